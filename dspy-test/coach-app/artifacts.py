@@ -0,0 +1,393 @@
+"""
+Optimized Module Artifacts and Startup Snapshots
+
+This module contains:
+- ArtifactError: Raised when an optimized artifact does not fit the current code
+- validate_artifact: Checks a saved module state against the module's predictors
+  and signature fields before it is applied
+- adapt_extractor_state: Turns the optimized InfoExtractor artifact into
+  IncrementalExtractor state
+- register_prefixes: Seeds the prompt_prefix cache with pre-rendered prefixes
+- load_optimized: Loads optimized/*.json through a binary snapshot cache
+- load_startup_modules: Startup path used by main.py
+
+Module.load() trusts the JSON: a signature that gained or lost a field since
+optimization silently shifts every instruction prefix by one. Here each
+artifact is validated once, then stored together with its pre-rendered
+prompt prefix (system message + demos) as a zlib-compressed pickle under
+.cache/snapshots. The snapshot key covers the artifact bytes, the current
+signature fields and the DSPy version, so any change falls back to the
+validated JSON path and writes a fresh snapshot. main.py extracts with
+IncrementalExtractor; until optimize.py has written its own artifact it
+starts from the InfoExtractor one, with conversation_history swapped for its
+own inputs. Snapshots are a local cache
+written by this app only; delete the directory to clear them.
+"""
+
+import copy
+import hashlib
+import json
+import os
+import pickle
+import zlib
+
+import dspy
+
+from prompt_prefix import PREFIX_CACHE, PrefixCachingAdapter, render_prefix
+
+
+OPTIMIZED_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "optimized")
+DEFAULT_SNAPSHOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "snapshots")
+
+# Artifacts written by optimize.py, by the module class they were optimized for
+ARTIFACT_FILES = {
+    "InfoExtractor": "extractor.json",
+    "IncrementalExtractor": "incremental_extractor.json",
+    "WorkoutGenerator": "generator.json",
+}
+
+
+class ArtifactError(ValueError):
+    """Raised when an optimized artifact does not match the current module."""
+
+
+# ============================================================================
+# VALIDATION
+# ============================================================================
+
+def signature_fingerprint(module):
+    """Predictor names with their signature field names and prefixes, for snapshot keys."""
+    return [
+        (name, [(field_name, field.json_schema_extra.get("prefix")) for field_name, field in predictor.signature.fields.items()])
+        for name, predictor in module.named_predictors()
+    ]
+
+
+def validate_artifact(module, state):
+    """
+    Check that a saved state can be applied to module without misalignment.
+
+    Args:
+        module: dspy.Module the state will be loaded into
+        state: Parsed artifact JSON (as written by Module.save)
+
+    Raises:
+        ArtifactError: On missing/extra predictors, changed signature fields or
+            demos carrying unknown fields
+    """
+    predictors = dict(module.named_predictors())
+    saved = {name: value for name, value in state.items() if name != "metadata"}
+    if set(saved) != set(predictors):
+        raise ArtifactError(
+            f"{type(module).__name__} has predictors {sorted(predictors)}, artifact has {sorted(saved)}"
+        )
+
+    for name, predictor in predictors.items():
+        fields = predictor.signature.fields
+        saved_fields = saved[name]["signature"]["fields"]
+        expected = [field.json_schema_extra.get("prefix") for field in fields.values()]
+        found = [field.get("prefix") for field in saved_fields]
+        if expected != found:
+            raise ArtifactError(f"{name}: signature fields changed (expected {expected}, artifact has {found})")
+
+        known = set(fields) | {"augmented"}
+        for demo in saved[name].get("demos", []):
+            unknown = set(demo) - known
+            if unknown:
+                raise ArtifactError(f"{name}: demo has fields not in the signature: {sorted(unknown)}")
+
+
+def adapt_extractor_state(module, state):
+    """
+    IncrementalExtractor state built from an optimized InfoExtractor artifact.
+
+    The optimized instructions (followed by UpdateUserInfo's), output field
+    prefixes and demos carry over. conversation_history is replaced by
+    known_info and new_messages; demos start with nothing known and see their
+    whole conversation as new messages, like a first ExtractionState request.
+
+    Args:
+        module: IncrementalExtractor the state will be loaded into
+        state: Parsed extractor.json
+
+    Returns:
+        dict: State in the layout Module.save writes for module
+    """
+    (name, predictor), = module.named_predictors()
+    saved = next(value for key, value in state.items() if key != "metadata")
+    inputs = [
+        {"prefix": field.json_schema_extra["prefix"], "description": field.json_schema_extra["desc"]}
+        for field in predictor.signature.input_fields.values()
+    ]
+    signature = {
+        **saved["signature"],
+        "instructions": f"{saved['signature']['instructions']}\n\n{predictor.signature.instructions}",
+        # conversation_history is the only input field of ExtractUserInfo
+        "fields": inputs + saved["signature"]["fields"][1:],
+    }
+    demos = []
+    for demo in saved.get("demos", []):
+        demo = dict(demo)
+        if "conversation_history" in demo:
+            demo["known_info"] = "{}"
+            demo["new_messages"] = demo.pop("conversation_history")
+        demos.append(demo)
+    return {name: {**saved, "signature": signature, "demos": demos}, "metadata": state.get("metadata", {})}
+
+
+# Fallbacks for modules without an artifact of their own: another module's
+# artifact, converted by the given function
+ADAPTED_ARTIFACTS = {
+    "IncrementalExtractor": ("extractor.json", adapt_extractor_state),
+}
+
+
+def apply_signature_state(signature, saved):
+    """
+    Signature with saved instructions, prefixes and descriptions applied.
+
+    Same result as Signature.load_state, but the signature is only rebuilt
+    when something differs, and then without deep-copying every field.
+    """
+    changed = {}
+    for (name, field), saved_field in zip(signature.fields.items(), saved["fields"]):
+        extra = field.json_schema_extra
+        if extra.get("prefix") != saved_field["prefix"] or extra.get("desc") != saved_field["description"]:
+            changed[name] = saved_field
+    if not changed and signature.instructions == saved["instructions"]:
+        return signature
+
+    fields = {}
+    for name, field in signature.fields.items():
+        if name in changed:
+            field = copy.copy(field)
+            field.json_schema_extra = {
+                **field.json_schema_extra,
+                "prefix": changed[name]["prefix"],
+                "desc": changed[name]["description"],
+            }
+        fields[name] = field
+    return dspy.Signature(fields, saved["instructions"])
+
+
+def apply_state(module, state):
+    """Apply a validated artifact state to module's predictors (Module.load_state equivalent)."""
+    for name, predictor in module.named_predictors():
+        saved = state[name]
+        if saved.get("lm"):
+            predictor.load_state(saved)
+            continue
+        for key, value in saved.items():
+            if key not in ("signature", "lm"):
+                setattr(predictor, key, value)
+        predictor.signature = apply_signature_state(predictor.signature, saved["signature"])
+        predictor.lm = None
+
+
+# ============================================================================
+# PRE-RENDERED PROMPTS
+# ============================================================================
+
+def register_prefixes(module, prefixes):
+    """Seed PREFIX_CACHE with prefixes rendered for the module's current predictor objects."""
+    for name, predictor in module.named_predictors():
+        if name in prefixes:
+            PREFIX_CACHE.put(predictor.signature, predictor.demos, prefixes[name])
+
+
+# ============================================================================
+# LOADING
+# ============================================================================
+
+def _snapshot_key(module, artifact_bytes, adapt=None):
+    material = json.dumps(
+        [type(module).__name__, signature_fingerprint(module), dspy.__version__, hashlib.sha256(artifact_bytes).hexdigest(),
+         adapt.__name__ if adapt else None],
+        default=str
+    )
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+def load_optimized(module, path, snapshot_dir=DEFAULT_SNAPSHOT_DIR, adapt=None):
+    """
+    Load an optimized artifact into module, preferring a validated snapshot.
+
+    Args:
+        module: Freshly constructed module matching the artifact
+        path: Path to the JSON written by Module.save
+        snapshot_dir: Where binary snapshots are cached (None to disable)
+        adapt: Optional function (module, state) -> state for artifacts written
+            for another module class (see ADAPTED_ARTIFACTS)
+
+    Returns:
+        str: "snapshot" or "json", depending on which path loaded the state
+
+    Raises:
+        ArtifactError: If the artifact does not match the module
+    """
+    with open(path, "rb") as f:
+        artifact_bytes = f.read()
+    key = _snapshot_key(module, artifact_bytes, adapt)
+    snapshot_path = os.path.join(snapshot_dir, f"{key}.snap") if snapshot_dir else None
+
+    if snapshot_path and os.path.exists(snapshot_path):
+        try:
+            with open(snapshot_path, "rb") as f:
+                snapshot = pickle.loads(zlib.decompress(f.read()))
+            apply_state(module, snapshot["state"])
+            register_prefixes(module, snapshot["prefixes"])
+            return "snapshot"
+        except (OSError, zlib.error, pickle.UnpicklingError, EOFError, KeyError):
+            pass  # Corrupt snapshot: rebuild it from the JSON below
+
+    state = json.loads(artifact_bytes)
+    if adapt:
+        state = adapt(module, state)
+    validate_artifact(module, state)
+    apply_state(module, state)
+
+    adapter = PrefixCachingAdapter()
+    prefixes = {
+        name: render_prefix(adapter, predictor.signature, predictor.demos)
+        for name, predictor in module.named_predictors()
+    }
+    register_prefixes(module, prefixes)
+
+    if snapshot_path:
+        os.makedirs(snapshot_dir, exist_ok=True)
+        tmp_path = f"{snapshot_path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(zlib.compress(pickle.dumps({"state": state, "prefixes": prefixes}, pickle.HIGHEST_PROTOCOL)))
+        os.replace(tmp_path, snapshot_path)
+    return "json"
+
+
+def artifact_source(module, optimized_dir=OPTIMIZED_DIR):
+    """
+    Artifact to load into module, preferring its own over an adapted one.
+
+    Args:
+        module: Constructed module
+        optimized_dir: Directory holding the optimize.py output
+
+    Returns:
+        tuple or None: (path, adapt function or None), None if there is no artifact
+    """
+    name = type(module).__name__
+    candidates = []
+    if name in ARTIFACT_FILES:
+        candidates.append((ARTIFACT_FILES[name], None))
+    if name in ADAPTED_ARTIFACTS:
+        candidates.append(ADAPTED_ARTIFACTS[name])
+    for filename, adapt in candidates:
+        path = os.path.join(optimized_dir, filename)
+        if os.path.exists(path):
+            return path, adapt
+    return None
+
+
+def load_startup_modules(*modules, optimized_dir=OPTIMIZED_DIR, snapshot_dir=DEFAULT_SNAPSHOT_DIR):
+    """
+    Load the optimized artifact for every module that has one.
+
+    IncrementalExtractor falls back to the InfoExtractor artifact through
+    adapt_extractor_state (see artifact_source). Modules without an artifact (e.g. CoachAgent) keep
+    their defaults; artifacts that fail validation are reported and skipped.
+
+    Args:
+        *modules: Constructed modules
+        optimized_dir: Directory holding the optimize.py output
+        snapshot_dir: Binary snapshot cache directory
+
+    Returns:
+        dict: Module class name -> "snapshot", "json", or an error message
+    """
+    loaded = {}
+    for module in modules:
+        name = type(module).__name__
+        source = artifact_source(module, optimized_dir)
+        if source is None:
+            continue
+        path, adapt = source
+        try:
+            loaded[name] = load_optimized(module, path, snapshot_dir, adapt)
+        except ArtifactError as e:
+            loaded[name] = f"skipped: {e}"
+    return loaded
+
+
+if __name__ == "__main__":
+    import statistics
+    import tempfile
+    import time
+
+    from modules import InfoExtractor, WorkoutGenerator
+    from sessions import build_generator_inputs
+    from stub_lm import StubLM
+
+    dspy.configure(lm=StubLM())
+    requirements = build_generator_inputs(dspy.Prediction(goal="hypertrophy", equipment="dumbbells",
+                                                          duration="45", focus="full_body"))
+    conversation = "[{'user': 'I want to build muscle with dumbbells, 45 minutes', 'coach': 'Any injuries?'}]"
+
+    def first_calls(extractor, generator, adapter):
+        with dspy.context(adapter=adapter):
+            start = time.perf_counter()
+            extractor(conversation_history=conversation)
+            generator(**requirements)
+            return time.perf_counter() - start
+
+    def module_load(extractor, generator):
+        extractor.load(os.path.join(OPTIMIZED_DIR, "extractor.json"))
+        generator.load(os.path.join(OPTIMIZED_DIR, "generator.json"))
+
+    def runs(setup, repeats=20):
+        load_times, call_times = [], []
+        for _ in range(repeats):
+            PREFIX_CACHE.clear()
+            start = time.perf_counter()
+            extractor, generator, adapter = setup()
+            load_times.append(time.perf_counter() - start)
+            call_times.append(first_calls(extractor, generator, adapter))
+        return statistics.median(load_times), statistics.median(call_times)
+
+    with tempfile.TemporaryDirectory() as snapshot_dir:
+        def json_setup():
+            extractor, generator = InfoExtractor(), WorkoutGenerator()
+            module_load(extractor, generator)
+            return extractor, generator, dspy.ChatAdapter()
+
+        def snapshot_setup():
+            extractor, generator = InfoExtractor(), WorkoutGenerator()
+            load_startup_modules(extractor, generator, snapshot_dir=snapshot_dir)
+            return extractor, generator, PrefixCachingAdapter()
+
+        # Identical prompts either way
+        reference, candidate = json_setup(), snapshot_setup()
+        lm = dspy.settings.lm
+        first_calls(*reference)
+        reference_messages = [entry["messages"] for entry in lm.history[-2:]]
+        first_calls(*candidate)
+        assert [entry["messages"] for entry in lm.history[-2:]] == reference_messages, "prompts differ"
+
+        print("=" * 60)
+        print("STARTUP: InfoExtractor + WorkoutGenerator (median of 20, StubLM)")
+        print("=" * 60)
+        json_load, json_call = runs(json_setup)
+        snapshot_load, snapshot_call = runs(snapshot_setup)
+        print(f"Module.load JSON:  load {json_load * 1000:6.2f}ms | first calls {json_call * 1000:6.2f}ms")
+        print(f"Snapshot:          load {snapshot_load * 1000:6.2f}ms | first calls {snapshot_call * 1000:6.2f}ms")
+        print(f"Startup to first responses: {(json_load + json_call) * 1000:.2f}ms -> "
+              f"{(snapshot_load + snapshot_call) * 1000:.2f}ms")
+        sizes = [os.path.getsize(os.path.join(snapshot_dir, name)) for name in os.listdir(snapshot_dir)]
+        print(f"Snapshot files: {len(sizes)}, {sum(sizes)} bytes total")
+
+        # A signature change is caught instead of silently misaligning prefixes
+        class RenamedGenerator(WorkoutGenerator):
+            def __init__(self):
+                super().__init__()
+                self.generate = dspy.ChainOfThought(self.generate.predict.signature.delete("space"))
+        try:
+            load_optimized(RenamedGenerator(), os.path.join(OPTIMIZED_DIR, "generator.json"), snapshot_dir)
+        except ArtifactError as e:
+            print(f"Validation: {e}")
@@ -0,0 +1,295 @@
+"""
+Vectorized Batch Metrics for Offline Evaluation
+
+This module contains batch versions of the metrics in metrics.py:
+- batch_extraction_accuracy: Field comparisons over the predictions' stored
+  values, counted in NumPy
+- batch_workout_quality: Sets and exercises of Pydantic workouts flattened into
+  columnar arrays, with rep-range, exercise-count and structure checks done in
+  NumPy and the equipment check looked up once per distinct exercise name
+
+Both return exactly the scores of the scalar functions. Only Pydantic Workout
+predictions (what WorkoutGenerator returns) are flattened: dict and JSON
+workouts, and any odd LM output, go through workout_quality itself, which is
+faster for them than flattening dicts in Python. Batches smaller than
+SCALAR_BATCH_SIZE use the scalar functions too, since array setup costs more
+than it saves there. Running this file checks equality on randomized inputs
+and reports throughput against the scalar functions.
+"""
+
+import operator
+
+import numpy as np
+
+from exercise_catalog import uses_allowed_equipment
+from metrics import extraction_accuracy, workout_quality
+
+
+EXTRACTION_SCORED_FIELDS = ("fitness_level", "goal", "focus", "equipment", "duration", "space", "injuries")
+
+# Below this many pairs the scalar loop is faster than building arrays
+SCALAR_BATCH_SIZE = 32
+
+# Goal codes for rep-range checks
+GOAL_CODES = {"strength": 1, "power": 1, "hypertrophy": 2, "endurance": 3}
+
+# Equipment codes for the restricted equipment values (0 = not checked)
+EQUIPMENT_CODES = {"bodyweight": 1, "dumbbells": 2, "barbell": 3}
+
+# Reps can be arbitrarily large ints; clamp to stay in int64
+MAX_REPS = 10 ** 9
+
+
+def batch_extraction_accuracy(examples, predictions):
+    """
+    Vectorized extraction_accuracy over many (example, prediction) pairs.
+
+    Field values are read from each Example's store rather than through
+    attribute access, which dominates the scalar function's cost.
+
+    Args:
+        examples: List of dspy.Example with expected extraction results
+        predictions: List of InfoExtractor predictions, aligned with examples
+
+    Returns:
+        np.ndarray: Scores between 0.0 and 1.0, one per pair
+    """
+    if len(examples) < SCALAR_BATCH_SIZE:
+        return np.array([extraction_accuracy(e, p) for e, p in zip(examples, predictions)], dtype=np.float64)
+    expected = [example._store for example in examples]
+    predicted = [prediction._store for prediction in predictions]
+    matches = np.zeros(len(examples), dtype=np.int64)
+    for name in EXTRACTION_SCORED_FIELDS:
+        value = operator.itemgetter(name)
+        matches += np.fromiter(map(operator.eq, map(value, expected), map(value, predicted)), bool, len(examples))
+    return matches / len(EXTRACTION_SCORED_FIELDS)
+
+
+# ============================================================================
+# FLATTENING
+# ============================================================================
+
+class _Columns:
+    """Columnar storage for the exercises and sets of many Pydantic workouts."""
+    def __init__(self):
+        self.exercise_workout = []
+        self.exercise_names = []
+        self.exercise_valid = []
+        self.set_workout = []
+        self.set_reps = []
+
+    def add_model(self, row, workout):
+        # Read attributes directly instead of model_dump()
+        for exercise in workout.exercises:
+            self.exercise_workout.append(row)
+            self.exercise_names.append(exercise.name.lower())
+            self.exercise_valid.append(len(exercise.sets) > 0)
+            for workout_set in exercise.sets:
+                self.set_workout.append(row)
+                self.set_reps.append(max(-MAX_REPS, min(MAX_REPS, workout_set.reps)))
+
+
+def _any_per_row(flags, rows, num_rows):
+    """For each row, whether any flagged element belongs to it."""
+    return np.bincount(rows[flags], minlength=num_rows) > 0
+
+
+# ============================================================================
+# BATCH WORKOUT QUALITY
+# ============================================================================
+
+def batch_workout_quality(examples, predictions):
+    """
+    Vectorized workout_quality over many (example, prediction) pairs.
+
+    Args:
+        examples: List of dspy.Example with goal, equipment and duration
+        predictions: List of WorkoutGenerator predictions, aligned with examples
+
+    Returns:
+        np.ndarray: Scores between 0.0 and 1.0, one per pair
+    """
+    num_rows = len(examples)
+    if num_rows < SCALAR_BATCH_SIZE:
+        return np.array([workout_quality(e, p) for e, p in zip(examples, predictions)], dtype=np.float64)
+
+    has_exercises = np.zeros(num_rows, dtype=bool)
+    scalar_rows = []
+    columns = _Columns()
+
+    for row, prediction in enumerate(predictions):
+        workout = getattr(prediction, "workout", None)
+        if hasattr(workout, "model_dump") and hasattr(workout, "exercises"):
+            columns.add_model(row, workout)
+            has_exercises[row] = True
+        else:
+            scalar_rows.append(row)
+    if len(scalar_rows) == num_rows:
+        return np.array([workout_quality(e, p) for e, p in zip(examples, predictions)], dtype=np.float64)
+
+    exercise_rows = np.array(columns.exercise_workout, dtype=np.int64)
+    set_rows = np.array(columns.set_workout, dtype=np.int64)
+    reps = np.array(columns.set_reps, dtype=np.int64)
+    names = np.array(columns.exercise_names, dtype=str)
+
+    # Per-row requirements
+    goals = np.array([GOAL_CODES.get(example.goal.lower(), 0) for example in examples], dtype=np.int8)
+    equipment = np.array(
+        [EQUIPMENT_CODES.get(example.equipment.lower(), 0) for example in examples], dtype=np.int8
+    )
+    durations = np.array(
+        [int(example.duration) if example.duration.isdigit() else 45 for example in examples], dtype=np.int64
+    )
+
+    # 2. Exercise count vs duration
+    num_exercises = np.bincount(exercise_rows, minlength=num_rows)
+    expected = durations // 10
+    in_range = (expected * 0.5 <= num_exercises) & (num_exercises <= expected * 1.5)
+    count_points = np.where(num_exercises > 0, np.where(in_range, 1.0, 0.5), 0.0)
+
+    # 3. Exercise structure
+    invalid = ~np.array(columns.exercise_valid, dtype=bool)
+    structure_points = np.where(_any_per_row(invalid, exercise_rows, num_rows), 0.0, 1.0)
+
+    # 4. Rep ranges vs goal
+    set_goals = goals[set_rows]
+    rep_violation = (
+        ((set_goals == 1) & (reps > 6))
+        | ((set_goals == 2) & ((reps < 6) | (reps > 15)))
+        | ((set_goals == 3) & (reps < 12))
+    )
+    rep_points = np.where(
+        _any_per_row(rep_violation, set_rows, num_rows),
+        np.where(num_exercises > 0, 0.5, 0.0),
+        1.0
+    )
+
+    # 5. Equipment, via a (distinct name x equipment code) table from the exercise catalog
+    unique_names, name_codes = np.unique(names, return_inverse=True)
+    allowed = np.ones((len(unique_names), len(EQUIPMENT_CODES) + 1), dtype=bool)
+    for name_code, name in enumerate(unique_names.tolist()):
+        for equipment_name, code in EQUIPMENT_CODES.items():
+            allowed[name_code, code] = uses_allowed_equipment(name, equipment_name)
+    equipment_violation = ~allowed[name_codes.reshape(-1), equipment[exercise_rows]]
+    equipment_points = np.where(
+        _any_per_row(equipment_violation, exercise_rows, num_rows),
+        np.where(num_exercises > 0, 0.5, 0.0),
+        1.0
+    )
+
+    total = 1.0 + count_points + structure_points + rep_points + equipment_points
+    scores = np.where(has_exercises, total / 5.0, 0.0)
+
+    for row in scalar_rows:
+        scores[row] = workout_quality(examples[row], predictions[row])
+    return scores
+
+
+# ============================================================================
+# PROPERTY CHECK AND BENCHMARK
+# ============================================================================
+
+def _random_workout_case(rng):
+    """Random (example, prediction) pair covering regular and odd shapes."""
+    import json
+
+    import dspy
+    from modules import Workout
+
+    example = dspy.Example(
+        goal=rng.choice(["strength", "Hypertrophy", "endurance", "power", "general"]),
+        equipment=rng.choice(["bodyweight", "dumbbells", "barbell", "cables", "machines"]),
+        duration=rng.choice(["30", "45", "60", "90", "abc", "20"]),
+    )
+    names = ["Dumbbell Press", "Barbell Squat", "Cable Row", "Machine Fly", "Push-ups", "Goblet Squat",
+             "Bench Press", "Lat Pulldown", "Underwater Basket Weaving", "Incline DB Press"]
+
+    def random_set():
+        reps = rng.choice([rng.randint(0, 25), str(rng.randint(1, 20)), "8-10", "max", 7.5, True])
+        workout_set = {"reps": reps, "setType": "working"}
+        if rng.random() < 0.05:
+            del workout_set["reps"]
+        return workout_set
+
+    exercises = []
+    for _ in range(rng.randint(0, 9)):
+        exercise = {"name": rng.choice(names), "sets": [random_set() for _ in range(rng.randint(0, 5))]}
+        if rng.random() < 0.05:
+            del exercise["name"]
+        if rng.random() < 0.03:
+            exercise = "not an exercise"
+        exercises.append(exercise)
+
+    kind = rng.random()
+    if kind < 0.3:
+        clean = [
+            {"name": e["name"], "sets": [{"reps": int(rng.randint(1, 20)), "setType": "working"}
+                                         for _ in e["sets"]] or [{"reps": 10, "setType": "working"}]}
+            for e in exercises if isinstance(e, dict) and "name" in e
+        ]
+        workout = Workout.model_validate({"exercises": clean})
+    elif kind < 0.6:
+        workout = {"exercises": exercises}
+    elif kind < 0.9:
+        text = json.dumps({"exercises": exercises})
+        workout = f"```json\n{text}\n```" if rng.random() < 0.5 else text
+    else:
+        workout = rng.choice(["not json", "{}", '{"exercises": "none"}', "[]"])
+    return example, dspy.Prediction(workout=workout)
+
+
+if __name__ == "__main__":
+    import random
+    import time
+
+    import dspy
+    from metrics import extraction_accuracy
+    from stub_lm import DEFAULT_WORKOUT
+    from modules import Workout
+
+    rng = random.Random(0)
+
+    # Property check: batch scores must equal the scalar scores exactly
+    cases = [_random_workout_case(rng) for _ in range(5000)]
+    examples = [example for example, _ in cases]
+    predictions = [prediction for _, prediction in cases]
+    scalar = [workout_quality(e, p) for e, p in cases]
+    batch = batch_workout_quality(examples, predictions)
+    assert list(batch) == scalar, "batch_workout_quality differs from workout_quality"
+
+    fields = {"fitness_level": ["beginner", "advanced"], "goal": ["strength", "general"],
+              "focus": ["legs", "back"], "equipment": ["barbell", "bands"], "duration": ["45", "60"],
+              "space": ["gym", "home"], "injuries": ["none", "knee"]}
+    extraction_examples = [dspy.Example(**{k: rng.choice(v) for k, v in fields.items()}) for _ in range(5000)]
+    extraction_predictions = [dspy.Prediction(**{k: rng.choice(v) for k, v in fields.items()}) for _ in range(5000)]
+    scalar_accuracy = [extraction_accuracy(e, p) for e, p in zip(extraction_examples, extraction_predictions)]
+    assert list(batch_extraction_accuracy(extraction_examples, extraction_predictions)) == scalar_accuracy
+    print("Property check passed: batch scores identical on 5000 random cases per metric")
+
+    def throughput(label, scalar_metric, batch_metric, examples, predictions, repeats=5):
+        """Best-of-repeats pairs/s of the scalar loop and the batch function."""
+        scalar_seconds = batch_seconds = float("inf")
+        for _ in range(repeats):
+            start = time.perf_counter()
+            for e, p in zip(examples, predictions):
+                scalar_metric(e, p)
+            scalar_seconds = min(scalar_seconds, time.perf_counter() - start)
+            start = time.perf_counter()
+            batch_metric(examples, predictions)
+            batch_seconds = min(batch_seconds, time.perf_counter() - start)
+        count = len(examples)
+        print(f"{label:<40} scalar {count / scalar_seconds:>9,.0f}/s | batch {count / batch_seconds:>9,.0f}/s "
+              f"({scalar_seconds / batch_seconds:.1f}x)")
+
+    # Throughput on generated workouts
+    example = dspy.Example(goal="hypertrophy", equipment="dumbbells", duration="45")
+    workout = Workout.model_validate(DEFAULT_WORKOUT)
+    for label, prediction in (("Pydantic", dspy.Prediction(workout=workout)),
+                              ("dict", dspy.Prediction(workout=workout.model_dump()))):
+        for count in (20000, 8):
+            throughput(f"workout_quality ({label}, {count} workouts)", workout_quality, batch_workout_quality,
+                       [example] * count, [prediction] * count)
+
+    for count in (5000, 8):
+        throughput(f"extraction_accuracy ({count} pairs)", extraction_accuracy, batch_extraction_accuracy,
+                   extraction_examples[:count], extraction_predictions[:count])
@@ -0,0 +1,519 @@
+"""
+End-to-End Benchmark Suite for the Coach Pipeline
+
+This module contains:
+- build_scripts: Scripted conversations from training_data.extractor_examples
+- script_lm: StubLM that plays each script's coach replies and extraction labels
+- StageProfiler: dspy callback that attributes LM time, prompt formatting,
+  completion parsing, output validation and tokens to pipeline stages
+- run_level: Drives the conversations through CoachAgent -> InfoExtractor ->
+  WorkoutGenerator at one concurrency level
+- compare_reports: Flags regressions against an earlier JSON report
+
+Each conversation replays the user messages of one training example; the
+coach answers with the recorded coach replies and sets should_extract on
+the last turn, InfoExtractor returns the example's labels and
+WorkoutGenerator the default workout. Per stage the report gives latency
+percentiles, prompt/completion tokens (about 4 characters per token, as in
+stub_lm.py) and the Python-side time per call: adapter formatting, parsing,
+validation of typed outputs (e.g. the Pydantic Workout) and the remaining
+module overhead. Every level is run a second time under tracemalloc for the
+memory peak, so tracing does not skew the timings.
+
+Usage:
+    python benchmark.py [--latency 0.05] [--jitter 0.02] [--concurrency 1,4,16]
+                        [--conversations 36] [--adapter prefix|chat]
+                        [--output PATH] [--baseline PATH]
+
+Running it prints a summary table and writes the JSON report (default
+../eval-logs/benchmark.json). With --baseline, throughput and per-stage p50
+are compared with an earlier report and the exit status is 1 if any got
+worse by more than --tolerance.
+"""
+
+import argparse
+import ast
+import asyncio
+import contextvars
+import datetime
+import json
+import os
+import platform
+import re
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+
+import dspy
+from dspy.adapters import chat_adapter
+from dspy.utils.callback import BaseCallback
+
+from evaluation import DEFAULT_REPORT_DIR
+from modules import CoachAgent, InfoExtractor, WorkoutGenerator
+from prompt_prefix import PrefixCache, PrefixCachingAdapter
+from sessions import build_generator_inputs, find_missing_fields, percentile
+from stub_lm import StubLM
+from token_estimate import estimate_tokens
+from training_data import extractor_examples
+
+
+STAGES = ("coach", "extractor", "generator")
+EXTRACTION_LABELS = (
+    "fitness_level", "goal", "focus", "equipment", "duration", "space", "injuries", "primary_lift_pr",
+)
+
+# Stage of the module call running in the current task
+CURRENT_STAGE = contextvars.ContextVar("benchmark_stage", default=None)
+
+
+# ============================================================================
+# SCRIPTED CONVERSATIONS
+# ============================================================================
+
+@dataclass
+class Script:
+    """User messages, coach replies and extraction labels of one conversation"""
+    turns: list
+    labels: dict
+
+
+def build_scripts(examples=extractor_examples):
+    """
+    Turn InfoExtractor training examples into scripted conversations.
+
+    Args:
+        examples: dspy.Examples whose conversation_history is a str() of
+            [{"user": ..., "coach": ...}, ...]
+
+    Returns:
+        list: One Script per example
+    """
+    return [
+        Script(
+            turns=[(turn["user"], turn["coach"]) for turn in ast.literal_eval(example.conversation_history)],
+            labels={name: example[name] for name in EXTRACTION_LABELS},
+        )
+        for example in examples
+    ]
+
+
+def _input_field(messages, name):
+    content = messages[-1]["content"]
+    match = re.search(
+        rf"\[\[ ## {name} ## \]\]\n(.*?)(?=\n\n\[\[ ## |\n\nRespond with|\Z)", content, re.DOTALL
+    )
+    return match.group(1) if match else None
+
+
+def script_lm(scripts, latency=0.05, jitter=0.02, seed=0):
+    """
+    StubLM that follows the scripts.
+
+    The coach reply is looked up by (conversation_history, user_message),
+    extraction labels by the final conversation history.
+
+    Args:
+        scripts: Scripts from build_scripts
+        latency: Seconds per call
+        jitter: Uniform +/- jitter in seconds
+        seed: Seed for the jitter
+
+    Returns:
+        StubLM: Configured stub
+    """
+    replies, labels = {}, {}
+    for script in scripts:
+        history = []
+        for index, (user, coach) in enumerate(script.turns):
+            replies[(str(history), user)] = (coach, index == len(script.turns) - 1)
+            history.append({"user": user, "coach": coach})
+        labels[str(history)] = script.labels
+
+    def reply(messages):
+        return replies[(_input_field(messages, "conversation_history"), _input_field(messages, "user_message"))]
+
+    def label(messages, name):
+        return labels[_input_field(messages, "conversation_history")][name]
+
+    return StubLM(latency=latency, jitter=jitter, seed=seed, responses={
+        "response": lambda messages: reply(messages)[0],
+        "should_extract": lambda messages: "true" if reply(messages)[1] else "false",
+        **{name: (lambda messages, name=name: label(messages, name)) for name in EXTRACTION_LABELS},
+    })
+
+
+# ============================================================================
+# PROFILING
+# ============================================================================
+
+@dataclass
+class StageStats:
+    """Measurements for one pipeline stage"""
+    latencies: list = field(default_factory=list)
+    lm_calls: int = 0
+    lm_seconds: float = 0.0
+    format_seconds: float = 0.0
+    parse_seconds: float = 0.0
+    validate_seconds: float = 0.0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+
+    def summary(self):
+        """Per-call averages and latency percentiles, in milliseconds and tokens."""
+        calls = len(self.latencies) or 1
+        other = sum(self.latencies) - self.lm_seconds - self.format_seconds - self.parse_seconds
+        return {
+            "calls": len(self.latencies),
+            "lm_calls": self.lm_calls,
+            "p50_ms": percentile(self.latencies, 50) * 1000,
+            "p90_ms": percentile(self.latencies, 90) * 1000,
+            "p99_ms": percentile(self.latencies, 99) * 1000,
+            "prompt_tokens": self.prompt_tokens / calls,
+            "completion_tokens": self.completion_tokens / calls,
+            "lm_ms": self.lm_seconds / calls * 1000,
+            "format_ms": self.format_seconds / calls * 1000,
+            "parse_ms": (self.parse_seconds - self.validate_seconds) / calls * 1000,
+            "validate_ms": self.validate_seconds / calls * 1000,
+            "other_ms": max(0.0, other) / calls * 1000,
+        }
+
+
+class StageProfiler(BaseCallback):
+    """
+    dspy callback that charges LM, format and parse time to CURRENT_STAGE.
+
+    dspy reports calls of LMs that are not dspy.LM (StubLM, CachedLM, ...)
+    as module calls, so those are picked out by type. dspy also wraps
+    format()/parse() once per adapter class in the hierarchy; nested
+    callbacks of the same kind are skipped to avoid counting twice.
+    Validation time is measured by profiling() around dspy's parse_value.
+    """
+    def __init__(self):
+        self.stages = defaultdict(StageStats)
+        self._open = {}
+        self._active = contextvars.ContextVar("profiler_active", default=frozenset())
+
+    def _start(self, kind, call_id):
+        active = self._active.get()
+        if kind in active:
+            return
+        self._active.set(active | {kind})
+        self._open[call_id] = (kind, CURRENT_STAGE.get(), time.perf_counter())
+
+    def _end(self, call_id):
+        opened = self._open.pop(call_id, None)
+        if opened is None:
+            return None, 0.0
+        kind, stage, start = opened
+        self._active.set(self._active.get() - {kind})
+        return stage, time.perf_counter() - start
+
+    def on_lm_start(self, call_id, instance, inputs):
+        self._start("lm", call_id)
+        stage = CURRENT_STAGE.get()
+        if stage and call_id in self._open:
+            messages = inputs.get("messages") or [{"content": inputs.get("prompt") or ""}]
+            self.stages[stage].prompt_tokens += sum(estimate_tokens(str(m["content"])) for m in messages)
+
+    def on_lm_end(self, call_id, outputs, exception=None):
+        stage, elapsed = self._end(call_id)
+        if stage:
+            self.stages[stage].lm_calls += 1
+            self.stages[stage].lm_seconds += elapsed
+            self.stages[stage].completion_tokens += sum(
+                estimate_tokens(output if isinstance(output, str) else str(output.get("text", "")))
+                for output in outputs or []
+            )
+
+    def on_module_start(self, call_id, instance, inputs):
+        if isinstance(instance, dspy.BaseLM):
+            self.on_lm_start(call_id, instance, inputs)
+
+    def on_module_end(self, call_id, outputs, exception=None):
+        if call_id in self._open:
+            self.on_lm_end(call_id, outputs, exception)
+
+    def on_adapter_format_start(self, call_id, instance, inputs):
+        self._start("format", call_id)
+
+    def on_adapter_format_end(self, call_id, outputs, exception=None):
+        stage, elapsed = self._end(call_id)
+        if stage:
+            self.stages[stage].format_seconds += elapsed
+
+    def on_adapter_parse_start(self, call_id, instance, inputs):
+        self._start("parse", call_id)
+
+    def on_adapter_parse_end(self, call_id, outputs, exception=None):
+        stage, elapsed = self._end(call_id)
+        if stage:
+            self.stages[stage].parse_seconds += elapsed
+
+
+@contextmanager
+def profiling(profiler):
+    """Install the profiler callback and time dspy's typed output validation."""
+    parse_value = chat_adapter.parse_value
+
+    def timed_parse_value(value, annotation):
+        start = time.perf_counter()
+        try:
+            return parse_value(value, annotation)
+        finally:
+            stage = CURRENT_STAGE.get()
+            if stage:
+                profiler.stages[stage].validate_seconds += time.perf_counter() - start
+
+    chat_adapter.parse_value = timed_parse_value
+    try:
+        with dspy.context(callbacks=[profiler]):
+            yield profiler
+    finally:
+        chat_adapter.parse_value = parse_value
+
+
+async def _stage_call(profiler, stage, module, **kwargs):
+    token = CURRENT_STAGE.set(stage)
+    start = time.perf_counter()
+    try:
+        return await module.acall(**kwargs)
+    finally:
+        profiler.stages[stage].latencies.append(time.perf_counter() - start)
+        CURRENT_STAGE.reset(token)
+
+
+# ============================================================================
+# DRIVER
+# ============================================================================
+
+async def run_conversation(script, modules, profiler):
+    """
+    Play one scripted conversation through the three modules.
+
+    Args:
+        script: Script to play
+        modules: (coach, extractor, generator)
+        profiler: StageProfiler collecting the measurements
+
+    Returns:
+        bool: True if a workout was generated
+    """
+    coach, extractor, generator = modules
+    history = []
+    for user, _ in script.turns:
+        result = await _stage_call(
+            profiler, "coach", coach, conversation_history=str(history), user_message=user
+        )
+        history.append({"user": user, "coach": result.response})
+        if result.should_extract.lower() != "true":
+            continue
+        extracted = await _stage_call(profiler, "extractor", extractor, conversation_history=str(history))
+        if find_missing_fields(extracted):
+            continue
+        await _stage_call(profiler, "generator", generator, **build_generator_inputs(extracted))
+        return True
+    return False
+
+
+async def _drive(scripts, modules, profiler, concurrency):
+    slots = asyncio.Semaphore(concurrency)
+
+    async def run(script):
+        async with slots:
+            return await run_conversation(script, modules, profiler)
+
+    return await asyncio.gather(*(run(script) for script in scripts))
+
+
+def run_level(scripts, lm, adapter, concurrency, trace_memory=True):
+    """
+    Run all conversations at one concurrency level.
+
+    Args:
+        scripts: Conversations to play (each runs once)
+        lm: LM to use, usually from script_lm
+        adapter: dspy adapter to format and parse with
+        concurrency: Conversations in flight at once
+        trace_memory: Also measure the Python memory peak in a second pass
+
+    Returns:
+        dict: Throughput, memory peak and per-stage summaries
+    """
+    modules = (CoachAgent(), InfoExtractor(), WorkoutGenerator())
+    with dspy.context(lm=lm, adapter=adapter):
+        # Warm-up: import-time work and first-use caches are not part of the measurement
+        with profiling(StageProfiler()) as warmup:
+            asyncio.run(_drive(scripts[:1], modules, warmup, 1))
+
+        profiler = StageProfiler()
+        with profiling(profiler):
+            start = time.perf_counter()
+            completed = asyncio.run(_drive(scripts, modules, profiler, concurrency))
+            wall = time.perf_counter() - start
+
+        peak = None
+        if trace_memory:
+            tracemalloc.start()
+            with profiling(StageProfiler()) as traced:
+                asyncio.run(_drive(scripts, modules, traced, concurrency))
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+    lm_calls = sum(stats.lm_calls for stats in profiler.stages.values())
+    return {
+        "concurrency": concurrency,
+        "conversations": len(scripts),
+        "workouts": sum(completed),
+        "wall_seconds": wall,
+        "conversations_per_sec": len(scripts) / wall if wall else 0.0,
+        "lm_calls_per_sec": lm_calls / wall if wall else 0.0,
+        "peak_memory_mib": peak / 2**20 if peak is not None else None,
+        "stages": {stage: profiler.stages[stage].summary() for stage in STAGES if stage in profiler.stages},
+    }
+
+
+def run_benchmark(latency=0.05, jitter=0.02, concurrency=(1, 4, 16), conversations=36, adapter="prefix",
+                  trace_memory=True):
+    """
+    Run every concurrency level and assemble the JSON report.
+
+    Args:
+        latency: Stub LM seconds per call
+        jitter: Stub LM +/- jitter in seconds
+        concurrency: Concurrency levels to run
+        conversations: Conversations per level (training examples repeated as needed)
+        adapter: "prefix" (PrefixCachingAdapter, as main.py) or "chat" (dspy.ChatAdapter)
+        trace_memory: Measure the memory peak of every level
+
+    Returns:
+        dict: The report
+    """
+    base = build_scripts()
+    scripts = [base[i % len(base)] for i in range(conversations)]
+    levels = []
+    for level in concurrency:
+        lm = script_lm(base, latency=latency, jitter=jitter)
+        formatter = PrefixCachingAdapter(cache=PrefixCache()) if adapter == "prefix" else dspy.ChatAdapter()
+        levels.append(run_level(scripts, lm, formatter, level, trace_memory=trace_memory))
+    return {
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "config": {
+            "latency": latency,
+            "jitter": jitter,
+            "conversations": conversations,
+            "adapter": adapter,
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "dspy": dspy.__version__,
+            "platform": platform.platform(),
+        },
+        "levels": levels,
+    }
+
+
+# ============================================================================
+# REPORTING
+# ============================================================================
+
+def print_report(report):
+    """Print throughput and per-stage measurements for every level."""
+    config = report["config"]
+    print("=" * 60)
+    print(f"COACH PIPELINE BENCHMARK (StubLM, {config['latency'] * 1000:.0f}ms +/- "
+          f"{config['jitter'] * 1000:.0f}ms, {config['adapter']} adapter)")
+    print("=" * 60)
+    for level in report["levels"]:
+        memory = f"{level['peak_memory_mib']:.1f} MiB peak" if level["peak_memory_mib"] is not None else ""
+        print(f"\nConcurrency {level['concurrency']}: {level['conversations']} conversations in "
+              f"{level['wall_seconds']:.2f}s, {level['conversations_per_sec']:.1f} conv/s, "
+              f"{level['lm_calls_per_sec']:.1f} LM calls/s {memory}")
+        print(f"{'Stage':<10} | {'p50':>7} | {'p90':>7} | {'p99':>7} | {'Prompt':>6} | {'Compl':>5} | "
+              f"{'Format':>6} | {'Parse':>6} | {'Valid':>6} | {'Other':>6}")
+        for stage, stats in level["stages"].items():
+            print(f"{stage:<10} | {stats['p50_ms']:5.1f}ms | {stats['p90_ms']:5.1f}ms | {stats['p99_ms']:5.1f}ms | "
+                  f"{stats['prompt_tokens']:>6.0f} | {stats['completion_tokens']:>5.0f} | "
+                  f"{stats['format_ms']:4.2f}ms | {stats['parse_ms']:4.2f}ms | {stats['validate_ms']:4.2f}ms | "
+                  f"{stats['other_ms']:4.2f}ms")
+
+
+def compare_reports(baseline, report, tolerance=0.1):
+    """
+    Compare a report with an earlier one at matching concurrency levels.
+
+    Args:
+        baseline: Earlier report
+        report: New report
+        tolerance: Relative slowdown accepted before a metric counts as a regression
+
+    Returns:
+        list: Descriptions of the regressions found
+    """
+    regressions = []
+    previous = {level["concurrency"]: level for level in baseline["levels"]}
+    for level in report["levels"]:
+        old = previous.get(level["concurrency"])
+        if old is None:
+            continue
+        checks = [("conversations/sec", old["conversations_per_sec"], level["conversations_per_sec"], True)]
+        for stage, stats in level["stages"].items():
+            if stage in old["stages"]:
+                checks.append((f"{stage} p50", old["stages"][stage]["p50_ms"], stats["p50_ms"], False))
+        for name, before, after, higher_is_better in checks:
+            if not before:
+                continue
+            change = (after - before) / before
+            worse = -change if higher_is_better else change
+            flag = "REGRESSION" if worse > tolerance else ""
+            print(f"  concurrency {level['concurrency']:>3} {name:<18} {before:9.2f} -> {after:9.2f} "
+                  f"({change:+.0%}) {flag}")
+            if flag:
+                regressions.append(f"concurrency {level['concurrency']} {name}: {change:+.0%}")
+    return regressions
+
+
+def main(argv=None):
+    """Command-line entry point"""
+    parser = argparse.ArgumentParser(description="End-to-end benchmark of the coach pipeline")
+    parser.add_argument("--latency", type=float, default=0.05, help="stub LM seconds per call")
+    parser.add_argument("--jitter", type=float, default=0.02, help="stub LM +/- jitter in seconds")
+    parser.add_argument("--concurrency", default="1,4,16", help="comma-separated concurrency levels")
+    parser.add_argument("--conversations", type=int, default=36, help="conversations per level")
+    parser.add_argument("--adapter", choices=("prefix", "chat"), default="prefix")
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc pass")
+    parser.add_argument("--output", default=os.path.join(DEFAULT_REPORT_DIR, "benchmark.json"))
+    parser.add_argument("--baseline", help="earlier report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="accepted relative slowdown")
+    args = parser.parse_args(argv)
+
+    report = run_benchmark(
+        latency=args.latency,
+        jitter=args.jitter,
+        concurrency=[int(level) for level in args.concurrency.split(",")],
+        conversations=args.conversations,
+        adapter=args.adapter,
+        trace_memory=not args.no_memory,
+    )
+    print_report(report)
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nReport saved to: {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print(f"\nComparison with {args.baseline}:")
+        regressions = compare_reports(baseline, report, args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) beyond {args.tolerance:.0%}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,193 @@
+"""
+Parallel Evaluation Harness
+
+This module compares module variants (e.g. original vs optimized) on one or
+more dataset splits:
+- Inputs come from each Example's with_inputs(...) keys, so any module works
+- Every (split, example, variant) prediction runs on a thread pool; calls
+  share whatever rate limiter the configured LM uses
+- The JSON report has per-example scores, per-call latency and token counts,
+  and per-variant aggregates plus total wall-clock time
+
+Running this file evaluates both modules against the local StubLM.
+"""
+
+import contextvars
+import datetime
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import dspy
+
+from sessions import percentile
+
+
+DEFAULT_REPORT_DIR = os.path.join("..", "eval-logs")
+
+
+def make_splits(examples, holdout_fraction=0.25, seed=0):
+    """
+    Split examples into a training set and a held-out set.
+
+    Args:
+        examples: List of dspy.Example
+        holdout_fraction: Share of examples to hold out
+        seed: Shuffle seed so splits are reproducible
+
+    Returns:
+        dict: {"train": [...], "holdout": [...]}
+    """
+    import random
+
+    shuffled = list(examples)
+    random.Random(seed).shuffle(shuffled)
+    cut = max(1, int(round(len(shuffled) * holdout_fraction))) if holdout_fraction else 0
+    return {"train": shuffled[cut:], "holdout": shuffled[:cut]}
+
+
+def _usage_totals(prediction):
+    usage = prediction.get_lm_usage() or {}
+    prompt_tokens = sum(u.get("prompt_tokens", 0) or 0 for u in usage.values())
+    completion_tokens = sum(u.get("completion_tokens", 0) or 0 for u in usage.values())
+    return prompt_tokens, completion_tokens
+
+
+def _run_one(module, example, metric):
+    """Predict and score one example, capturing latency, tokens and errors."""
+    start = time.perf_counter()
+    try:
+        with dspy.context(track_usage=True):
+            prediction = module(**example.inputs().toDict())
+        latency = time.perf_counter() - start
+        prompt_tokens, completion_tokens = _usage_totals(prediction)
+        return {
+            "score": float(metric(example, prediction)),
+            "latency": latency,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "error": None,
+        }
+    except Exception as e:
+        return {
+            "score": 0.0,
+            "latency": time.perf_counter() - start,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "error": f"{type(e).__name__}: {e}",
+        }
+
+
+def _aggregate(results):
+    latencies = [r["latency"] for r in results]
+    return {
+        "count": len(results),
+        "mean_score": sum(r["score"] for r in results) / len(results) if results else 0.0,
+        "errors": sum(1 for r in results if r["error"]),
+        "mean_latency": sum(latencies) / len(latencies) if latencies else 0.0,
+        "p95_latency": percentile(latencies, 95),
+        "prompt_tokens": sum(r["prompt_tokens"] for r in results),
+        "completion_tokens": sum(r["completion_tokens"] for r in results),
+    }
+
+
+def evaluate_parallel(variants, splits, metric, num_threads=4, report_path=None):
+    """
+    Evaluate several module variants on several splits concurrently.
+
+    Args:
+        variants: dict of variant name -> module (e.g. {"original": m1, "optimized": m2})
+        splits: dict of split name -> list of dspy.Example
+        metric: Metric function (example, prediction) -> float
+        num_threads: Worker threads; the LM's rate limiter still caps throughput
+        report_path: Optional path to write the JSON report
+
+    Returns:
+        dict: Report with "splits" -> {"aggregate": {...}, "examples": [...]} per split
+    """
+    jobs = [
+        (split_name, index, variant_name, module, example)
+        for split_name, examples in splits.items()
+        for index, example in enumerate(examples)
+        for variant_name, module in variants.items()
+    ]
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=num_threads) as pool:
+        # Each job runs in a copy of the caller's context so dspy.context(lm=...) overrides apply
+        futures = [
+            pool.submit(contextvars.copy_context().run, _run_one, module, example, metric)
+            for _, _, _, module, example in jobs
+        ]
+        outcomes = [future.result() for future in futures]
+    wall = time.perf_counter() - start
+
+    report = {
+        "timestamp": datetime.datetime.now().isoformat(),
+        "variants": list(variants),
+        "num_threads": num_threads,
+        "wall_seconds": wall,
+        "splits": {},
+    }
+    for (split_name, index, variant_name, _, example), outcome in zip(jobs, outcomes):
+        split = report["splits"].setdefault(split_name, {"examples": [], "aggregate": {}})
+        while len(split["examples"]) <= index:
+            split["examples"].append({"index": len(split["examples"]), "variants": {}})
+        entry = split["examples"][index]
+        entry["inputs"] = example.inputs().toDict()
+        entry["variants"][variant_name] = outcome
+
+    for split in report["splits"].values():
+        for variant_name in variants:
+            results = [entry["variants"][variant_name] for entry in split["examples"]]
+            split["aggregate"][variant_name] = _aggregate(results)
+
+    if report_path:
+        os.makedirs(os.path.dirname(report_path) or ".", exist_ok=True)
+        with open(report_path, "w") as f:
+            json.dump(report, f, indent=2, default=str)
+
+    return report
+
+
+def print_report_summary(report, baseline="original", candidate="optimized"):
+    """Print per-split aggregates and the candidate's change over the baseline."""
+    print(f"\nWall clock: {report['wall_seconds']:.2f}s on {report['num_threads']} threads")
+    for split_name, split in report["splits"].items():
+        print(f"\n[{split_name}] {len(split['examples'])} examples")
+        for variant_name, agg in split["aggregate"].items():
+            print(
+                f"  {variant_name:<10} score {agg['mean_score']:.2%} | "
+                f"latency {agg['mean_latency'] * 1000:.0f}ms (p95 {agg['p95_latency'] * 1000:.0f}ms) | "
+                f"tokens {agg['prompt_tokens']} in / {agg['completion_tokens']} out | "
+                f"errors {agg['errors']}"
+            )
+        if baseline in split["aggregate"] and candidate in split["aggregate"]:
+            change = split["aggregate"][candidate]["mean_score"] - split["aggregate"][baseline]["mean_score"]
+            print(f"  Change:    {change:+.2%}")
+
+
+if __name__ == "__main__":
+    from metrics import extraction_accuracy, workout_quality
+    from modules import InfoExtractor, WorkoutGenerator
+    from stub_lm import StubLM
+    from training_data import get_extractor_trainset, get_generator_trainset
+
+    dspy.configure(lm=StubLM(latency=0.1))
+
+    print("=" * 60)
+    print("PARALLEL EVALUATION (StubLM, 100ms per call)")
+    print("=" * 60)
+    for name, module_cls, examples, metric in (
+        ("InfoExtractor", InfoExtractor, get_extractor_trainset(), extraction_accuracy),
+        ("WorkoutGenerator", WorkoutGenerator, get_generator_trainset(), workout_quality),
+    ):
+        print(f"\n{name}")
+        report = evaluate_parallel(
+            {"original": module_cls(), "optimized": module_cls()},
+            make_splits(examples),
+            metric,
+            num_threads=8,
+        )
+        print_report_summary(report)
@@ -0,0 +1,231 @@
+"""
+Reasoning-Free Execution Modes for ChainOfThought Modules
+
+This module contains:
+- ModalChainOfThought: dspy.ChainOfThought whose reasoning can be shortened
+  or skipped at runtime
+- mode_signature: The ChainOfThought signature for an execution mode
+- set_execution_mode: Switches every ModalChainOfThought inside a module
+- modes_from_env: Per-module modes from COACH_NOVA_FAST_MODE
+
+All modules generate a reasoning field that the app never shows. Modes:
+- "reasoning": ChainOfThought as optimized (default)
+- "brief": reasoning limited to one short sentence; demo reasoning is cut to
+  its first sentence so the demos do not invite long answers
+- "direct": the reasoning field is dropped, i.e. plain Predict
+
+The mode is applied per call by passing a signature (and demos) override to
+the same Predict, so predictor names, saved state and optimized artifacts
+are unchanged and the loaded demos keep working: demo fields that are not in
+the signature are simply not rendered. Running this file evaluates every
+mode with metrics.extraction_accuracy and metrics.workout_quality against a
+StubLM whose latency grows with output length, with the optimized extractor
+demos loaded, and reports quality vs. output tokens and latency.
+"""
+
+import functools
+import os
+import re
+
+import dspy
+
+
+EXECUTION_MODES = ("reasoning", "brief", "direct")
+MODE_TARGETS = ("coach", "extractor", "generator")
+
+BRIEF_PREFIX = "Reasoning: In one short sentence,"
+BRIEF_DESC = "one short sentence, no more than 25 words"
+FIRST_SENTENCE = re.compile(r"^(.+?[.!?])(?:\s|$)", re.DOTALL)
+
+
+@functools.lru_cache(maxsize=128)
+def mode_signature(signature, mode):
+    """
+    Signature for mode, derived from a ChainOfThought signature.
+
+    Cached so that the same object is returned for the same predictor
+    signature, which keeps the prompt prefix cache warm across calls.
+
+    Args:
+        signature: Signature with a leading reasoning output field
+        mode: One of EXECUTION_MODES
+
+    Returns:
+        type[dspy.Signature]: Signature to call the predictor with
+    """
+    if mode == "reasoning" or "reasoning" not in signature.output_fields:
+        return signature
+    if mode == "direct":
+        return signature.delete("reasoning")
+    return signature.with_updated_fields("reasoning", prefix=BRIEF_PREFIX, desc=BRIEF_DESC)
+
+
+def _first_sentence(text):
+    match = FIRST_SENTENCE.match(str(text).strip())
+    return match.group(1) if match else str(text)
+
+
+class ModalChainOfThought(dspy.ChainOfThought):
+    """
+    ChainOfThought with a runtime execution mode.
+
+    Args:
+        signature: Signature to wrap, as for dspy.ChainOfThought
+        mode: Initial mode from EXECUTION_MODES
+        **config: Passed on to dspy.ChainOfThought
+    """
+    def __init__(self, signature, mode="reasoning", **config):
+        super().__init__(signature, **config)
+        self.mode = mode
+        self._brief_demos = (None, (), [])
+
+    def _demos_for(self, demos):
+        # Rebuilt only when the predictor's demos change, so the list identity stays stable for PrefixCache
+        source, ids, brief = self._brief_demos
+        if source is not demos or ids != tuple(map(id, demos)):
+            brief = [
+                demo.copy(reasoning=_first_sentence(demo["reasoning"]))
+                if isinstance(demo, dspy.Example) and "reasoning" in demo
+                else {**demo, "reasoning": _first_sentence(demo["reasoning"])}
+                if isinstance(demo, dict) and "reasoning" in demo
+                else demo
+                for demo in demos
+            ]
+            self._brief_demos = (demos, tuple(map(id, demos)), brief)
+        return brief
+
+    def mode_call_kwargs(self, signature=None, demos=None):
+        """
+        Signature and demos that predict is called with in the current mode.
+
+        For callers that format prompts from the predictor themselves, such
+        as workout_stream.WorkoutStream.
+
+        Args:
+            signature: Signature override (default: the predictor's)
+            demos: Demos override (default: the predictor's, shortened in brief mode)
+
+        Returns:
+            dict: {"signature": ..., "demos": ...}
+        """
+        if self.mode not in EXECUTION_MODES:
+            raise ValueError(f"Unknown execution mode {self.mode!r}; expected one of {EXECUTION_MODES}")
+        signature = mode_signature(signature or self.predict.signature, self.mode)
+        if demos is None:
+            demos = self._demos_for(self.predict.demos) if self.mode == "brief" else self.predict.demos
+        return {"signature": signature, "demos": demos}
+
+    def _mode_kwargs(self, kwargs):
+        if self.mode == "reasoning":
+            return kwargs
+        overrides = self.mode_call_kwargs(kwargs.pop("signature", None), kwargs.pop("demos", None))
+        return {**kwargs, **overrides}
+
+    def forward(self, **kwargs):
+        return self.predict(**self._mode_kwargs(kwargs))
+
+    async def aforward(self, **kwargs):
+        return await self.predict.acall(**self._mode_kwargs(kwargs))
+
+
+def set_execution_mode(module, mode):
+    """
+    Set mode on every ModalChainOfThought in module, including module itself.
+
+    Args:
+        module: dspy.Module, e.g. CoachAgent
+        mode: One of EXECUTION_MODES
+
+    Returns:
+        int: Number of ModalChainOfThought modules switched
+    """
+    if mode not in EXECUTION_MODES:
+        raise ValueError(f"Unknown execution mode {mode!r}; expected one of {EXECUTION_MODES}")
+    switched = 0
+    for _, sub_module in module.named_sub_modules():
+        if isinstance(sub_module, ModalChainOfThought):
+            sub_module.mode = mode
+            switched += 1
+    return switched
+
+
+def modes_from_env():
+    """
+    Per-module modes from COACH_NOVA_FAST_MODE.
+
+    The value is a single mode for every module (e.g. "direct") or a spec
+    like "coach=direct,extractor=direct,generator=brief"; unset or "off"
+    keeps full reasoning everywhere.
+
+    Returns:
+        dict: module name ("coach", "extractor", "generator") -> mode
+    """
+    spec = os.getenv("COACH_NOVA_FAST_MODE", "off").strip().lower()
+    if spec in ("", "off", "0", "false", "no"):
+        return {}
+    if spec in EXECUTION_MODES:
+        return dict.fromkeys(MODE_TARGETS, spec)
+    modes = {}
+    for part in filter(None, (part.strip() for part in spec.split(","))):
+        target, _, mode = part.partition("=")
+        if target not in MODE_TARGETS or mode not in EXECUTION_MODES:
+            raise ValueError(f"Bad COACH_NOVA_FAST_MODE entry {part!r}; expected <{'|'.join(MODE_TARGETS)}>="
+                             f"<{'|'.join(EXECUTION_MODES)}>")
+        modes[target] = mode
+    return modes
+
+
+if __name__ == "__main__":
+    from artifacts import OPTIMIZED_DIR, load_optimized
+    from benchmark import build_scripts, script_lm
+    from evaluation import evaluate_parallel
+    # modules.py imports this file as execution_modes, not __main__, so match its classes
+    from execution_modes import set_execution_mode
+    from metrics import extraction_accuracy, workout_quality
+    from modules import InfoExtractor, WorkoutGenerator
+    from training_data import get_extractor_trainset, get_generator_trainset
+
+    long_reasoning = (
+        "The user described their experience level, the equipment they have access to and how long "
+        "they can train. Their goal and preferred focus follow from the last messages, and nothing "
+        "suggests an injury, so the remaining fields are filled from what was said explicitly. "
+    ) * 2
+
+    def reasoning(messages):
+        """Long reasoning unless the prompt asks for one sentence, like a real model would."""
+        if BRIEF_PREFIX in messages[0]["content"] or BRIEF_DESC in messages[0]["content"]:
+            return _first_sentence(long_reasoning)
+        return long_reasoning
+
+    # 200ms to first token plus 2ms per 4-character chunk: latency follows output length
+    lm = script_lm(build_scripts(), latency=0.2, jitter=0.0)
+    lm.token_delay = 0.002
+    lm.responses["reasoning"] = reasoning
+    dspy.configure(lm=lm)
+
+    extractor_modes, generator_modes = {}, {}
+    for mode in EXECUTION_MODES:
+        extractor = InfoExtractor()
+        load_optimized(extractor, os.path.join(OPTIMIZED_DIR, "extractor.json"))
+        assert set_execution_mode(extractor, mode)
+        extractor_modes[mode] = extractor
+        generator = WorkoutGenerator()
+        assert set_execution_mode(generator, mode)
+        generator_modes[mode] = generator
+    demos = len(extractor_modes["reasoning"].extract.predict.demos)
+
+    print("=" * 60)
+    print(f"EXECUTION MODES (StubLM, 200ms + 2ms per 4 output chars; {demos} optimized extractor demos)")
+    print("=" * 60)
+    print(f"{'Module':<17} | {'Mode':<9} | {'Quality':>7} | {'Out tok/call':>12} | {'Mean latency':>12} | Errors")
+    for name, variants, examples, metric in (
+        ("InfoExtractor", extractor_modes, get_extractor_trainset(), extraction_accuracy),
+        ("WorkoutGenerator", generator_modes, get_generator_trainset(), workout_quality),
+    ):
+        report = evaluate_parallel(variants, {"all": examples}, metric, num_threads=8)
+        for mode, aggregate in report["splits"]["all"]["aggregate"].items():
+            print(
+                f"{name:<17} | {mode:<9} | {aggregate['mean_score']:>7.1%} | "
+                f"{aggregate['completion_tokens'] / aggregate['count']:>12.0f} | "
+                f"{aggregate['mean_latency'] * 1000:>10.0f}ms | {aggregate['errors']}"
+            )
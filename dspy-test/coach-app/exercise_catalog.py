@@ -0,0 +1,390 @@
+"""
+Exercise Catalog and Name Index
+
+This module contains:
+- CatalogExercise: Name, aliases, equipment, muscle focus and space for one exercise
+- EXERCISES: The catalog of established exercises Coach Nova programs
+- ExerciseIndex: Normalized-name lookup with a character-trigram fuzzy fallback
+- uses_allowed_equipment: Equipment check used by metrics.workout_quality
+- validate_workout: Post-generation checks for Workout.exercises
+
+Names are normalized to lower-case alphanumerics with simple plural
+stripping, so "Push-ups", "push up" and "Pushup" share one key. Exact keys
+are a dict lookup; other names are matched by trigram overlap against an
+inverted index, and a fuzzy match is only accepted when every equipment word
+in the name (dumbbell, barbell, ...) agrees with the catalog entry. A name
+without equipment words that is closer to a catalog movement with its
+implement removed ("Bench Press" vs "Dumbbell Bench Press") than to any
+full name is left unknown, so it is not pinned to one implement.
+"""
+
+import re
+from collections import Counter
+from dataclasses import dataclass, field
+from functools import lru_cache
+
+
+# Spaces where an exercise can be done
+ANYWHERE = ("home", "gym", "hotel", "outdoor")
+FREE_WEIGHT_SPACES = ("home", "gym", "hotel")
+HOME_OR_GYM = ("home", "gym")
+GYM_ONLY = ("gym",)
+
+# Equipment words in exercise names and the catalog equipment they imply
+EQUIPMENT_WORDS = {
+    "dumbbell": "dumbbells",
+    "db": "dumbbells",
+    "barbell": "barbell",
+    "bb": "barbell",
+    "cable": "cables",
+    "machine": "machines",
+    "band": "bands",
+}
+
+# Catalog equipment each user equipment value allows; other values are not checked
+ALLOWED_EQUIPMENT = {
+    "bodyweight": {"bodyweight"},
+    "dumbbells": {"dumbbells", "bodyweight"},
+    "barbell": {"barbell", "bodyweight"},
+}
+
+# Fallback for names missing from the catalog: words that rule an exercise out
+FORBIDDEN_NAME_WORDS = {
+    "bodyweight": ("dumbbell", "barbell", "cable", "machine"),
+    "dumbbells": ("barbell", "cable", "machine"),
+    "barbell": ("dumbbell", "cable", "machine"),
+}
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+@dataclass(frozen=True)
+class CatalogExercise:
+    """One established exercise and what it needs"""
+    name: str
+    equipment: tuple
+    focus: tuple
+    space: tuple
+    aliases: tuple = field(default=())
+
+
+# ============================================================================
+# CATALOG
+# ============================================================================
+
+# Aliases always name the implement unless the movement is only done one way:
+# bare names like "Squat" or "Bench Press" stay unknown and fall back to the
+# equipment-word scan rather than being pinned to one implement
+EXERCISES = (
+    # Barbell
+    CatalogExercise("Barbell Bench Press", ("barbell",), ("push", "chest"), HOME_OR_GYM),
+    CatalogExercise("Incline Barbell Press", ("barbell",), ("push", "chest"), HOME_OR_GYM),
+    CatalogExercise("Barbell Floor Press", ("barbell",), ("push", "chest"), HOME_OR_GYM),
+    CatalogExercise("Barbell Back Squat", ("barbell",), ("legs",), HOME_OR_GYM, ("Back Squat", "Barbell Squat")),
+    CatalogExercise("Barbell Front Squat", ("barbell",), ("legs",), HOME_OR_GYM, ("Front Squat",)),
+    CatalogExercise("Barbell Deadlift", ("barbell",), ("legs", "back", "pull"), HOME_OR_GYM, ("Conventional Deadlift",)),
+    CatalogExercise("Barbell Romanian Deadlift", ("barbell",), ("legs", "pull"), HOME_OR_GYM, ("Barbell RDL",)),
+    CatalogExercise("Barbell Row", ("barbell",), ("pull", "back"), HOME_OR_GYM, ("Bent-Over Barbell Row", "Pendlay Row")),
+    CatalogExercise("Barbell Overhead Press", ("barbell",), ("push", "shoulders"), HOME_OR_GYM, ("Military Press", "OHP")),
+    CatalogExercise("Barbell Hip Thrust", ("barbell",), ("legs",), HOME_OR_GYM),
+    CatalogExercise("Barbell Curl", ("barbell",), ("pull", "arms"), HOME_OR_GYM),
+    CatalogExercise("Close-Grip Bench Press", ("barbell",), ("push", "arms", "chest"), HOME_OR_GYM),
+    CatalogExercise("Power Clean", ("barbell",), ("full_body", "legs", "pull"), HOME_OR_GYM, ("Barbell Power Clean",)),
+    # Dumbbell
+    CatalogExercise("Dumbbell Bench Press", ("dumbbells",), ("push", "chest"), FREE_WEIGHT_SPACES, ("DB Bench Press",)),
+    CatalogExercise("Incline Dumbbell Press", ("dumbbells",), ("push", "chest"), FREE_WEIGHT_SPACES, ("Incline Dumbbell Bench Press",)),
+    CatalogExercise("Dumbbell Fly", ("dumbbells",), ("push", "chest"), FREE_WEIGHT_SPACES, ("Dumbbell Chest Fly",)),
+    CatalogExercise("Dumbbell Row", ("dumbbells",), ("pull", "back"), FREE_WEIGHT_SPACES, ("One-Arm Dumbbell Row", "Single-Arm Dumbbell Row")),
+    CatalogExercise("Dumbbell Shoulder Press", ("dumbbells",), ("push", "shoulders"), FREE_WEIGHT_SPACES, ("Seated Dumbbell Press", "Dumbbell Overhead Press")),
+    CatalogExercise("Dumbbell Lateral Raise", ("dumbbells",), ("shoulders",), FREE_WEIGHT_SPACES),
+    CatalogExercise("Dumbbell Rear Delt Fly", ("dumbbells",), ("pull", "shoulders", "back"), FREE_WEIGHT_SPACES, ("Dumbbell Reverse Fly",)),
+    CatalogExercise("Dumbbell Goblet Squat", ("dumbbells",), ("legs",), FREE_WEIGHT_SPACES, ("Goblet Squat",)),
+    CatalogExercise("Dumbbell Romanian Deadlift", ("dumbbells",), ("legs", "pull"), FREE_WEIGHT_SPACES, ("DB RDL",)),
+    CatalogExercise("Dumbbell Lunge", ("dumbbells",), ("legs",), FREE_WEIGHT_SPACES, ("Dumbbell Walking Lunge",)),
+    CatalogExercise("Dumbbell Bulgarian Split Squat", ("dumbbells",), ("legs",), FREE_WEIGHT_SPACES),
+    CatalogExercise("Dumbbell Step-Up", ("dumbbells",), ("legs",), FREE_WEIGHT_SPACES),
+    CatalogExercise("Dumbbell Curl", ("dumbbells",), ("pull", "arms"), FREE_WEIGHT_SPACES, ("Dumbbell Biceps Curl",)),
+    CatalogExercise("Hammer Curl", ("dumbbells",), ("pull", "arms"), FREE_WEIGHT_SPACES, ("Dumbbell Hammer Curl",)),
+    CatalogExercise("Incline Dumbbell Curl", ("dumbbells",), ("pull", "arms"), FREE_WEIGHT_SPACES),
+    CatalogExercise("Dumbbell Triceps Extension", ("dumbbells",), ("push", "arms"), FREE_WEIGHT_SPACES, ("Dumbbell Overhead Triceps Extension",)),
+    CatalogExercise("Dumbbell Skull Crusher", ("dumbbells",), ("push", "arms"), FREE_WEIGHT_SPACES),
+    CatalogExercise("Dumbbell Shrug", ("dumbbells",), ("pull", "back"), FREE_WEIGHT_SPACES),
+    CatalogExercise("Dumbbell Thruster", ("dumbbells",), ("full_body",), FREE_WEIGHT_SPACES),
+    # Cable
+    CatalogExercise("Cable Lat Pulldown", ("cables", "machines"), ("pull", "back"), GYM_ONLY, ("Lat Pulldown", "Pulldown")),
+    CatalogExercise("Cable Seated Row", ("cables", "machines"), ("pull", "back"), GYM_ONLY, ("Seated Cable Row", "Seated Row")),
+    CatalogExercise("Cable Straight Arm Pulldown", ("cables",), ("pull", "back"), GYM_ONLY, ("Straight Arm Pulldown",)),
+    CatalogExercise("Cable Face Pull", ("cables",), ("pull", "shoulders"), GYM_ONLY, ("Face Pull",)),
+    CatalogExercise("Cable Crossover", ("cables",), ("push", "chest"), GYM_ONLY, ("Cable Fly",)),
+    CatalogExercise("Cable Triceps Pushdown", ("cables",), ("push", "arms"), GYM_ONLY, ("Triceps Pushdown", "Rope Pushdown")),
+    CatalogExercise("Cable Curl", ("cables",), ("pull", "arms"), GYM_ONLY),
+    CatalogExercise("Cable Lateral Raise", ("cables",), ("shoulders",), GYM_ONLY),
+    # Machine
+    CatalogExercise("Leg Press", ("machines",), ("legs",), GYM_ONLY, ("Machine Leg Press",)),
+    CatalogExercise("Leg Extension", ("machines",), ("legs",), GYM_ONLY),
+    CatalogExercise("Leg Curl", ("machines",), ("legs",), GYM_ONLY, ("Lying Leg Curl", "Seated Leg Curl")),
+    CatalogExercise("Machine Chest Press", ("machines",), ("push", "chest"), GYM_ONLY),
+    CatalogExercise("Machine Shoulder Press", ("machines",), ("push", "shoulders"), GYM_ONLY),
+    CatalogExercise("Pec Deck", ("machines",), ("push", "chest"), GYM_ONLY, ("Machine Fly",)),
+    CatalogExercise("Smith Machine Squat", ("machines",), ("legs",), GYM_ONLY),
+    CatalogExercise("Calf Raise Machine", ("machines",), ("legs",), GYM_ONLY, ("Standing Calf Raise Machine",)),
+    # Bands
+    CatalogExercise("Band Pull-Apart", ("bands",), ("pull", "shoulders"), ANYWHERE),
+    CatalogExercise("Banded Squat", ("bands",), ("legs",), ANYWHERE, ("Resistance Band Squat",)),
+    CatalogExercise("Band Row", ("bands",), ("pull", "back"), ANYWHERE, ("Resistance Band Row",)),
+    # Bodyweight
+    CatalogExercise("Push-up", ("bodyweight",), ("push", "chest"), ANYWHERE, ("Pushup", "Press-up")),
+    CatalogExercise("Incline Push-up", ("bodyweight",), ("push", "chest"), ANYWHERE),
+    CatalogExercise("Diamond Push-up", ("bodyweight",), ("push", "arms", "chest"), ANYWHERE),
+    CatalogExercise("Pike Push-up", ("bodyweight",), ("push", "shoulders"), ANYWHERE),
+    CatalogExercise("Pull-up", ("bodyweight",), ("pull", "back"), ("home", "gym", "outdoor"), ("Pullup",)),
+    CatalogExercise("Chin-up", ("bodyweight",), ("pull", "back", "arms"), ("home", "gym", "outdoor"), ("Chinup",)),
+    CatalogExercise("Weighted Pull-up", ("bodyweight",), ("pull", "back"), HOME_OR_GYM),
+    CatalogExercise("Inverted Row", ("bodyweight",), ("pull", "back"), ("home", "gym", "outdoor"), ("Bodyweight Row",)),
+    CatalogExercise("Dip", ("bodyweight",), ("push", "chest", "arms"), ("home", "gym", "outdoor"), ("Parallel Bar Dip",)),
+    CatalogExercise("Bench Dip", ("bodyweight",), ("push", "arms"), ANYWHERE, ("Chair Dip",)),
+    CatalogExercise("Bodyweight Squat", ("bodyweight",), ("legs",), ANYWHERE, ("Air Squat",)),
+    CatalogExercise("Lunge", ("bodyweight",), ("legs",), ANYWHERE, ("Walking Lunge", "Reverse Lunge")),
+    CatalogExercise("Jump Squat", ("bodyweight",), ("legs",), ANYWHERE),
+    CatalogExercise("Glute Bridge", ("bodyweight",), ("legs",), ANYWHERE),
+    CatalogExercise("Wall Sit", ("bodyweight",), ("legs",), ANYWHERE),
+    CatalogExercise("Calf Raise", ("bodyweight",), ("legs",), ANYWHERE, ("Standing Calf Raise",)),
+    CatalogExercise("Plank", ("bodyweight",), ("full_body",), ANYWHERE, ("Plank Hold", "Front Plank")),
+    CatalogExercise("Side Plank", ("bodyweight",), ("full_body",), ANYWHERE),
+    CatalogExercise("Mountain Climber", ("bodyweight",), ("full_body",), ANYWHERE),
+    CatalogExercise("Burpee", ("bodyweight",), ("full_body",), ANYWHERE),
+    CatalogExercise("Jumping Jack", ("bodyweight",), ("full_body",), ANYWHERE),
+    CatalogExercise("High Knees", ("bodyweight",), ("full_body", "legs"), ANYWHERE),
+    CatalogExercise("Bicycle Crunch", ("bodyweight",), ("full_body",), ANYWHERE, ("Crunch",)),
+    CatalogExercise("Superman", ("bodyweight",), ("back",), ANYWHERE),
+)
+
+
+# ============================================================================
+# NAME INDEX
+# ============================================================================
+
+def _singular(token):
+    return token[:-1] if len(token) > 2 and token.endswith("s") and not token.endswith("ss") else token
+
+
+def normalize_name(name):
+    """Lower-case alphanumeric key with plurals stripped ("Push-Ups" -> "pushup")."""
+    return "".join(_singular(token) for token in TOKEN_PATTERN.findall(name.lower()))
+
+
+def mentioned_equipment(name):
+    """Catalog equipment named by words in an exercise name."""
+    tokens = {_singular(token) for token in TOKEN_PATTERN.findall(name.lower())}
+    return {equipment for word, equipment in EQUIPMENT_WORDS.items() if word in tokens}
+
+
+def movement_key(name):
+    """normalize_name without equipment words ("Dumbbell Bench Press" -> "benchpres")."""
+    return "".join(token for token in map(_singular, TOKEN_PATTERN.findall(name.lower()))
+                   if token not in EQUIPMENT_WORDS)
+
+
+def _trigrams(key):
+    padded = f"#{key}#"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class ExerciseIndex:
+    """
+    Lookup from free-form exercise names to catalog entries.
+
+    Exact matches on the normalized name or an alias are O(1). Otherwise the
+    trigram inverted index yields candidates, scored by Dice similarity;
+    the best candidate at or above threshold wins, provided any equipment
+    word in the name matches its equipment. A name without equipment words
+    that matches a movement key (a catalog name with its equipment words
+    removed) at least as well is ambiguous and returns None. Results are
+    memoized.
+
+    Args:
+        exercises: Iterable of CatalogExercise
+        threshold: Minimum Dice similarity for a fuzzy match
+        cache_size: Number of memoized lookups
+    """
+    def __init__(self, exercises=EXERCISES, threshold=0.7, cache_size=10_000):
+        self.exercises = tuple(exercises)
+        self.threshold = threshold
+        self._exact = {}
+        self._keys = []
+        self._postings = {}
+        self._movements = []
+        self._movement_postings = {}
+        for entry in self.exercises:
+            for name in (entry.name, *entry.aliases):
+                key = normalize_name(name)
+                if key in self._exact:
+                    continue
+                self._exact[key] = entry
+                key_id = len(self._keys)
+                self._keys.append((key, len(_trigrams(key)), entry))
+                for gram in _trigrams(key):
+                    self._postings.setdefault(gram, []).append(key_id)
+        for movement in sorted({movement_key(name) for entry in self.exercises
+                                for name in (entry.name, *entry.aliases) if mentioned_equipment(name)}):
+            for gram in _trigrams(movement):
+                self._movement_postings.setdefault(gram, []).append(len(self._movements))
+            self._movements.append(len(_trigrams(movement)))
+        self.lookup = lru_cache(maxsize=cache_size)(self._lookup)
+
+    def __len__(self):
+        return len(self.exercises)
+
+    def _lookup(self, name):
+        """
+        Find the catalog entry for an exercise name.
+
+        Args:
+            name: Exercise name as written by the LM or user
+
+        Returns:
+            CatalogExercise or None: The matching entry, or None if nothing is close enough
+        """
+        key = normalize_name(name)
+        entry = self._exact.get(key)
+        if entry is not None or not key:
+            return entry
+
+        grams = _trigrams(key)
+        shared = Counter()
+        for gram in grams:
+            shared.update(self._postings.get(gram, ()))
+        required = mentioned_equipment(name)
+
+        best, best_score = None, self.threshold
+        for key_id, count in shared.items():
+            _, size, candidate = self._keys[key_id]
+            score = 2 * count / (len(grams) + size)
+            if score >= best_score and required <= set(candidate.equipment):
+                best, best_score = candidate, score
+        if best is not None and not required and self._movement_score(grams) >= best_score:
+            # "Bench Press" is a movement, not one implement's exercise
+            return None
+        return best
+
+    def _movement_score(self, grams):
+        shared = Counter()
+        for gram in grams:
+            shared.update(self._movement_postings.get(gram, ()))
+        return max((2 * count / (len(grams) + self._movements[movement_id]) for movement_id, count in shared.items()),
+                   default=0.0)
+
+
+CATALOG = ExerciseIndex()
+
+
+# ============================================================================
+# CHECKS
+# ============================================================================
+
+def uses_allowed_equipment(name, equipment, index=CATALOG):
+    """
+    Decide whether an exercise fits the user's equipment.
+
+    Catalog exercises are allowed when one of their equipment options is
+    available; names missing from the catalog fall back to scanning for
+    equipment words. Equipment other than bodyweight, dumbbells and barbell
+    is not restricted.
+
+    Args:
+        name: Exercise name
+        equipment: User's equipment value (e.g. "dumbbells")
+        index: ExerciseIndex to consult
+
+    Returns:
+        bool: False if the exercise needs equipment the user lacks
+    """
+    allowed = ALLOWED_EQUIPMENT.get(equipment)
+    if allowed is None:
+        return True
+    entry = index.lookup(name)
+    if entry is None:
+        lowered = name.lower()
+        return not any(word in lowered for word in FORBIDDEN_NAME_WORDS[equipment])
+    return not allowed.isdisjoint(entry.equipment)
+
+
+@dataclass
+class ValidationIssue:
+    """A problem with one exercise of a generated workout"""
+    exercise: str
+    problem: str
+    detail: str
+
+
+def validate_workout(workout, equipment=None, space=None, focus=None, index=CATALOG):
+    """
+    Check generated exercises against the catalog and the user's requirements.
+
+    Args:
+        workout: Workout model or dict with an "exercises" list
+        equipment: User's equipment value, or None to skip the check
+        space: User's space value, or None to skip the check
+        focus: User's focus value, or None to skip the check
+        index: ExerciseIndex to consult
+
+    Returns:
+        list: ValidationIssue per problem (empty when the workout passes)
+    """
+    exercises = workout["exercises"] if isinstance(workout, dict) else workout.exercises
+    issues = []
+    for exercise in exercises:
+        name = exercise["name"] if isinstance(exercise, dict) else exercise.name
+        entry = index.lookup(name)
+        if entry is None:
+            issues.append(ValidationIssue(name, "unknown", "not in the exercise catalog"))
+            continue
+        if equipment and not uses_allowed_equipment(name, equipment, index):
+            issues.append(ValidationIssue(name, "equipment", f"needs {'/'.join(entry.equipment)}"))
+        if space and space not in entry.space:
+            issues.append(ValidationIssue(name, "space", f"needs {'/'.join(entry.space)}"))
+        if focus and focus != "full_body" and focus not in entry.focus and "full_body" not in entry.focus:
+            issues.append(ValidationIssue(name, "focus", f"works {'/'.join(entry.focus)}"))
+    return issues
+
+
+if __name__ == "__main__":
+    import random
+    import time
+
+    from stub_lm import DEFAULT_WORKOUT
+
+    print("=" * 60)
+    print(f"EXERCISE CATALOG ({len(CATALOG)} exercises)")
+    print("=" * 60)
+    for name in ("Goblet Squat", "push ups", "Incline DB Bench Press", "Seated Cable Rows",
+                 "Barbell Rows", "Dumbell Lateral Raises", "Squats", "Bench Press", "Underwater Basket Weaving"):
+        entry = CATALOG.lookup(name)
+        print(f"{name:<28} -> {entry.name if entry else None}")
+
+    print("\nBodyweight check of 'Goblet Squat':")
+    print(f"  substring scan: {'allowed' if 'dumbbell' not in 'goblet squat' else 'rejected'}")
+    print(f"  catalog:        {'allowed' if uses_allowed_equipment('Goblet Squat', 'bodyweight') else 'rejected'}")
+
+    print("\nValidating the stub workout for a bodyweight hotel session:")
+    for issue in validate_workout(DEFAULT_WORKOUT, equipment="bodyweight", space="hotel", focus="legs"):
+        print(f"  {issue.exercise}: {issue.problem} ({issue.detail})")
+
+    # Throughput: exact names, fuzzy variants, and misses
+    rng = random.Random(0)
+    exact = [rng.choice(EXERCISES).name for _ in range(100_000)]
+    fuzzy = [name.replace("e", "", 1) + "s" for name in exact]
+    misses = [f"Exercise {rng.randint(0, 10 ** 9)}" for _ in range(100_000)]
+    print("\nLookup throughput:")
+    for label, names in (("exact", exact), ("fuzzy", fuzzy), ("miss", misses)):
+        cold = ExerciseIndex(cache_size=0)
+        start = time.perf_counter()
+        for name in names:
+            cold.lookup(name)
+        uncached = len(names) / (time.perf_counter() - start)
+        warm = ExerciseIndex()
+        start = time.perf_counter()
+        for name in names:
+            warm.lookup(name)
+        cached = len(names) / (time.perf_counter() - start)
+        print(f"  {label:<6} {uncached:>10,.0f}/s uncached | {cached:>10,.0f}/s memoized")
@@ -0,0 +1,296 @@
+"""
+Micro-Batched Extraction Across Sessions
+
+This module contains:
+- validate_record: Per-record check of one entry of a multi-record extraction
+- ExtractionBatcher: Collects concurrent InfoExtractor requests for a short
+  window and serves them with one LM call per batch
+- run_arrivals: Open-loop load generator used for the throughput/latency curves
+
+When many sessions finish gathering info at once, each would issue its own
+ExtractUserInfo call. The batcher queues requests until max_batch are
+waiting or the oldest has waited max_wait seconds, then either sends them as
+one ExtractUserInfoBatch call ("multi") or as parallel single calls
+("fanout"). Multi-record results are matched back to their session by
+conversation_id and validated one by one; a record that is missing or
+malformed (or the whole batch, if the call fails) falls back to a single
+InfoExtractor call for that session only. Running this file replays
+extraction requests against a StubLM and prints latency percentiles and
+throughput for several batch settings and arrival rates.
+"""
+
+import asyncio
+import json
+import time
+
+import dspy
+
+from extraction_state import EXTRACTION_FIELDS, FIELD_CHOICES, normalize_value
+from modules import BatchInfoExtractor, InfoExtractor
+from sessions import percentile
+
+
+BATCH_MODES = ("multi", "fanout")
+
+
+def validate_record(record):
+    """
+    Check one entry of an ExtractUserInfoBatch result.
+
+    Enum fields must be a documented choice or "null" and duration a number
+    or "null"; free-text fields only need to be present.
+
+    Args:
+        record: ExtractedInfo returned for one conversation
+
+    Returns:
+        dict: Normalized ExtractUserInfo fields, or None if the record is unusable
+    """
+    fields = {}
+    for name in EXTRACTION_FIELDS:
+        value = normalize_value(getattr(record, name, None))
+        if value != "null":
+            if name in FIELD_CHOICES and value not in FIELD_CHOICES[name]:
+                return None
+            if name == "duration" and not value.isdigit():
+                return None
+        fields[name] = value
+    return fields
+
+
+# ============================================================================
+# BATCHER
+# ============================================================================
+
+class ExtractionBatcher:
+    """
+    Groups concurrent extraction requests into micro-batches.
+
+    Must be used from a single event loop. max_batch=1 turns batching off
+    (every request is sent on its own, as SessionEngine does by default).
+
+    Args:
+        extractor: InfoExtractor used for fan-out and per-record fallback
+        batch_extractor: BatchInfoExtractor used in "multi" mode
+        max_batch: Largest number of requests sent together
+        max_wait: Seconds the oldest queued request may wait for others
+        mode: "multi" (one multi-record call) or "fanout" (parallel single calls)
+        max_in_flight: Cap on concurrent LM calls issued by the batcher
+    """
+    def __init__(self, extractor=None, batch_extractor=None, max_batch=8, max_wait=0.02, mode="multi",
+                 max_in_flight=None):
+        if mode not in BATCH_MODES:
+            raise ValueError(f"mode must be one of {BATCH_MODES}, got {mode!r}")
+        self.extractor = extractor or InfoExtractor()
+        self.batch_extractor = batch_extractor or BatchInfoExtractor()
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait
+        self.mode = mode
+        self._slots = asyncio.Semaphore(max_in_flight) if max_in_flight else None
+        self._pending = []  # (conversation_history, future)
+        self._timer = None
+        self._tasks = set()
+        self.stats = {
+            "requests": 0,
+            "batches": 0,
+            "lm_calls": 0,
+            "invalid_records": 0,
+            "failed_batches": 0,
+            "fallbacks": 0,
+        }
+
+    async def extract(self, conversation_history):
+        """
+        Queue one extraction and wait for its result.
+
+        Args:
+            conversation_history: Same input as InfoExtractor
+
+        Returns:
+            dspy.Prediction: ExtractUserInfo fields for this conversation
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((conversation_history, future))
+        self.stats["requests"] += 1
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._pending:
+            batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+            task = asyncio.create_task(self._run(batch))
+            # The event loop only keeps weak references to tasks
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _call(self, module, **kwargs):
+        self.stats["lm_calls"] += 1
+        if self._slots is None:
+            return await module.acall(**kwargs)
+        async with self._slots:
+            return await module.acall(**kwargs)
+
+    async def _run(self, batch):
+        self.stats["batches"] += 1
+        histories = [history for history, _ in batch]
+        results = [None] * len(batch)
+        if self.mode == "multi" and len(batch) > 1:
+            results = await self._run_multi(histories)
+            self.stats["fallbacks"] += results.count(None)
+
+        missing = [index for index, result in enumerate(results) if result is None]
+        singles = await asyncio.gather(
+            *(self._call(self.extractor, conversation_history=histories[index]) for index in missing),
+            return_exceptions=True
+        )
+        for index, result in zip(missing, singles):
+            results[index] = result
+
+        for (_, future), result in zip(batch, results):
+            if future.done():
+                continue  # Caller went away
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    async def _run_multi(self, histories):
+        conversations = json.dumps([
+            {"id": index, "conversation_history": history} for index, history in enumerate(histories)
+        ])
+        try:
+            prediction = await self._call(self.batch_extractor, conversations=conversations)
+            records = list(prediction.extractions)
+        except Exception:
+            self.stats["failed_batches"] += 1
+            return [None] * len(histories)
+
+        results = [None] * len(histories)
+        for record in records:
+            index = getattr(record, "conversation_id", None)
+            if not isinstance(index, int) or not 0 <= index < len(histories) or results[index] is not None:
+                self.stats["invalid_records"] += 1
+                continue
+            fields = validate_record(record)
+            if fields is None:
+                self.stats["invalid_records"] += 1
+                continue
+            results[index] = dspy.Prediction(reasoning=prediction.get("reasoning", ""), **fields)
+        return results
+
+
+# ============================================================================
+# LOAD GENERATOR
+# ============================================================================
+
+async def run_arrivals(batcher, histories, rate):
+    """
+    Submit extraction requests at a fixed arrival rate and time each one.
+
+    Arrivals are open-loop (they do not wait for earlier requests), like
+    independent sessions all reaching should_extract.
+
+    Args:
+        batcher: ExtractionBatcher to exercise
+        histories: One conversation history per request
+        rate: Requests per second
+
+    Returns:
+        dict: requests, throughput (req/s), p50/p99 latency (seconds), lm_calls, results
+    """
+    latencies = []
+
+    async def request(history, delay):
+        await asyncio.sleep(delay)
+        start = time.perf_counter()
+        result = await batcher.extract(history)
+        latencies.append(time.perf_counter() - start)
+        return result
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(request(history, i / rate) for i, history in enumerate(histories)))
+    wall = time.perf_counter() - start
+    return {
+        "requests": len(histories),
+        "throughput": len(histories) / wall if wall else 0.0,
+        "p50_latency": percentile(latencies, 50),
+        "p99_latency": percentile(latencies, 99),
+        "lm_calls": batcher.stats["lm_calls"],
+        "results": results,
+    }
+
+
+if __name__ == "__main__":
+    import re
+
+    from stub_lm import StubLM
+    from training_data import get_extractor_trainset
+
+    examples = get_extractor_trainset()
+    labels = {example.conversation_history: example for example in examples}
+    conversations_pattern = re.compile(r"\[\[ ## conversations ## \]\]\n(.*)")
+
+    def label(messages, name):
+        history = messages[-1]["content"].split("[[ ## conversation_history ## ]]\n", 1)[1].split("\n\n", 1)[0]
+        return labels[history][name]
+
+    malformed_ids = set()
+
+    def batch_records(messages):
+        conversations = json.loads(conversations_pattern.search(messages[-1]["content"]).group(1))
+        records = []
+        for conversation in conversations:
+            example = labels[conversation["conversation_history"]]
+            record = {"conversation_id": conversation["id"], **{name: example[name] for name in EXTRACTION_FIELDS}}
+            if conversation["id"] in malformed_ids:
+                record["duration"] = "about forty minutes"
+            records.append(record)
+        return json.dumps(records)
+
+    # 100ms to first token, ~2ms per 4 output characters; at most 4 calls in flight
+    lm = StubLM(latency=0.1, token_delay=0.002, responses={
+        "extractions": batch_records,
+        **{name: (lambda messages, name=name: label(messages, name)) for name in EXTRACTION_FIELDS},
+    })
+    dspy.configure(lm=lm)
+    histories = [examples[i % len(examples)].conversation_history for i in range(60)]
+    settings = [
+        ("unbatched", dict(max_batch=1)),
+        ("fanout x8", dict(max_batch=8, max_wait=0.05, mode="fanout")),
+        ("multi x4", dict(max_batch=4, max_wait=0.05)),
+        ("multi x8", dict(max_batch=8, max_wait=0.05)),
+        ("multi x16", dict(max_batch=16, max_wait=0.1)),
+    ]
+
+    print("=" * 60)
+    print("MICRO-BATCHED EXTRACTION (StubLM, 100ms + 2ms/4 chars, 4 calls in flight)")
+    print("=" * 60)
+    print(f"{len(histories)} requests per run\n")
+    print(f"{'Setting':<10} | {'Rate':>6} | {'Throughput':>10} | {'p50':>8} | {'p99':>8} | {'LM calls':>8} | Batch size")
+    for rate in (10, 25, 50, 100):
+        for name, kwargs in settings:
+            batcher = ExtractionBatcher(max_in_flight=4, **kwargs)
+            stats = asyncio.run(run_arrivals(batcher, histories, rate))
+            for history, result in zip(histories, stats["results"]):
+                assert all(getattr(result, field) == labels[history][field] for field in EXTRACTION_FIELDS), name
+            print(
+                f"{name:<10} | {rate:>4}/s | {stats['throughput']:>6.1f}/s   | "
+                f"{stats['p50_latency'] * 1000:6.0f}ms | {stats['p99_latency'] * 1000:6.0f}ms | "
+                f"{stats['lm_calls']:>8} | {stats['requests'] / batcher.stats['batches']:.1f}"
+            )
+        print()
+
+    # A burst where one record per batch comes back malformed
+    malformed_ids.add(3)
+    batcher = ExtractionBatcher(max_in_flight=4, max_batch=8, max_wait=0.05)
+    stats = asyncio.run(run_arrivals(batcher, histories[:16], rate=1000))
+    for history, result in zip(histories, stats["results"]):
+        assert all(getattr(result, field) == labels[history][field] for field in EXTRACTION_FIELDS)
+    print(f"Malformed records: {batcher.stats['invalid_records']} rejected, {batcher.stats['fallbacks']} "
+          f"served by single-call fallback, {stats['lm_calls']} LM calls for {stats['requests']} requests")
@@ -0,0 +1,265 @@
+"""
+Incremental Slot-Filling State for Information Extraction
+
+This module contains:
+- FIELD_CHOICES: Documented values for the enum fields of ExtractUserInfo
+- ExtractionState: Partially-filled requirements that are updated from only
+  the messages added since the last extraction
+
+InfoExtractor re-reads str(history) on every call, so its prompt grows with
+the whole conversation. ExtractionState sends IncrementalExtractor the known
+fields plus the newest exchanges instead, and freezes fields once they hold a
+confident value. Running this file compares prompt tokens per turn for both
+approaches on the training conversations.
+"""
+
+import ast
+import json
+
+import dspy
+
+from rule_extractor import pre_extract
+
+
+# Documented values for each enum field (mirrors the ExtractUserInfo descriptions)
+FIELD_CHOICES = {
+    "fitness_level": ("beginner", "intermediate", "advanced"),
+    "goal": ("strength", "hypertrophy", "endurance", "power", "general"),
+    "focus": ("push", "pull", "legs", "chest", "back", "arms", "shoulders", "full_body"),
+    "equipment": ("bodyweight", "dumbbells", "barbell", "machines", "cables", "bands"),
+    "space": ("home", "gym", "hotel", "outdoor"),
+}
+
+# All ExtractUserInfo output fields, in signature order
+EXTRACTION_FIELDS = (
+    "fitness_level", "goal", "focus", "equipment",
+    "duration", "space", "injuries", "primary_lift_pr",
+)
+
+
+def normalize_value(value):
+    """Lower-case and strip an extracted value, mapping empty values to "null"."""
+    value = str(value).strip().lower() if value is not None else ""
+    return value or "null"
+
+
+def is_confident(name, value):
+    """
+    Decide whether an extracted value is trustworthy enough to freeze.
+
+    Enum fields must match a documented choice, duration must be a number,
+    and free-text fields only need to be non-null.
+
+    Args:
+        name: Field name from EXTRACTION_FIELDS
+        value: Normalized field value
+
+    Returns:
+        bool: True if the value should no longer be re-extracted
+    """
+    if value == "null":
+        return False
+    if name in FIELD_CHOICES:
+        return value in FIELD_CHOICES[name]
+    if name == "duration":
+        return value.isdigit()
+    return True
+
+
+# ============================================================================
+# EXTRACTION STATE
+# ============================================================================
+
+class ExtractionState:
+    """
+    Partially-filled ExtractUserInfo fields for one conversation.
+
+    Exchanges are queued with add_exchange() and only those queued since the
+    previous extraction are sent to the LM. Confident fields are frozen, so a
+    later, vaguer LM answer cannot overwrite them. With use_rules, fields that
+    rule_extractor.pre_extract can resolve are filled locally first and the LM
+    call is skipped when no field is left for it. provenance records whether
+    each filled field came from "rule" or "lm".
+    """
+    def __init__(self, use_rules=True):
+        self.use_rules = use_rules
+        self.fields = {name: "null" for name in EXTRACTION_FIELDS}
+        self.frozen = set()
+        self.provenance = {}
+        self.pending = []
+        self.previous_coach = None
+
+    def add_exchange(self, user_message, coach_response):
+        """Queue one user/coach exchange for the next extraction."""
+        self.pending.append({"user": user_message, "coach": coach_response})
+
+    def known_info(self):
+        """Filled field values as compact JSON."""
+        filled = {name: value for name, value in self.fields.items() if value != "null"}
+        return json.dumps(filled, separators=(",", ":"))
+
+    def open_fields(self):
+        """Fields that are not frozen yet, in signature order."""
+        return tuple(name for name in EXTRACTION_FIELDS if name not in self.frozen)
+
+    def request(self, open_fields=None):
+        """
+        Keyword arguments for IncrementalExtractor.
+
+        new_messages starts with the coach message that preceded the pending
+        exchanges, so short answers such as "yes" or "45" keep their question.
+        """
+        messages = self.pending
+        if self.previous_coach:
+            messages = [{"coach": self.previous_coach}] + messages
+        return {
+            "known_info": self.known_info(),
+            "new_messages": str(messages),
+            "open_fields": self.open_fields() if open_fields is None else open_fields,
+        }
+
+    def apply_rules(self):
+        """
+        Fill fields resolvable by the local rule parser from pending exchanges.
+
+        Rules only fill fields that are still open: a frozen value, or one the
+        LM already gave, is never replaced by a keyword match.
+
+        Returns:
+            tuple: Open fields that still need the LM
+        """
+        if not self.use_rules:
+            return self.open_fields()
+        absent = set()
+        for name, value in pre_extract(self.pending, self.previous_coach).items():
+            if name in self.frozen or self.provenance.get(name) == "lm":
+                continue
+            if value == "null":
+                absent.add(name)
+                continue
+            self.fields[name] = value
+            self.frozen.add(name)
+            self.provenance[name] = "rule"
+        return tuple(name for name in self.open_fields() if name not in absent)
+
+    def merge(self, prediction):
+        """
+        Fold an IncrementalExtractor prediction into the state.
+
+        Args:
+            prediction: Prediction with ExtractUserInfo output fields
+
+        Returns:
+            dspy.Prediction: All current field values
+        """
+        for name in EXTRACTION_FIELDS:
+            if name in self.frozen:
+                continue
+            value = normalize_value(getattr(prediction, name, None))
+            if value == "null":
+                continue
+            self.fields[name] = value
+            self.provenance[name] = "lm"
+            if is_confident(name, value):
+                self.frozen.add(name)
+        return self._consume_pending()
+
+    def _consume_pending(self):
+        if self.pending:
+            self.previous_coach = self.pending[-1]["coach"]
+        self.pending = []
+        return self.as_prediction()
+
+    def as_prediction(self):
+        """Current field values as a Prediction, like InfoExtractor returns."""
+        return dspy.Prediction(**self.fields)
+
+    def extract(self, extractor):
+        """Resolve pending exchanges with rules, then IncrementalExtractor if needed."""
+        if not self.pending:
+            return self.as_prediction()
+        lm_fields = self.apply_rules()
+        if not lm_fields:
+            return self._consume_pending()
+        return self.merge(extractor(**self.request(lm_fields)))
+
+    async def aextract(self, extractor):
+        """Async variant of extract()."""
+        if not self.pending:
+            return self.as_prediction()
+        lm_fields = self.apply_rules()
+        if not lm_fields:
+            return self._consume_pending()
+        return self.merge(await extractor.acall(**self.request(lm_fields)))
+
+
+# ============================================================================
+# BENCHMARK
+# ============================================================================
+
+def benchmark_prompt_tokens(examples):
+    """
+    Compare prompt tokens per turn for full-history vs incremental extraction.
+
+    Every conversation is replayed turn by turn, extracting after each turn
+    with both InfoExtractor (full str(history)) and IncrementalExtractor. A
+    StubLM answering with the example's labels reports prompt token usage.
+
+    Args:
+        examples: Extractor training examples with conversation_history
+
+    Returns:
+        dict: turn number -> {"full": [tokens...], "incremental": [tokens...]}
+    """
+    from modules import InfoExtractor, IncrementalExtractor
+    from stub_lm import StubLM
+
+    full_extractor = InfoExtractor()
+    incremental_extractor = IncrementalExtractor()
+    per_turn = {}
+
+    for example in examples:
+        lm = StubLM(responses={name: example[name] for name in EXTRACTION_FIELDS})
+        history = ast.literal_eval(example.conversation_history)
+        state = ExtractionState(use_rules=False)
+
+        with dspy.context(lm=lm):
+            for turn, exchange in enumerate(history, 1):
+                full_extractor(conversation_history=str(history[:turn]))
+                full_tokens = lm.history[-1]["usage"]["prompt_tokens"]
+
+                calls = len(lm.history)
+                state.add_exchange(exchange["user"], exchange["coach"])
+                state.extract(incremental_extractor)
+                incremental_tokens = lm.history[-1]["usage"]["prompt_tokens"] if len(lm.history) > calls else 0
+
+                counts = per_turn.setdefault(turn, {"full": [], "incremental": []})
+                counts["full"].append(full_tokens)
+                counts["incremental"].append(incremental_tokens)
+
+    return per_turn
+
+
+if __name__ == "__main__":
+    from training_data import get_extractor_trainset
+
+    per_turn = benchmark_prompt_tokens(get_extractor_trainset())
+
+    print("=" * 60)
+    print("PROMPT TOKENS PER TURN (extract after every turn)")
+    print("=" * 60)
+    print(f"{'Turn':>4} | {'Convs':>5} | {'Full history':>12} | {'Incremental':>11} | {'Saved':>6}")
+    total_full = total_incremental = 0
+    for turn in sorted(per_turn):
+        full = per_turn[turn]["full"]
+        incremental = per_turn[turn]["incremental"]
+        avg_full = sum(full) / len(full)
+        avg_incremental = sum(incremental) / len(incremental)
+        total_full += sum(full)
+        total_incremental += sum(incremental)
+        print(
+            f"{turn:>4} | {len(full):>5} | {avg_full:>12.0f} | {avg_incremental:>11.0f} | "
+            f"{1 - avg_incremental / avg_full:>6.1%}"
+        )
+    print(f"\nTotal prompt tokens: full={total_full}, incremental={total_incremental} "
+          f"({1 - total_incremental / total_full:.1%} saved)")
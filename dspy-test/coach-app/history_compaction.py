@@ -0,0 +1,248 @@
+"""
+Conversation History Compaction for CoachAgent
+
+This module contains:
+- HistoryCompactor: Renders the conversation_history input of CoachAgent
+  within a token budget
+- render_history: str(history), or its compacted form when a compactor is given
+- compactor_from_env: HistoryCompactor configured from COACH_NOVA_HISTORY_BUDGET
+
+CoachAgent used to receive str(history) with every coach reply verbatim, so
+its prompt grew without bound. The compacted history keeps the last
+keep_turns exchanges verbatim and folds everything older into one summary
+entry at the front of the list: the ExtractUserInfo fields already known
+(from the ExtractionState when available, otherwise from rule_extractor) and
+the fields still to ask about. If the result is still over token_budget,
+verbatim turns are folded into the summary from the oldest on, then long
+coach replies are clipped; the newest exchange is always kept. Running this
+file compares prompt size and coach latency for synthetic 5/20/50-turn
+conversations with and without compaction.
+"""
+
+import ast
+import os
+
+from extraction_state import EXTRACTION_FIELDS
+from rule_extractor import pre_extract
+from token_estimate import estimate_tokens
+
+
+DEFAULT_KEEP_TURNS = 4
+DEFAULT_TOKEN_BUDGET = 600
+# Coach replies in verbatim turns are clipped to this many characters when over budget
+CLIPPED_REPLY_CHARS = 160
+
+
+# ============================================================================
+# COMPACTOR
+# ============================================================================
+
+class HistoryCompactor:
+    """
+    Keeps CoachAgent's conversation_history within a token budget.
+
+    The output is still the str() of a list of dicts, so prompts and
+    optimized demos keep their shape; only the first entry changes from an
+    exchange to {"summary": ..., "known": {...}, "open_questions": [...]}.
+
+    Args:
+        keep_turns: Newest exchanges kept verbatim
+        token_budget: Maximum estimated tokens of the rendered history
+    """
+    def __init__(self, keep_turns=DEFAULT_KEEP_TURNS, token_budget=DEFAULT_TOKEN_BUDGET):
+        self.keep_turns = keep_turns
+        self.token_budget = token_budget
+        self.stats = {"renders": 0, "compacted": 0, "turns_folded": 0, "replies_clipped": 0, "over_budget": 0}
+
+    def summarize(self, exchanges, known_fields=None):
+        """
+        Summary entry for exchanges that are no longer shown verbatim.
+
+        Args:
+            exchanges: Older {"user": ..., "coach": ...} dicts, oldest first
+            known_fields: Optional ExtractionState.fields; its filled values win
+                over the rule parser
+
+        Returns:
+            dict: {"summary", "known", "open_questions"}
+        """
+        known = {name: value for name, value in pre_extract(exchanges).items() if value != "null"}
+        for name, value in (known_fields or {}).items():
+            if value != "null":
+                known[name] = value
+        return {
+            "summary": f"{len(exchanges)} earlier exchanges",
+            "known": {name: known[name] for name in EXTRACTION_FIELDS if name in known},
+            "open_questions": [name for name in EXTRACTION_FIELDS if name not in known],
+        }
+
+    def _render(self, history, folded, known_fields, clip):
+        recent = history[folded:]
+        if clip:
+            recent = [
+                {"user": turn["user"], "coach": _clip(turn["coach"])} if index < len(recent) - 1 else turn
+                for index, turn in enumerate(recent)
+            ]
+        if folded:
+            recent = [self.summarize(history[:folded], known_fields)] + recent
+        return str(recent)
+
+    def render(self, history, known_fields=None):
+        """
+        Render history for CoachAgent's conversation_history input.
+
+        Args:
+            history: List of {"user": ..., "coach": ...} dicts, oldest first
+            known_fields: Optional ExtractionState.fields for the summary
+
+        Returns:
+            str: History within token_budget (unless even the newest exchange
+            alone exceeds it)
+        """
+        self.stats["renders"] += 1
+        folded = max(0, len(history) - self.keep_turns)
+        text = self._render(history, folded, known_fields, clip=False)
+
+        # Fold verbatim turns, oldest first, keeping at least the newest exchange
+        while estimate_tokens(text) > self.token_budget and folded < len(history) - 1:
+            folded += 1
+            text = self._render(history, folded, known_fields, clip=False)
+
+        if estimate_tokens(text) > self.token_budget:
+            text = self._render(history, folded, known_fields, clip=True)
+            self.stats["replies_clipped"] += 1
+        if estimate_tokens(text) > self.token_budget:
+            self.stats["over_budget"] += 1
+        if folded:
+            self.stats["compacted"] += 1
+            self.stats["turns_folded"] += folded
+        return text
+
+
+def _clip(text):
+    return text if len(text) <= CLIPPED_REPLY_CHARS else text[:CLIPPED_REPLY_CHARS].rstrip() + "..."
+
+
+def render_history(history, compactor=None, known_fields=None):
+    """
+    CoachAgent conversation_history: compacted if a compactor is given, else str(history).
+
+    Args:
+        history: List of {"user": ..., "coach": ...} dicts
+        compactor: Optional HistoryCompactor
+        known_fields: Optional ExtractionState.fields for the summary
+
+    Returns:
+        str: Value for the conversation_history input
+    """
+    if compactor is None:
+        return str(history)
+    return compactor.render(history, known_fields)
+
+
+def compactor_from_env():
+    """
+    HistoryCompactor if COACH_NOVA_HISTORY_BUDGET is set to a token budget.
+
+    COACH_NOVA_HISTORY_TURNS overrides the number of verbatim turns.
+
+    Returns:
+        HistoryCompactor or None
+    """
+    budget = os.getenv("COACH_NOVA_HISTORY_BUDGET", "off").lower()
+    if budget in ("", "off", "0", "false", "no"):
+        return None
+    keep_turns = int(os.getenv("COACH_NOVA_HISTORY_TURNS", DEFAULT_KEEP_TURNS))
+    return HistoryCompactor(keep_turns=keep_turns, token_budget=int(budget))
+
+
+# ============================================================================
+# BENCHMARK
+# ============================================================================
+
+FILLER_QUESTIONS = (
+    "How long should I rest between sets?",
+    "Should I do cardio before or after lifting?",
+    "What should I eat before a workout?",
+    "Is it okay to train when I'm sore?",
+    "How important is sleep for recovery?",
+    "Do I need to stretch before lifting?",
+)
+
+CHATTY_REPLY = (
+    "Great question! {topic} It really depends on your goals and how your body responds, but as a general "
+    "guideline most lifters do well with a consistent routine, good sleep, enough protein and gradual "
+    "progression. Listen to your body, keep a training log, and adjust as you go. Now, back to your plan: "
+    "is there anything else about your schedule, equipment or injuries I should know?"
+)
+
+
+def synthetic_conversation(example, turns):
+    """
+    A turns-long conversation: the example's exchanges, then chatty filler.
+
+    Args:
+        example: Extractor training example
+        turns: Total number of exchanges
+
+    Returns:
+        list: {"user": ..., "coach": ...} dicts
+    """
+    history = ast.literal_eval(example.conversation_history)[:turns]
+    for index in range(turns - len(history)):
+        question = FILLER_QUESTIONS[index % len(FILLER_QUESTIONS)]
+        history.append({"user": question, "coach": CHATTY_REPLY.format(topic=question)})
+    return history
+
+
+if __name__ == "__main__":
+    import time
+
+    import dspy
+
+    from modules import CoachAgent
+    from stub_lm import StubLM
+    from training_data import get_extractor_trainset
+
+    # Four information-gathering exchanges, then questions about rest, cardio, food, ...
+    example = get_extractor_trainset()[1]
+    coach = CoachAgent()
+    # 300ms to first token plus 0.1ms per prompt token of prefill
+    lm = StubLM(latency=0.3, prefill_delay=0.0001)
+    compactor = HistoryCompactor()
+
+    print("=" * 60)
+    print(f"HISTORY COMPACTION (keep {compactor.keep_turns} turns, budget {compactor.token_budget} tokens)")
+    print("=" * 60)
+    print(f"{'Turns':>5} | {'History tok':>13} | {'Prompt tok':>13} | {'Last-turn latency':>17} | "
+          f"{'Session history tok':>19}")
+    with dspy.context(lm=lm):
+        coach(conversation_history="[]", user_message="warm-up")
+        for turns in (5, 20, 50):
+            history = synthetic_conversation(example, turns)
+            session = {"full": 0, "compact": 0}
+            for turn in range(turns):
+                session["full"] += estimate_tokens(render_history(history[:turn]))
+                compacted = render_history(history[:turn], compactor)
+                session["compact"] += estimate_tokens(compacted)
+                assert estimate_tokens(compacted) <= compactor.token_budget
+
+            measured = {}
+            for mode, rendered in (("full", render_history(history[:-1])),
+                                   ("compact", render_history(history[:-1], compactor))):
+                start = time.perf_counter()
+                coach(conversation_history=rendered, user_message=history[-1]["user"])
+                measured[mode] = (
+                    estimate_tokens(rendered),
+                    lm.history[-1]["usage"]["prompt_tokens"],
+                    time.perf_counter() - start,
+                )
+            full, compact = measured["full"], measured["compact"]
+            print(
+                f"{turns:>5} | {full[0]:>5} -> {compact[0]:>4} | {full[1]:>5} -> {compact[1]:>4} | "
+                f"{full[2] * 1000:>6.0f} -> {compact[2] * 1000:>4.0f}ms | "
+                f"{session['full']:>8} -> {session['compact']:>6}"
+            )
+    print(f"\nCompactor stats: {compactor.stats}")
+    print("\nSample compacted history (50 turns):")
+    print(render_history(synthetic_conversation(example, 50)[:-1], HistoryCompactor())[:600] + " ...")
@@ -0,0 +1,267 @@
+"""
+Persistent LM Response Cache
+
+This module contains:
+- request_key: Hash of a request, shared with replay_lm.py
+- ResponseStore: Content-addressed SQLite store with TTL and LRU eviction
+- CachedLM: dspy.BaseLM wrapper that answers repeated prompts from the store
+- with_response_cache: Helper used by main.py and optimize.py
+
+The cache key is a SHA-256 of the model, the rendered chat messages (which
+hold the signature instructions, field descriptions, demos and inputs) and
+the LM kwargs. CachedLM sits *outside* RateLimitedLM, so a hit neither waits
+for the rate limiter nor spends any of the daily Gemini quota.
+
+Set COACH_NOVA_LM_CACHE=off to bypass the cache, or pass cache=False on a call.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import dspy
+
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "lm_responses.sqlite")
+DEFAULT_MAX_ENTRIES = 10_000
+DEFAULT_MAX_BYTES = 100 * 1024 * 1024
+DEFAULT_TTL = 7 * 24 * 60 * 60  # one week
+
+# Request kwargs that never change the response and must not leak into keys
+IGNORED_KWARGS = ("api_key", "api_base", "base_url", "cache")
+
+
+def cache_enabled_by_env():
+    """Return False when COACH_NOVA_LM_CACHE is set to off/0/false."""
+    return os.getenv("COACH_NOVA_LM_CACHE", "on").lower() not in ("off", "0", "false", "no")
+
+
+def request_key(model, prompt, messages, kwargs):
+    """
+    Identify an LM request by everything that can change its response.
+
+    Args:
+        model: Model name
+        prompt: Plain prompt, if any
+        messages: Chat messages formatted by the adapter, if any
+        kwargs: Request kwargs (IGNORED_KWARGS are left out)
+
+    Returns:
+        str: SHA-256 hex digest
+    """
+    request = {
+        "model": model,
+        "prompt": prompt,
+        "messages": messages,
+        "kwargs": {k: v for k, v in kwargs.items() if k not in IGNORED_KWARGS},
+    }
+    encoded = json.dumps(request, sort_keys=True, default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+# ============================================================================
+# RESPONSE STORE
+# ============================================================================
+
+class ResponseStore:
+    """
+    SQLite-backed key/value store for LM outputs.
+
+    Entries older than ttl seconds are treated as misses. When the store
+    exceeds max_entries or max_bytes, least recently used entries are
+    removed. A single connection is shared by all threads behind a lock, and
+    deep copies (dspy's lm.copy()) share the same store.
+    """
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_entries=DEFAULT_MAX_ENTRIES,
+                 max_bytes=DEFAULT_MAX_BYTES, ttl=DEFAULT_TTL):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+            "created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        self._conn.commit()
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def get(self, key):
+        """Return the cached value for key, or None on a miss or expired entry."""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            value, created = row
+            if self.ttl is not None and now - created > self.ttl:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+        return json.loads(value)
+
+    def put(self, key, value):
+        """Store a JSON-serializable value and evict entries over the limits."""
+        payload = json.dumps(value)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, payload, len(payload), now, now)
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        count, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        while count > self.max_entries or total > self.max_bytes:
+            key, size = self._conn.execute(
+                "SELECT key, size FROM responses ORDER BY accessed ASC LIMIT 1"
+            ).fetchone()
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self.evictions += 1
+            count -= 1
+            total -= size
+
+    def clear(self):
+        """Remove every entry."""
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+
+# ============================================================================
+# CACHED LM
+# ============================================================================
+
+class CachedLM(dspy.BaseLM):
+    """
+    Wrapper around any dspy LM that serves repeated requests from a ResponseStore.
+
+    Only plain-text outputs are cached; responses carrying tool calls or
+    logprobs always go to the wrapped LM.
+    """
+    def __init__(self, lm, store=None, enabled=None):
+        super().__init__(model=lm.model, model_type=lm.model_type, cache=False)
+        self.kwargs = dict(lm.kwargs)
+        self.lm = lm
+        self.store = store if store is not None else ResponseStore()
+        self.enabled = cache_enabled_by_env() if enabled is None else enabled
+        self.hits = 0
+        self.misses = 0
+
+    def cache_key(self, prompt, messages, kwargs):
+        """SHA-256 of model, rendered prompt/messages and response-affecting kwargs."""
+        return request_key(self.model, prompt, messages, kwargs)
+
+    def _lookup(self, prompt, messages, kwargs):
+        if not self.enabled or kwargs.get("cache") is False:
+            return None, None
+        key = self.cache_key(prompt, messages, kwargs)
+        outputs = self.store.get(key)
+        if outputs is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return key, outputs
+
+    def _save(self, key, outputs):
+        if key is not None and all(isinstance(output, str) for output in outputs):
+            self.store.put(key, outputs)
+        return outputs
+
+    def __call__(self, prompt=None, messages=None, **kwargs):
+        kwargs = {**self.kwargs, **kwargs}
+        key, outputs = self._lookup(prompt, messages, kwargs)
+        if outputs is not None:
+            return outputs
+        return self._save(key, self.lm(prompt=prompt, messages=messages, **kwargs))
+
+    async def acall(self, prompt=None, messages=None, **kwargs):
+        kwargs = {**self.kwargs, **kwargs}
+        key, outputs = self._lookup(prompt, messages, kwargs)
+        if outputs is not None:
+            return outputs
+        return self._save(key, await self.lm.acall(prompt=prompt, messages=messages, **kwargs))
+
+    def stats(self):
+        """Hit/miss/eviction counters for this wrapper."""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.store.evictions,
+            "entries": len(self.store),
+        }
+
+
+def with_response_cache(lm, **store_kwargs):
+    """
+    Wrap lm in a CachedLM unless COACH_NOVA_LM_CACHE=off.
+
+    Args:
+        lm: dspy LM to wrap (e.g. dspy.LM or RateLimitedLM)
+        **store_kwargs: Options for ResponseStore (path, max_entries, max_bytes, ttl)
+
+    Returns:
+        dspy.BaseLM: CachedLM, or lm unchanged when the cache is bypassed
+    """
+    if not cache_enabled_by_env():
+        return lm
+    return CachedLM(lm, store=ResponseStore(**store_kwargs))
+
+
+def print_cache_stats(lm):
+    """Print cache counters if lm is a CachedLM."""
+    if isinstance(lm, CachedLM):
+        stats = lm.stats()
+        print(
+            f"[LM cache] {stats['hits']} hits / {stats['misses']} misses "
+            f"({stats['hit_rate']:.0%} hit rate), {stats['entries']} entries, "
+            f"{stats['evictions']} evicted"
+        )
+
+
+if __name__ == "__main__":
+    import tempfile
+
+    from modules import InfoExtractor
+    from stub_lm import StubLM
+    from training_data import get_extractor_trainset
+
+    with tempfile.TemporaryDirectory() as tmp:
+        lm = CachedLM(StubLM(latency=0.05), store=ResponseStore(os.path.join(tmp, "cache.sqlite")))
+        dspy.configure(lm=lm)
+        extractor = InfoExtractor()
+        trainset = get_extractor_trainset()
+
+        print("=" * 60)
+        print("LM RESPONSE CACHE (StubLM, 50ms per call)")
+        print("=" * 60)
+        for run in ("cold", "warm"):
+            start = time.perf_counter()
+            for example in trainset:
+                extractor(conversation_history=example.conversation_history)
+            elapsed = time.perf_counter() - start
+            print(f"{run:>4} run: {elapsed * 1000:7.1f}ms for {len(trainset)} extractions")
+        print_cache_stats(lm)
@@ -7,7 +7,76 @@ information extraction, and workout generation using DSPy modules.
 
 import os
 import dspy
-from modules import CoachAgent, InfoExtractor, WorkoutGenerator
+from modules import CoachAgent, IncrementalExtractor, WorkoutGenerator
+from extraction_state import ExtractionState
+from lm_cache import CachedLM, with_response_cache, print_cache_stats
+from sessions import find_missing_fields, build_generator_inputs
+from workout_stream import stream_workout
+from pipeline import SpeculativePipeline
+from artifacts import load_startup_modules
+from output_repair import RepairingAdapter, print_repair_stats
+from workout_templates import TemplateWorkoutGenerator
+from replay_lm import lm_from_env, lm_mode_from_env, print_replay_stats
+from model_routing import routes_from_env, route_modules, print_routing_stats
+from telemetry import tracer_from_env, close_tracer
+from history_compaction import compactor_from_env, render_history
+from execution_modes import modes_from_env, set_execution_mode
+from weight_prescription import PrescribedWorkoutGenerator
+from workout_cache import CachedWorkoutGenerator
+
+
+def print_exercise(exercise):
+    """Print one exercise and its sets"""
+    print(f"{exercise.name}:")
+    for i, set_obj in enumerate(exercise.sets, 1):
+        weight_str = f" @ {set_obj.weight}lbs" if set_obj.weight else ""
+        print(f"  Set {i}: {set_obj.reps} reps ({set_obj.setType}){weight_str}")
+    print(flush=True)
+
+
+def render_workout(workout):
+    """Print a complete Workout"""
+    print("=" * 60)
+    print("YOUR PERSONALIZED WORKOUT")
+    print("=" * 60)
+    print(f"\nFocus: {workout.workoutFocus}\n")
+
+    for exercise in workout.exercises:
+        print_exercise(exercise)
+
+    if workout.notes:
+        print(f"Notes: {workout.notes}")
+    print("=" * 60)
+
+
+def render_workout_stream(stream):
+    """
+    Print a workout progressively, one exercise as soon as it is generated.
+
+    Args:
+        stream: WorkoutStream from stream_workout()
+
+    Returns:
+        dspy.Prediction: The complete generator prediction
+    """
+    print("=" * 60)
+    print("YOUR PERSONALIZED WORKOUT")
+    print("=" * 60)
+
+    focus_shown = False
+    for exercise in stream:
+        if not focus_shown and "workoutFocus" in stream.fields:
+            print(f"\nFocus: {stream.fields['workoutFocus']}\n")
+            focus_shown = True
+        print_exercise(exercise)
+
+    workout = stream.prediction.workout
+    if not focus_shown:
+        print(f"Focus: {workout.workoutFocus}\n")
+    if workout.notes:
+        print(f"Notes: {workout.notes}")
+    print("=" * 60)
+    return stream.prediction
 
 
 def main():
@@ -15,19 +84,88 @@ def main():
 
     # Configure DSPy with Gemini model
     api_key = os.getenv("GOOGLE_GENERATIVE_AI_API_KEY")
-    if not api_key:
+    if not api_key and lm_mode_from_env() != "replay":
         print("Error: GOOGLE_GENERATIVE_AI_API_KEY environment variable not set")
         return
 
-    dspy.configure(lm=dspy.LM("gemini/gemini-2.0-flash-exp", api_key=api_key))
+    # Repeated prompts are answered from the on-disk cache (COACH_NOVA_LM_CACHE=off to bypass);
+    # COACH_NOVA_LM_MODE=record/replay captures or replays the session (see replay_lm.py)
+    lm = lm_from_env(lambda: with_response_cache(dspy.LM("gemini/gemini-2.0-flash-exp", api_key=api_key)))
+    # PrefixCachingAdapter renders each prompt prefix once (artifact loads pre-seed it); the
+    # RepairingAdapter subclass fixes malformed typed outputs locally (see output_repair.py)
+    adapter = RepairingAdapter()
+    dspy.configure(lm=lm, adapter=adapter)
 
-    # Initialize modules
+    # COACH_NOVA_METRICS_PORT serves OpenMetrics at /metrics, COACH_NOVA_TRACE_FILE
+    # appends every module/LM span as JSONL (see telemetry.py)
+    tracer = tracer_from_env()
+    if tracer:
+        dspy.configure(callbacks=[tracer])
+        if isinstance(lm, CachedLM):
+            tracer.registry.export_stats("lm_cache", lm.stats, "On-disk LM response cache")
+        tracer.registry.export_stats("output_repair", adapter.stats, "Structured output repair")
+
+    # Initialize modules, with optimized artifacts from optimize.py where available
     coach = CoachAgent()
-    extractor = InfoExtractor()
+    extractor = IncrementalExtractor()
     generator = WorkoutGenerator()
+    for name, outcome in load_startup_modules(coach, extractor, generator).items():
+        print(f"[Startup] Optimized {name}: {outcome}")
+
+    # COACH_NOVA_FAST_MODE=direct (or e.g. coach=direct,generator=brief) skips or shortens the
+    # hidden reasoning field of each module (see execution_modes.py)
+    modules = {"coach": coach, "extractor": extractor, "generator": generator}
+    for name, mode in modes_from_env().items():
+        set_execution_mode(modules[name], mode)
+        print(f"[Startup] {name} execution mode: {mode}")
+
+    # COACH_NOVA_ROUTES=default (or e.g. coach=m1,extractor=m1>m2,generator=m3) gives each module
+    # its own model, with a cheap-first cascade for extraction (see model_routing.py)
+    routing_log = None
+    routes = routes_from_env()
+    if routes:
+        def build_lm(model):
+            return lm_from_env(lambda: with_response_cache(dspy.LM(model, api_key=api_key)), name=model)
+
+        extractor, routing_log = route_modules(routes, build_lm, coach, extractor, generator)
+
+    # COACH_NOVA_WEIGHTS=local has the LM plan exercises and reps only and prescribes the weights
+    # from primary_lift_pr (see weight_prescription.py); such workouts are not streamed
+    prescriber = None
+    if os.getenv("COACH_NOVA_WEIGHTS", "lm").lower() == "local":
+        prescriber = PrescribedWorkoutGenerator(generator)
+        if tracer:
+            tracer.registry.export_stats("weights", prescriber.stats, "Local weight prescription")
 
-    # Conversation history
+    # COACH_NOVA_WORKOUT_CACHE=on reuses recent workouts for the same (or nearly the same)
+    # requirements instead of generating them again (see workout_cache.py)
+    workout_cache = None
+    if os.getenv("COACH_NOVA_WORKOUT_CACHE", "off").lower() in ("on", "1", "true", "yes"):
+        workout_cache = CachedWorkoutGenerator(prescriber or generator)
+        if tracer:
+            tracer.registry.export_stats("workout_cache", workout_cache.cache.stats, "Semantic workout cache")
+
+    # COACH_NOVA_TEMPLATES=on serves common requests from templates (see workout_templates.py)
+    templates = None
+    if os.getenv("COACH_NOVA_TEMPLATES", "off").lower() in ("on", "1", "true", "yes"):
+        templates = TemplateWorkoutGenerator(workout_cache or prescriber or generator)
+        if tracer:
+            tracer.registry.export_stats("templates", templates.stats, "Template workout library")
+
+    # Conversation history and incrementally extracted requirements
     history = []
+    extraction = ExtractionState()
+
+    # COACH_NOVA_HISTORY_BUDGET=<tokens> compacts older turns for the coach (see history_compaction.py)
+    compactor = compactor_from_env()
+
+    # COACH_NOVA_PIPELINE=on overlaps extraction with the coach call (see pipeline.py)
+    pipeline = None
+    if os.getenv("COACH_NOVA_PIPELINE", "off").lower() in ("on", "1", "true", "yes"):
+        pipeline = SpeculativePipeline(coach, extractor, templates or workout_cache or prescriber or generator,
+                                       history_compactor=compactor)
+        if tracer:
+            tracer.registry.export_stats("pipeline", pipeline.stats, "Speculative turn pipeline")
 
     print("=" * 60)
     print("Welcome to Coach Nova - Your AI Fitness Coach!")
@@ -51,77 +189,76 @@ def main():
 
         # Get coach response
         try:
-            result = coach(
-                conversation_history=str(history),
-                user_message=user_msg
-            )
-
-            print(f"\nCoach Nova: {result.response}\n")
-            history.append({"user": user_msg, "coach": result.response})
-
-            # Check if ready to generate workout
-            if result.should_extract.lower() == "true":
-                print("\n[Analyzing your requirements...]\n")
-
-                # Extract structured information
-                extracted = extractor(conversation_history=str(history))
-
-                # Check if all required fields are present
-                required_fields = {
-                    "goal": extracted.goal,
-                    "equipment": extracted.equipment,
-                    "duration": extracted.duration,
-                    "focus": extracted.focus
-                }
-
-                missing_fields = [k for k, v in required_fields.items() if not v or v == "null"]
-
-                if not missing_fields:
-                    print("[Generating your personalized workout...]\n")
-
-                    # Generate workout with Pydantic output
-                    workout = generator(
-                        fitness_level=extracted.fitness_level if extracted.fitness_level != "null" else "intermediate",
-                        goal=extracted.goal,
-                        focus=extracted.focus,
-                        equipment=extracted.equipment,
-                        duration=extracted.duration,
-                        space=extracted.space if extracted.space != "null" else "gym",
-                        injuries=extracted.injuries if extracted.injuries != "null" else "none",
-                        primary_lift_pr=extracted.primary_lift_pr if extracted.primary_lift_pr != "null" else "none"
-                    )
-
-                    # Display workout (Pydantic object formatting)
-                    print("=" * 60)
-                    print("YOUR PERSONALIZED WORKOUT")
-                    print("=" * 60)
-                    print(f"\nFocus: {workout.workout.workoutFocus}\n")
-
-                    for exercise in workout.workout.exercises:
-                        print(f"{exercise.name}:")
-                        for i, set_obj in enumerate(exercise.sets, 1):
-                            weight_str = f" @ {set_obj.weight}lbs" if set_obj.weight else ""
-                            print(f"  Set {i}: {set_obj.reps} reps ({set_obj.setType}){weight_str}")
-                        print()
-
-                    if workout.workout.notes:
-                        print(f"Notes: {workout.workout.notes}")
-                    print("=" * 60)
-
-                    # Ask if user wants to continue
-                    cont = input("\nWould you like to create another workout? (yes/no): ").strip().lower()
-                    if cont not in ["yes", "y"]:
-                        print("\nGoodbye! Stay fit!")
-                        break
+            workout_shown = False
+
+            if pipeline:
+                # Extraction and speculative generation overlap the coach call
+                turn = pipeline.turn(user_msg)
+                print(f"\nCoach Nova: {turn.response}\n")
+
+                if turn.workout is not None:
+                    render_workout(turn.workout)
+                    workout_shown = True
+                elif turn.should_extract:
+                    print(f"[Still gathering info - missing: {', '.join(turn.missing_fields)}]\n")
+            else:
+                result = coach(
+                    conversation_history=render_history(history, compactor, extraction.fields),
+                    user_message=user_msg
+                )
+
+                print(f"\nCoach Nova: {result.response}\n")
+                history.append({"user": user_msg, "coach": result.response})
+                extraction.add_exchange(user_msg, result.response)
+
+                # Check if ready to generate workout
+                if result.should_extract.lower() == "true":
+                    print("\n[Analyzing your requirements...]\n")
+
+                    # Extract structured information from the messages since the last extraction
+                    extracted = extraction.extract(extractor)
+
+                    # Check if all required fields are present
+                    missing_fields = find_missing_fields(extracted)
+
+                    if not missing_fields:
+                        print("[Generating your personalized workout...]\n")
+
+                        inputs = build_generator_inputs(extracted)
+                        served = templates.serve(**inputs) if templates else None
+                        if served is None and workout_cache:
+                            served = workout_cache.cache.get(inputs)
+                        if served is None and prescriber:
+                            served = prescriber(**inputs)
+                            if workout_cache:
+                                workout_cache.cache.put(inputs, served)
+                        if served is not None:
+                            render_workout(served.workout)
+                        else:
+                            # Stream the workout, printing each exercise once it validates
+                            generated = render_workout_stream(stream_workout(generator, **inputs))
+                            if workout_cache:
+                                workout_cache.cache.put(inputs, generated)
+                        workout_shown = True
                     else:
-                        # Reset history for new workout
-                        history = []
-                        print("\n" + "=" * 60)
-                        print("Let's create a new workout!")
-                        print("=" * 60 + "\n")
+                        # Not enough information yet, continue conversation
+                        print(f"[Still gathering info - missing: {', '.join(missing_fields)}]\n")
+
+            if workout_shown:
+                # Ask if user wants to continue
+                cont = input("\nWould you like to create another workout? (yes/no): ").strip().lower()
+                if cont not in ["yes", "y"]:
+                    print("\nGoodbye! Stay fit!")
+                    break
                 else:
-                    # Not enough information yet, continue conversation
-                    print(f"[Still gathering info - missing: {', '.join(missing_fields)}]\n")
+                    # Reset history for new workout
+                    history = []
+                    extraction = ExtractionState()
+                    if pipeline:
+                        pipeline.reset()
+                    print("\n" + "=" * 60)
+                    print("Let's create a new workout!")
+                    print("=" * 60 + "\n")
 
         except Exception as e:
             print(f"\nError: {e}")
@@ -132,6 +269,13 @@ def main():
     print("Session Complete - Inspecting DSPy History")
     print("=" * 60)
     dspy.inspect_history(n=3)
+    print_cache_stats(lm)
+    print_replay_stats(lm)
+    print_routing_stats(routing_log)
+    print_repair_stats(adapter)
+    if pipeline:
+        pipeline.close()
+    close_tracer(tracer)
 
 
 if __name__ == "__main__":
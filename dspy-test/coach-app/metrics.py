@@ -8,6 +8,9 @@ This module contains metric functions for evaluating:
 
 import json
 
+from exercise_catalog import uses_allowed_equipment
+from output_repair import strip_fences
+
 
 def extraction_accuracy(example, prediction, trace=None):
     """
@@ -46,24 +49,19 @@ def extraction_accuracy(example, prediction, trace=None):
     return score / total_fields
 
 
-def workout_quality(example, prediction, trace=None):
+def parse_workout(prediction):
     """
-    Evaluate the quality of a generated workout plan.
+    Extract the workout as plain data from a WorkoutGenerator prediction.
 
-    Checks that the workout:
-    - Has valid JSON format
-    - Contains appropriate number of exercises for duration
-    - Exercises match the specified focus area
-    - Rep ranges match the training goal
-    - Only uses specified equipment
+    Accepts a Pydantic Workout, a dict, or a JSON string (optionally wrapped
+    in markdown code fences) in prediction.workout, or a legacy
+    prediction.workout_json string.
 
     Args:
-        example: dspy.Example with input requirements and expected output
         prediction: Prediction from WorkoutGenerator module
-        trace: Optional trace information (not used)
 
     Returns:
-        float: Score between 0.0 and 1.0
+        dict or None: Parsed workout data, or None if it cannot be parsed
     """
     try:
         # Handle different output formats
@@ -75,31 +73,40 @@ def workout_quality(example, prediction, trace=None):
             elif isinstance(workout_obj, dict):
                 workout_data = workout_obj
             elif isinstance(workout_obj, str):
-                # If it's a JSON string, try to parse it
-                # Remove markdown code fences if present
-                workout_str = workout_obj.strip()
-                if workout_str.startswith('```'):
-                    # Extract JSON from markdown code block
-                    lines = workout_str.split('\n')
-                    # Skip first line (```json or ```)
-                    json_lines = []
-                    in_code = False
-                    for line in lines:
-                        if line.strip().startswith('```'):
-                            if in_code:
-                                break
-                            in_code = True
-                            continue
-                        if in_code:
-                            json_lines.append(line)
-                    workout_str = '\n'.join(json_lines)
-                workout_data = json.loads(workout_str)
+                # If it's a JSON string, parse it without markdown code fences
+                workout_data = json.loads(strip_fences(workout_obj))
             else:
-                return 0.0
+                return None
         else:
             # Fallback: try workout_json for backwards compatibility
             workout_data = json.loads(prediction.workout_json)
     except (json.JSONDecodeError, AttributeError, ValueError):
+        return None
+
+    return workout_data
+
+
+def workout_quality(example, prediction, trace=None):
+    """
+    Evaluate the quality of a generated workout plan.
+
+    Checks that the workout:
+    - Has valid JSON format
+    - Contains appropriate number of exercises for duration
+    - Exercises match the specified focus area
+    - Rep ranges match the training goal
+    - Only uses specified equipment
+
+    Args:
+        example: dspy.Example with input requirements and expected output
+        prediction: Prediction from WorkoutGenerator module
+        trace: Optional trace information (not used)
+
+    Returns:
+        float: Score between 0.0 and 1.0
+    """
+    workout_data = parse_workout(prediction)
+    if workout_data is None:
         # Invalid data gets 0 score
         return 0.0
 
@@ -177,19 +184,11 @@ def workout_quality(example, prediction, trace=None):
 
         for ex in exercises:
             if "name" in ex:
-                exercise_name = ex["name"].lower()
-
-                # Check if exercise uses appropriate equipment
-                if equipment == "bodyweight":
-                    if any(word in exercise_name for word in ["dumbbell", "barbell", "cable", "machine"]):
-                        equipment_appropriate = False
-                elif equipment == "dumbbells":
-                    if any(word in exercise_name for word in ["barbell", "cable", "machine"]):
-                        equipment_appropriate = False
-                elif equipment == "barbell":
-                    if any(word in exercise_name for word in ["dumbbell", "cable", "machine"]):
-                        equipment_appropriate = False
+                # Check if exercise uses appropriate equipment via the exercise catalog
+                # (names missing from the catalog fall back to equipment words)
                 # For cables and machines, more flexibility
+                if not uses_allowed_equipment(ex["name"], equipment):
+                    equipment_appropriate = False
 
         if equipment_appropriate:
             score += 1.0
@@ -0,0 +1,456 @@
+"""
+Per-Module Model Routing and Extraction Cascade
+
+This module contains:
+- RoutingLog: Every routed LM call (model, latency, estimated tokens and
+  cost) and every cascade decision, optionally appended to a JSONL file
+- RoutedLM: dspy.BaseLM wrapper that records its calls under a route name
+- CascadeExtractor: Runs an extractor on a small model first and escalates
+  to the next model when its answer is not good enough
+- route_modules: Assigns one LM (or cascade) per module
+- routes_from_env: Routes configured from COACH_NOVA_ROUTES
+
+A single LM used to serve every module, so the short CoachAgent turn paid
+the same per-token price as GenerateWorkout. Routes name the models for
+"coach", "extractor" and "generator"; a route with several models becomes a
+cascade (cheapest first). The extractor cascade accepts an answer when every
+enum/duration value is one of the documented choices and, for InfoExtractor,
+every required field is filled; otherwise, or when the completion cannot be
+parsed, the next model is tried and the escalation is logged with its
+reason. IncrementalExtractor answers are not escalated for null fields,
+which stay null until the user mentions them. Running this file plays the
+training conversations with IncrementalExtractor on every turn (as in
+pipeline mode), comparing one strong model for everything with routing plus
+the extraction cascade, using StubLMs with the latency of each tier, and
+reports cost, latency, escalations and extraction accuracy.
+"""
+
+import json
+import os
+import threading
+import time
+
+import dspy
+from dspy.utils.exceptions import AdapterParseError
+
+from extraction_state import EXTRACTION_FIELDS, ExtractionState, is_confident, normalize_value
+from modules import IncrementalExtractor
+from sessions import REQUIRED_FIELDS, percentile
+from token_estimate import estimate_tokens
+from workout_stream import stream_completion
+
+
+# List prices in USD per 1M (input, output) tokens; unknown models cost 0
+MODEL_PRICES = {
+    "gemini/gemini-2.0-flash-lite": (0.075, 0.30),
+    "gemini/gemini-2.0-flash": (0.10, 0.40),
+    "gemini/gemini-2.0-flash-exp": (0.10, 0.40),
+    "gemini/gemini-2.5-flash": (0.30, 2.50),
+    "gemini/gemini-2.5-pro": (1.25, 10.00),
+}
+
+# Cheap model for the chat turn, cascade for extraction, the original model for generation
+DEFAULT_ROUTES = {
+    "coach": ("gemini/gemini-2.0-flash-lite",),
+    "extractor": ("gemini/gemini-2.0-flash-lite", "gemini/gemini-2.0-flash-exp"),
+    "generator": ("gemini/gemini-2.0-flash-exp",),
+}
+ROUTE_NAMES = tuple(DEFAULT_ROUTES)
+
+
+def call_cost(model, prompt_tokens, completion_tokens):
+    """USD cost of one call at MODEL_PRICES."""
+    input_price, output_price = MODEL_PRICES.get(model, (0.0, 0.0))
+    return (prompt_tokens * input_price + completion_tokens * output_price) / 1_000_000
+
+
+# ============================================================================
+# ROUTING LOG
+# ============================================================================
+
+class RoutingLog:
+    """
+    Records of routed calls and cascade decisions, shared by all RoutedLMs.
+
+    Each record is a dict with "kind" "call" (route, model, latency,
+    prompt/completion tokens, cost, error) or "escalation" (route, model it
+    escalated from, reason). With path set, records are also appended to
+    that JSONL file.
+    """
+    def __init__(self, path=None):
+        self.path = path
+        self.records = []
+        self._lock = threading.Lock()
+        if path and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def record(self, kind, **fields):
+        entry = {"kind": kind, "time": time.time(), **fields}
+        with self._lock:
+            self.records.append(entry)
+            if self.path:
+                with open(self.path, "a") as f:
+                    f.write(json.dumps(entry) + "\n")
+        return entry
+
+    def summary(self):
+        """
+        Per-route totals.
+
+        Returns:
+            dict: route -> {calls, models: {model: calls}, escalations,
+            cost, p50_latency, p90_latency}
+        """
+        routes = {}
+        with self._lock:
+            records = list(self.records)
+        for entry in records:
+            route = routes.setdefault(entry["route"], {
+                "calls": 0, "models": {}, "escalations": 0, "cost": 0.0, "latencies": [],
+            })
+            if entry["kind"] == "escalation":
+                route["escalations"] += 1
+                continue
+            route["calls"] += 1
+            route["models"][entry["model"]] = route["models"].get(entry["model"], 0) + 1
+            route["cost"] += entry["cost"]
+            route["latencies"].append(entry["latency"])
+        for route in routes.values():
+            latencies = route.pop("latencies")
+            route["p50_latency"] = percentile(latencies, 50)
+            route["p90_latency"] = percentile(latencies, 90)
+        return routes
+
+
+class RoutedLM(dspy.BaseLM):
+    """
+    dspy.BaseLM wrapper that logs each call of lm under a route name.
+
+    Tokens are estimated from the prompt and completion text (about 4
+    characters per token) so that every backend, including StubLM and
+    replayed calls, is costed the same way.
+    """
+    def __init__(self, lm, route, log):
+        super().__init__(model=lm.model, model_type=lm.model_type, **lm.kwargs)
+        self.lm = lm
+        self.route = route
+        self.log = log
+
+    def _record(self, prompt, messages, outputs, latency, error=None):
+        prompt_tokens = estimate_tokens(prompt or "") if messages is None else sum(
+            estimate_tokens(str(message.get("content") or "")) for message in messages
+        )
+        completion_tokens = sum(
+            estimate_tokens(output if isinstance(output, str) else str(output.get("text") or ""))
+            for output in outputs or []
+        )
+        self.log.record(
+            "call", route=self.route, model=self.model, latency=latency,
+            prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+            cost=call_cost(self.model, prompt_tokens, completion_tokens),
+            **({"error": type(error).__name__} if error else {}),
+        )
+
+    def __call__(self, prompt=None, messages=None, **kwargs):
+        start = time.perf_counter()
+        try:
+            outputs = self.lm(prompt=prompt, messages=messages, **kwargs)
+        except Exception as e:
+            self._record(prompt, messages, None, time.perf_counter() - start, e)
+            raise
+        self._record(prompt, messages, outputs, time.perf_counter() - start)
+        return outputs
+
+    async def acall(self, prompt=None, messages=None, **kwargs):
+        start = time.perf_counter()
+        try:
+            outputs = await self.lm.acall(prompt=prompt, messages=messages, **kwargs)
+        except Exception as e:
+            self._record(prompt, messages, None, time.perf_counter() - start, e)
+            raise
+        self._record(prompt, messages, outputs, time.perf_counter() - start)
+        return outputs
+
+    def stream(self, prompt=None, messages=None, **kwargs):
+        """Stream from the wrapped LM (see workout_stream.stream_completion) and record the result."""
+        messages = messages or [{"role": "user", "content": prompt}]
+        start = time.perf_counter()
+        chunks = []
+        for chunk in stream_completion(self.lm, messages):
+            chunks.append(chunk)
+            yield chunk
+        self._record(None, messages, ["".join(chunks)], time.perf_counter() - start)
+
+
+# ============================================================================
+# CASCADE
+# ============================================================================
+
+class CascadeExtractor(dspy.Module):
+    """
+    Extractor that escalates through LMs ordered cheapest first.
+
+    Wraps InfoExtractor or IncrementalExtractor; for the latter only the
+    requested open_fields are checked. A null required field triggers
+    escalation, which suits InfoExtractor reading a complete conversation.
+    Incremental extraction asks for open fields that are legitimately null
+    until the user mentions them, so it should use required=() and only
+    escalate on invalid values and parse failures (route_modules does
+    this). The last LM's answer is returned as-is.
+
+    Args:
+        extractor: Module whose predictors have no LM of their own
+        lms: LMs to try in order, usually RoutedLMs
+        log: RoutingLog receiving escalation decisions
+        required: Fields that must not come back null
+        route: Route name used in the log
+    """
+    def __init__(self, extractor, lms, log, required=REQUIRED_FIELDS, route="extractor"):
+        super().__init__()
+        self.extractor = extractor
+        self.lms = list(lms)
+        self.log = log
+        self.required = tuple(required)
+        self.route = route
+
+    def escalation_reason(self, prediction, open_fields=None):
+        """
+        Why a prediction is not good enough, or None to accept it.
+
+        Args:
+            prediction: Extractor prediction
+            open_fields: Fields that were asked for (all if None)
+
+        Returns:
+            str or None: e.g. "missing goal,duration" or "invalid focus"
+        """
+        requested = EXTRACTION_FIELDS if open_fields is None else open_fields
+        values = {name: normalize_value(getattr(prediction, name, None)) for name in requested}
+        missing = [name for name in self.required if name in values and values[name] == "null"]
+        if missing:
+            return "missing " + ",".join(missing)
+        invalid = [name for name, value in values.items() if value != "null" and not is_confident(name, value)]
+        if invalid:
+            return "invalid " + ",".join(invalid)
+        return None
+
+    def _next(self, tier, prediction, error, open_fields):
+        """Return the escalation reason for tier's outcome, or None to stop there."""
+        if tier == len(self.lms) - 1:
+            return None
+        reason = f"parse error ({type(error).__name__})" if error else self.escalation_reason(prediction, open_fields)
+        if reason:
+            self.log.record("escalation", route=self.route, model=self.lms[tier].model, reason=reason)
+        return reason
+
+    def forward(self, **kwargs):
+        for tier, lm in enumerate(self.lms):
+            prediction = error = None
+            try:
+                with dspy.context(lm=lm):
+                    prediction = self.extractor(**kwargs)
+            except (AdapterParseError, ValueError) as e:
+                if tier == len(self.lms) - 1:
+                    raise
+                error = e
+            if not self._next(tier, prediction, error, kwargs.get("open_fields")):
+                return prediction
+
+    async def aforward(self, **kwargs):
+        for tier, lm in enumerate(self.lms):
+            prediction = error = None
+            try:
+                with dspy.context(lm=lm):
+                    prediction = await self.extractor.acall(**kwargs)
+            except (AdapterParseError, ValueError) as e:
+                if tier == len(self.lms) - 1:
+                    raise
+                error = e
+            if not self._next(tier, prediction, error, kwargs.get("open_fields")):
+                return prediction
+
+
+# ============================================================================
+# ROUTE ASSIGNMENT
+# ============================================================================
+
+def parse_routes(spec):
+    """
+    Parse a routes spec like "coach=m1,extractor=m1>m2,generator=m3".
+
+    "default" selects DEFAULT_ROUTES; routes not named keep their default.
+
+    Args:
+        spec: Routes spec string
+
+    Returns:
+        dict: route -> tuple of models, cheapest first
+    """
+    routes = dict(DEFAULT_ROUTES)
+    if spec.strip().lower() == "default":
+        return routes
+    for part in filter(None, (part.strip() for part in spec.split(","))):
+        route, _, models = part.partition("=")
+        if route not in ROUTE_NAMES or not models:
+            raise ValueError(f"Bad route {part!r}; expected <{'|'.join(ROUTE_NAMES)}>=model[>model...]")
+        routes[route] = tuple(model.strip() for model in models.split(">"))
+    return routes
+
+
+def routes_from_env():
+    """Routes from COACH_NOVA_ROUTES ("default" or a parse_routes spec), or None when unset/off."""
+    spec = os.getenv("COACH_NOVA_ROUTES", "off")
+    if spec.strip().lower() in ("", "off", "0", "false", "no"):
+        return None
+    return parse_routes(spec)
+
+
+def route_modules(routes, build_lm, coach, extractor, generator, log=None, required=None):
+    """
+    Give each module the LM of its route; a multi-model extractor route becomes a CascadeExtractor.
+
+    Call this after optimized artifacts are loaded (loading resets predictor LMs).
+
+    Args:
+        routes: route -> models, e.g. from parse_routes
+        build_lm: Callable model -> LM; each model is built once
+        coach: CoachAgent
+        extractor: InfoExtractor or IncrementalExtractor
+        generator: WorkoutGenerator (or a wrapper with named_predictors)
+        log: RoutingLog (a new one if None)
+        required: Fields whose null triggers escalation in the cascade; None
+            means () for IncrementalExtractor and REQUIRED_FIELDS otherwise
+
+    Returns:
+        tuple: (extractor to use, RoutingLog)
+    """
+    log = log or RoutingLog()
+    built = {}
+
+    def routed(route, model):
+        if model not in built:
+            built[model] = build_lm(model)
+        return RoutedLM(built[model], route, log)
+
+    coach.set_lm(routed("coach", routes["coach"][-1]))
+    generator.set_lm(routed("generator", routes["generator"][-1]))
+    models = routes["extractor"]
+    if len(models) == 1:
+        extractor.set_lm(routed("extractor", models[0]))
+        return extractor, log
+    if required is None:
+        required = () if isinstance(extractor, IncrementalExtractor) else REQUIRED_FIELDS
+    lms = [routed("extractor", model) for model in models]
+    return CascadeExtractor(extractor, lms, log, required=required), log
+
+
+def print_routing_stats(log):
+    """Print per-route calls, models, escalations, cost and latency."""
+    if log is None:
+        return
+    for route, stats in log.summary().items():
+        models = ", ".join(f"{model} x{count}" for model, count in stats["models"].items())
+        print(f"[Routing] {route}: {stats['calls']} calls ({models}), {stats['escalations']} escalated, "
+              f"${stats['cost']:.5f}, p50 {stats['p50_latency'] * 1000:.0f}ms")
+
+
+if __name__ == "__main__":
+    from benchmark import EXTRACTION_LABELS, build_scripts, script_lm
+    from metrics import extraction_accuracy
+    from modules import CoachAgent, WorkoutGenerator
+    from sessions import build_generator_inputs, find_missing_fields
+    from training_data import get_extractor_trainset
+
+    cheap_model, strong_model = "gemini/gemini-2.0-flash-lite", "gemini/gemini-2.5-pro"
+    scripts = build_scripts()
+    examples = get_extractor_trainset()
+    # Labels of the conversation being played and how far into it we are
+    progress = {"labels": None, "fraction": 0.0}
+
+    def mentioned(messages, name):
+        """A label once the conversation is far enough along to have mentioned it, else null."""
+        position = (EXTRACTION_LABELS.index(name) + 1) / len(EXTRACTION_LABELS)
+        return progress["labels"][name] if progress["fraction"] >= position else "null"
+
+    def build_stub(model):
+        """Scripted StubLM with the latency of its tier; the cheap one fumbles some fields."""
+        strong = model == strong_model
+        lm = script_lm(scripts, latency=0.6 if strong else 0.15, jitter=0.1 if strong else 0.03, seed=1 if strong else 2)
+        lm.model = model
+        # IncrementalExtractor only sees new messages: fields come back null until they are mentioned
+        for name in EXTRACTION_LABELS:
+            lm.responses[name] = lambda messages, name=name: mentioned(messages, name)
+        if not strong:
+            goal, equipment, space = lm.responses["goal"], lm.responses["equipment"], lm.responses["space"]
+            # Every third request: goal left null. Equipment and space are the enum fields the rules
+            # resolve least often, so their invalid values actually reach the cascade: every second
+            # request names the equipment loosely, every third the space
+            lm.responses["goal"] = lambda messages: "null" if len(messages[-1]["content"]) % 3 == 0 else goal(messages)
+            lm.responses["equipment"] = lambda messages: (
+                f"some {value}" if (value := equipment(messages)) != "null" and len(messages[-1]["content"]) % 2 == 0
+                else value
+            )
+            lm.responses["space"] = lambda messages: (
+                f"my {value}" if (value := space(messages)) != "null" and len(messages[-1]["content"]) % 3 == 1
+                else value
+            )
+        return lm
+
+    def play(routes, required=None):
+        """Run every script as main.py's pipeline mode does; returns (RoutingLog, wall seconds, accuracy)."""
+        coach, extractor, generator = CoachAgent(), IncrementalExtractor(), WorkoutGenerator()
+        extractor, log = route_modules(routes, build_stub, coach, extractor, generator, required=required)
+        scores = []
+        start = time.perf_counter()
+        for script, example in zip(scripts, examples):
+            progress["labels"] = script.labels
+            history, extraction = [], ExtractionState()
+            for turn, (user, _) in enumerate(script.turns, 1):
+                progress["fraction"] = turn / len(script.turns)
+                result = coach(conversation_history=str(history), user_message=user)
+                history.append({"user": user, "coach": result.response})
+                # Pipeline mode extracts on every turn, not only once the coach is done
+                extraction.add_exchange(user, result.response)
+                extracted = extraction.extract(extractor)
+                if result.should_extract.lower() != "true":
+                    continue
+                scores.append(extraction_accuracy(example, extracted))
+                if not find_missing_fields(extracted):
+                    generator(**build_generator_inputs(extracted))
+        return log, time.perf_counter() - start, sum(scores) / len(scores)
+
+    cascade_routes = {"coach": (cheap_model,), "extractor": (cheap_model, strong_model), "generator": (strong_model,)}
+    configs = {
+        "single strong model": ({route: (strong_model,) for route in ROUTE_NAMES}, None),
+        "cascade, required fields": (cascade_routes, REQUIRED_FIELDS),
+        "cascade, invalid/parse only": (cascade_routes, None),
+    }
+    print("=" * 60)
+    print(f"MODEL ROUTING ({len(scripts)} conversations, IncrementalExtractor every turn; StubLM tiers: "
+          f"{cheap_model} 150ms, {strong_model} 600ms)")
+    print("=" * 60)
+    results = {}
+    for name, (routes, required) in configs.items():
+        log, seconds, accuracy = play(routes, required)
+        results[name] = (log, seconds, accuracy)
+        summary = log.summary()
+        cost = sum(route["cost"] for route in summary.values())
+        print(f"\n{name}: ${cost:.5f}, {seconds:.1f}s wall, extraction accuracy {accuracy:.1%}")
+        for route, stats in summary.items():
+            models = ", ".join(f"{model.split('/')[-1]} x{count}" for model, count in stats["models"].items())
+            print(f"  {route:<9} {stats['calls']:>3} calls ({models}) | {stats['escalations']} escalated | "
+                  f"${stats['cost']:.5f} | p50 {stats['p50_latency'] * 1000:4.0f}ms "
+                  f"p90 {stats['p90_latency'] * 1000:4.0f}ms")
+
+    log = results["cascade, invalid/parse only"][0]
+    reasons = [entry["reason"] for entry in log.records if entry["kind"] == "escalation"]
+    assert any(reason.startswith("invalid") for reason in reasons), "cheap tier never escalated on an invalid value"
+    print(f"\nEscalation reasons (invalid/parse only): {', '.join(sorted(set(reasons))) or 'none'}")
+    baseline_cost = sum(route["cost"] for route in results["single strong model"][0].summary().values())
+    for name in ("cascade, required fields", "cascade, invalid/parse only"):
+        routed_cost = sum(route["cost"] for route in results[name][0].summary().values())
+        print(f"{name}: cost ${baseline_cost:.5f} -> ${routed_cost:.5f} ({1 - routed_cost / baseline_cost:.0%} "
+              f"saved), wall {results['single strong model'][1]:.1f}s -> {results[name][1]:.1f}s")
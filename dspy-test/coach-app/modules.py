@@ -2,9 +2,12 @@
 DSPy Modules and Signatures for Fitness Coach Application
 
 This module contains:
-- Pydantic Models: Type-safe structured output models
+- Pydantic Models: Type-safe structured output models (WorkoutPlan is a
+  Workout without weights, for weight_prescription.py)
 - ChatAgent: Conversational layer for coaching interaction
 - InfoExtractor: Extracts structured workout requirements from conversation
+- BatchInfoExtractor: Extracts requirements for several conversations in one call
+- IncrementalExtractor: Updates extracted requirements from the newest messages
 - WorkoutGenerator: Creates structured workout plans
 """
 
@@ -12,6 +15,8 @@ import dspy
 from pydantic import BaseModel, Field
 from typing import Optional, List, Literal
 
+from execution_modes import ModalChainOfThought
+
 
 # ============================================================================
 # PYDANTIC MODELS (Type Safety)
@@ -40,6 +45,38 @@ class Workout(BaseModel):
     workoutFocus: Optional[str] = Field(None, description="Workout focus area")
 
 
+class PlannedSet(BaseModel):
+    """Set of a WorkoutPlan; its weight is prescribed locally"""
+    reps: int = Field(description="Number of repetitions")
+    setType: Literal["warmup", "working"] = Field(description="Set type")
+
+
+class PlannedExercise(BaseModel):
+    """Exercise of a WorkoutPlan"""
+    name: str = Field(description="Exercise name (real, established exercises only)")
+    sets: List[PlannedSet] = Field(description="List of sets for this exercise")
+
+
+class WorkoutPlan(BaseModel):
+    """Workout without weights (see weight_prescription.py)"""
+    exercises: List[PlannedExercise] = Field(description="List of exercises in workout")
+    notes: Optional[str] = Field(None, description="Additional guidance or safety notes")
+    workoutFocus: Optional[str] = Field(None, description="Workout focus area")
+
+
+class ExtractedInfo(BaseModel):
+    """ExtractUserInfo fields for one conversation of a batch"""
+    conversation_id: int = Field(description="id of the conversation these fields were extracted from")
+    fitness_level: str = Field(description="beginner|intermediate|advanced or null")
+    goal: str = Field(description="strength|hypertrophy|endurance|power|general or null")
+    focus: str = Field(description="push|pull|legs|chest|back|arms|shoulders|full_body or null")
+    equipment: str = Field(description="bodyweight|dumbbells|barbell|machines|cables|bands or null")
+    duration: str = Field(description="session minutes as number or null")
+    space: str = Field(description="home|gym|hotel|outdoor or null")
+    injuries: str = Field(description="any limitations/pain or null")
+    primary_lift_pr: str = Field(description="User's PR for main lift (e.g. '205lb bench') or null")
+
+
 # ============================================================================
 # SIGNATURES
 # ============================================================================
@@ -83,6 +120,28 @@ class ExtractUserInfo(dspy.Signature):
     primary_lift_pr = dspy.OutputField(desc="User's PR for main lift (e.g. '205lb bench') or null. Use to calibrate weights.")
 
 
+class ExtractUserInfoBatch(dspy.Signature):
+    """Extract structured workout requirements from each conversation independently"""
+    conversations = dspy.InputField(desc="JSON list of {id, conversation_history} objects")
+
+    extractions: List[ExtractedInfo] = dspy.OutputField(desc="One entry per conversation, matched by conversation_id")
+
+
+class UpdateUserInfo(dspy.Signature):
+    """Fill missing workout requirements from the newest chat messages; known_info is already settled"""
+    known_info = dspy.InputField(desc="Fields already extracted, as JSON")
+    new_messages = dspy.InputField(desc="Chat messages since the last extraction, after the coach message they answer")
+
+    fitness_level = dspy.OutputField(desc="beginner|intermediate|advanced or null")
+    goal = dspy.OutputField(desc="strength|hypertrophy|endurance|power|general or null")
+    focus = dspy.OutputField(desc="push|pull|legs|chest|back|arms|shoulders|full_body or null")
+    equipment = dspy.OutputField(desc="bodyweight|dumbbells|barbell|machines|cables|bands or null")
+    duration = dspy.OutputField(desc="session minutes as number or null")
+    space = dspy.OutputField(desc="home|gym|hotel|outdoor or null")
+    injuries = dspy.OutputField(desc="any limitations/pain or null")
+    primary_lift_pr = dspy.OutputField(desc="User's PR for main lift (e.g. '205lb bench') or null. Use to calibrate weights.")
+
+
 class GenerateWorkout(dspy.Signature):
     """Generate workout matching requirements. Uses Pydantic model for type-safe output."""
     fitness_level = dspy.InputField()
@@ -106,7 +165,7 @@ class CoachAgent(dspy.Module):
 
     def __init__(self):
         super().__init__()
-        self.chat = dspy.ChainOfThought(ChatAgent)
+        self.chat = ModalChainOfThought(ChatAgent)
 
     def forward(self, conversation_history, user_message):
         return self.chat(
@@ -114,24 +173,87 @@ class CoachAgent(dspy.Module):
             user_message=user_message
         )
 
+    async def aforward(self, conversation_history, user_message):
+        return await self.chat.acall(
+            conversation_history=conversation_history,
+            user_message=user_message
+        )
+
 
 class InfoExtractor(dspy.Module):
     """Extracts structured workout parameters from conversation history"""
 
     def __init__(self):
         super().__init__()
-        self.extract = dspy.ChainOfThought(ExtractUserInfo)
+        self.extract = ModalChainOfThought(ExtractUserInfo)
 
     def forward(self, conversation_history):
         return self.extract(conversation_history=conversation_history)
 
+    async def aforward(self, conversation_history):
+        return await self.extract.acall(conversation_history=conversation_history)
+
+
+class BatchInfoExtractor(dspy.Module):
+    """Extracts workout parameters for several conversations with one LM call"""
+
+    def __init__(self):
+        super().__init__()
+        self.extract = ModalChainOfThought(ExtractUserInfoBatch)
+
+    def forward(self, conversations):
+        return self.extract(conversations=conversations)
+
+    async def aforward(self, conversations):
+        return await self.extract.acall(conversations=conversations)
+
+
+class IncrementalExtractor(dspy.Module):
+    """Updates partially-filled workout parameters from the newest messages only"""
+
+    def __init__(self):
+        super().__init__()
+        self.update = ModalChainOfThought(UpdateUserInfo)
+        self._signatures = {}
+
+    def _signature_for(self, open_fields):
+        # Only ask for fields that are still open; frozen fields stay out of the prompt
+        base = self.update.predict.signature
+        if open_fields is None:
+            return base
+        key = (base.instructions, tuple(open_fields))
+        if key not in self._signatures:
+            signature = base
+            for name in UpdateUserInfo.output_fields:
+                if name not in open_fields:
+                    signature = signature.delete(name)
+            self._signatures[key] = signature
+        return self._signatures[key]
+
+    def forward(self, known_info, new_messages, open_fields=None):
+        return self.update(
+            signature=self._signature_for(open_fields),
+            known_info=known_info,
+            new_messages=new_messages
+        )
+
+    async def aforward(self, known_info, new_messages, open_fields=None):
+        return await self.update.acall(
+            signature=self._signature_for(open_fields),
+            known_info=known_info,
+            new_messages=new_messages
+        )
+
 
 class WorkoutGenerator(dspy.Module):
     """Generates structured workout plan in JSON format"""
 
     def __init__(self):
         super().__init__()
-        self.generate = dspy.ChainOfThought(GenerateWorkout)
+        self.generate = ModalChainOfThought(GenerateWorkout)
 
     def forward(self, **user_requirements):
         return self.generate(**user_requirements)
+
+    async def aforward(self, **user_requirements):
+        return await self.generate.acall(**user_requirements)
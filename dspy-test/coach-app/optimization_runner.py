@@ -0,0 +1,474 @@
+"""
+Parallel, Checkpointed MIPROv2 Runs
+
+This module contains:
+- program_fingerprint / devset_fingerprint: Stable hashes of a candidate
+  program's prompt state and of an evaluation set
+- TrialCheckpoint: JSON store of completed trial scores, written after every trial
+- StepCheckpoint: Pickled results of the bootstrap and instruction proposal steps
+- CheckpointedEvaluate: Evaluate wrapper that answers already-scored
+  (program, devset) pairs from the checkpoint and records new ones
+- CheckpointedMIPROv2: dspy.MIPROv2 that checkpoints every step and stops
+  cleanly when the daily quota runs out
+- run_parallel: Runs several optimizations at once on a thread pool
+
+MIPROv2.compile runs three steps: bootstrap few-shot demo sets, propose
+instruction candidates, then score trials. The first two are saved as soon
+as they finish (demos with their bootstrapped traces, instructions, and the
+optimizer's RNG state so later steps draw the same random numbers), keyed by
+everything they depend on: the student program, trainset, seed, demo limits
+and models. MIPROv2 evaluates each trial with Evaluate and keeps only the
+score. Scores are stored under a hash of the candidate's instructions and
+demos plus the examples it was scored on, so a rerun with the same seed
+replays the steps and trials it already finished without calling the LM,
+and Optuna, seeing the same scores, proposes the same next trial it would
+have. dspy's eval_candidate_program turns any exception into a score of 0.0,
+so quota exhaustion is detected from the shared RateLimiter instead: the
+affected step is not recorded and the run raises QuotaExhaustedError.
+
+Both modules are optimized on threads rather than processes: the work is
+waiting on the LM, and the RateLimiter (requests/min, tokens/min and the
+daily quota) only coordinates callers inside one process. Running this file
+optimizes InfoExtractor and WorkoutGenerator against a rate-limited StubLM,
+serially and in parallel, then interrupts runs at several points by
+exhausting the quota and reports the LM calls each resumed run needed.
+"""
+
+import hashlib
+import json
+import os
+import pickle
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import dspy
+from dspy.evaluate.evaluate import EvaluationResult
+
+from rate_limiter import QuotaExhaustedError
+
+
+CHECKPOINT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "optimization")
+
+
+def _digest(value):
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def program_fingerprint(program):
+    """
+    Hash the prompt state of a program (instructions, fields and demos).
+
+    Args:
+        program: dspy.Module whose predictors define the prompts
+
+    Returns:
+        str: SHA-256 hex digest
+    """
+    return _digest(program.dump_state())
+
+
+def devset_fingerprint(devset):
+    """
+    Hash an ordered list of examples, inputs and labels alike.
+
+    Args:
+        devset: List of dspy.Example
+
+    Returns:
+        str: SHA-256 hex digest
+    """
+    return _digest([example.toDict() for example in devset])
+
+
+# ============================================================================
+# CHECKPOINT STORE
+# ============================================================================
+
+class TrialCheckpoint:
+    """
+    Trial scores keyed by (scope, program, devset), persisted as JSON.
+
+    The file is rewritten atomically after every recorded trial, so an
+    interrupted run loses at most the evaluation that was in progress.
+
+    Args:
+        path: JSON file holding the scores (None keeps them in memory only)
+    """
+    def __init__(self, path):
+        self.path = path
+        self.trials = self._load()
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self.path and os.path.exists(self.path):
+            try:
+                with open(self.path) as f:
+                    return json.load(f)["trials"]
+            except (ValueError, KeyError, OSError):
+                pass
+        return {}
+
+    def _save(self):
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"trials": self.trials}, f)
+        os.replace(tmp_path, self.path)
+
+    @staticmethod
+    def key(scope, program, devset):
+        return _digest([scope, program_fingerprint(program), devset_fingerprint(devset)])
+
+    def get(self, key):
+        """Return the recorded score for key, or None."""
+        with self._lock:
+            trial = self.trials.get(key)
+        return trial["score"] if trial else None
+
+    def put(self, key, score, devset_size):
+        """Record a completed trial and flush the file."""
+        with self._lock:
+            self.trials[key] = {"score": score, "devset_size": devset_size}
+            self._save()
+
+    def __len__(self):
+        return len(self.trials)
+
+
+class StepCheckpoint:
+    """
+    Outputs of whole optimization steps, pickled after each step.
+
+    Pickle keeps bootstrapped demos exactly as produced (including Pydantic
+    outputs such as Workout), so restored demos render the same prompts.
+    Only steps saved under the current run key are returned; a different
+    run replaces them.
+
+    Args:
+        path: Pickle file holding the steps (None keeps them in memory only)
+    """
+    def __init__(self, path):
+        self.path = path
+        self.run, self.steps = self._load()
+
+    def _load(self):
+        if self.path and os.path.exists(self.path):
+            try:
+                with open(self.path, "rb") as f:
+                    saved = pickle.load(f)
+                return saved["run"], saved["steps"]
+            except (OSError, pickle.UnpicklingError, EOFError, KeyError, AttributeError):
+                pass
+        return None, {}
+
+    def _save(self):
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump({"run": self.run, "steps": self.steps}, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.path)
+
+    def get(self, run, name):
+        """Return the saved output of step name for this run, or None."""
+        return self.steps.get(name) if run == self.run else None
+
+    def put(self, run, name, value):
+        """Save the output of one step and flush the file."""
+        if run != self.run:
+            self.run, self.steps = run, {}
+        self.steps[name] = value
+        self._save()
+
+
+# ============================================================================
+# CHECKPOINTED EVALUATION
+# ============================================================================
+
+class CheckpointedEvaluate:
+    """
+    Wraps MIPROv2's Evaluate so each (program, devset) pair is scored once.
+
+    Only EvaluationResult.score is used by MIPROv2, so restored trials come
+    back with an empty results list.
+
+    Args:
+        evaluate: The dspy.Evaluate built by MIPROv2.compile
+        checkpoint: TrialCheckpoint to read and record scores
+        scope: Anything else the score depends on (metric, task model)
+        limiter: Shared RateLimiter, used to spot quota exhaustion
+    """
+    def __init__(self, evaluate, checkpoint, scope, limiter=None):
+        self.evaluate = evaluate
+        self.checkpoint = checkpoint
+        self.scope = scope
+        self.limiter = limiter
+        self.interrupted = False
+        self.stats = {"evaluated": 0, "restored": 0, "examples_skipped": 0}
+
+    def _quota_errors(self):
+        return self.limiter.quota_errors if self.limiter else 0
+
+    def __call__(self, program, devset=None, **kwargs):
+        devset = devset if devset is not None else self.evaluate.devset
+        key = self.checkpoint.key(self.scope, program, devset)
+        score = self.checkpoint.get(key)
+        if score is not None:
+            self.stats["restored"] += 1
+            self.stats["examples_skipped"] += len(devset)
+            return EvaluationResult(score=score, results=[])
+
+        quota_errors = self._quota_errors()
+        result = self.evaluate(program, devset=devset, **kwargs)
+        if self._quota_errors() > quota_errors:
+            # Some examples failed for lack of quota; the score is not real
+            self.interrupted = True
+            return result
+        self.stats["evaluated"] += 1
+        self.checkpoint.put(key, result.score, len(devset))
+        return result
+
+
+class CheckpointedMIPROv2(dspy.MIPROv2):
+    """
+    dspy.MIPROv2 whose bootstrap, proposal and trial results survive an
+    interrupted run.
+
+    Pass the same seed, trainset and settings on rerun to resume: finished
+    steps and trials are replayed from the checkpoint files and only the
+    rest call the LM. Bootstrapping and proposal are saved whole, so an
+    interruption inside one of them repeats that step.
+
+    Args:
+        metric: Metric function, as for dspy.MIPROv2
+        checkpoint_path: JSON file for this optimization's trials; steps go
+            next to it with a .steps.pkl suffix
+        limiter: RateLimiter shared by the LMs in use, if any
+        **kwargs: Passed to dspy.MIPROv2
+    """
+    def __init__(self, metric, checkpoint_path=None, limiter=None, **kwargs):
+        super().__init__(metric=metric, **kwargs)
+        self.checkpoint = TrialCheckpoint(checkpoint_path)
+        self.steps = StepCheckpoint(f"{os.path.splitext(checkpoint_path)[0]}.steps.pkl" if checkpoint_path else None)
+        self.limiter = limiter
+        self.evaluate = None
+        self.run_key = None
+        self.restored_steps = []
+
+    def _scope(self):
+        return [getattr(self.metric, "__name__", repr(self.metric)), getattr(self.task_model, "model", None)]
+
+    def _quota_errors(self):
+        return self.limiter.quota_errors if self.limiter else 0
+
+    def _run_fingerprint(self, student, kwargs):
+        # Plain settings only; a teacher module has no stable representation
+        settings = {
+            name: value for name, value in kwargs.items()
+            if isinstance(value, (str, int, float, bool, type(None)))
+        }
+        return _digest([
+            self._scope(),
+            getattr(self.prompt_model, "model", None),
+            program_fingerprint(student),
+            devset_fingerprint(kwargs.get("trainset") or []),
+            devset_fingerprint(kwargs.get("valset") or []),
+            [self.seed, self.auto, self.num_candidates, self.max_bootstrapped_demos, self.max_labeled_demos],
+            settings,
+        ])
+
+    def _step(self, name, run):
+        saved = self.steps.get(self.run_key, name)
+        if saved is not None:
+            value, rng_state = saved
+            self.rng.setstate(rng_state)
+            self.restored_steps.append(name)
+            return value
+
+        quota_errors = self._quota_errors()
+        value = run()
+        if self._quota_errors() > quota_errors:
+            # Failed calls are swallowed inside the step, so its output is incomplete
+            raise QuotaExhaustedError(f"Daily quota used up while running {name}; rerun to resume")
+        self.steps.put(self.run_key, name, (value, self.rng.getstate()))
+        return value
+
+    def _bootstrap_fewshot_examples(self, program, trainset, seed, teacher):
+        return self._step("bootstrap", lambda: super(CheckpointedMIPROv2, self)._bootstrap_fewshot_examples(
+            program, trainset, seed, teacher
+        ))
+
+    def _propose_instructions(self, *args):
+        return self._step("instructions", lambda: super(CheckpointedMIPROv2, self)._propose_instructions(*args))
+
+    def _optimize_prompt_parameters(self, program, instruction_candidates, demo_candidates, evaluate, *args):
+        self.evaluate = CheckpointedEvaluate(evaluate, self.checkpoint, self._scope(), self.limiter)
+        return super()._optimize_prompt_parameters(
+            program, instruction_candidates, demo_candidates, self.evaluate, *args
+        )
+
+    def _select_and_insert_instructions_and_demos(self, *args, **kwargs):
+        # Stop before the next trial; Optuna re-raises exceptions from the objective
+        if self.evaluate is not None and self.evaluate.interrupted:
+            raise QuotaExhaustedError(
+                f"Daily quota used up after {len(self.checkpoint)} checkpointed trials; rerun to resume"
+            )
+        return super()._select_and_insert_instructions_and_demos(*args, **kwargs)
+
+    def compile(self, student, **kwargs):
+        self.evaluate = None
+        self.restored_steps = []
+        self.run_key = self._run_fingerprint(student, kwargs)
+        program = super().compile(student, **kwargs)
+        if self.evaluate is not None and self.evaluate.interrupted:
+            # The final full evaluation ran out of quota
+            raise QuotaExhaustedError("Daily quota used up during the final evaluation; rerun to resume")
+        return program
+
+
+# ============================================================================
+# PARALLEL RUNNER
+# ============================================================================
+
+def run_parallel(jobs, max_workers=None):
+    """
+    Run optimization jobs concurrently and wait for all of them.
+
+    A job that fails does not cancel the others, so every job checkpoints
+    as much as the shared quota allows.
+
+    Args:
+        jobs: Dict mapping a name to a zero-argument callable
+        max_workers: Thread count (default: one per job)
+
+    Returns:
+        tuple: (results, errors) dicts keyed by job name
+    """
+    results, errors = {}, {}
+    with ThreadPoolExecutor(max_workers=max_workers or len(jobs)) as pool:
+        futures = {name: pool.submit(job) for name, job in jobs.items()}
+        for name, future in futures.items():
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                errors[name] = e
+    return results, errors
+
+
+if __name__ == "__main__":
+    import logging
+    import tempfile
+    import time
+
+    from metrics import extraction_accuracy, workout_quality
+    from modules import InfoExtractor, WorkoutGenerator
+    from rate_limiter import RateLimiter
+    from stub_lm import StubLM
+    from training_data import get_extractor_trainset, get_generator_trainset
+
+    logging.getLogger("dspy").setLevel(logging.CRITICAL)
+    import optuna
+    optuna.logging.disable_default_handler()
+    logging.getLogger("optuna").addHandler(logging.NullHandler())
+
+    class QuotaStubLM(StubLM):
+        """StubLM that draws every call from a RateLimiter, like RateLimitedLM."""
+        def __init__(self, limiter, **kwargs):
+            super().__init__(**kwargs)
+            self.limiter = limiter
+
+        def forward(self, prompt=None, messages=None, **kwargs):
+            # acquire() without its per-wait message
+            time.sleep(self.limiter._reserve(0))
+            return super().forward(prompt=prompt, messages=messages, **kwargs)
+
+    def make_lm(requests_per_day=1_000_000):
+        # 3000 req/min shared by everything, 100ms per call; the daily counter
+        # also counts calls across lm.copy()s made by the optimizer
+        limiter = RateLimiter(requests_per_min=3000, burst=10, requests_per_day=requests_per_day, state_path=None)
+        return QuotaStubLM(limiter, latency=0.1)
+
+    def lm_calls(lm):
+        return lm.limiter.daily.count - lm.limiter.quota_errors
+
+    def job(student, trainset, metric, lm, checkpoint_dir, num_threads):
+        def run():
+            with dspy.context(lm=lm):
+                optimizer = CheckpointedMIPROv2(
+                    metric,
+                    checkpoint_path=os.path.join(checkpoint_dir, f"{type(student).__name__}.json"),
+                    limiter=lm.limiter,
+                    auto="light",
+                    max_bootstrapped_demos=2,
+                    max_labeled_demos=2,
+                    num_threads=num_threads,
+                    verbose=False,
+                )
+                return optimizer, optimizer.compile(student, trainset=trainset)
+        return run
+
+    def jobs(lm, checkpoint_dir, num_threads):
+        return {
+            "InfoExtractor": job(InfoExtractor(), get_extractor_trainset(), extraction_accuracy,
+                                 lm, checkpoint_dir, num_threads),
+            "WorkoutGenerator": job(WorkoutGenerator(), get_generator_trainset(), workout_quality,
+                                    lm, checkpoint_dir, num_threads),
+        }
+
+    print("=" * 60)
+    print("PARALLEL CHECKPOINTED MIPROv2 (StubLM, 100ms/call, 3000 req/min shared)")
+    print("=" * 60)
+
+    # Serial, one evaluation thread: how choice "3" in optimize.py used to behave
+    with tempfile.TemporaryDirectory() as checkpoint_dir:
+        lm = make_lm()
+        start = time.perf_counter()
+        for run in jobs(lm, checkpoint_dir, num_threads=1).values():
+            run()
+        serial_wall, total_calls = time.perf_counter() - start, lm_calls(lm)
+
+    with tempfile.TemporaryDirectory() as checkpoint_dir:
+        lm = make_lm()
+        start = time.perf_counter()
+        results, errors = run_parallel(jobs(lm, checkpoint_dir, num_threads=4))
+        parallel_wall = time.perf_counter() - start
+        assert not errors, errors
+        best = {name: program_fingerprint(program) for name, (_, program) in results.items()}
+
+    print(f"{'Serial, 1 eval thread':<28} | {serial_wall:6.1f}s | {total_calls} LM calls")
+    print(f"{'Parallel, 4 eval threads':<28} | {parallel_wall:6.1f}s | {lm_calls(lm)} LM calls "
+          f"({serial_wall / parallel_wall:.1f}x faster)")
+
+    def resume(quota_fraction, keep_steps):
+        """Run until the quota runs out, then rerun with a fresh day's quota."""
+        with tempfile.TemporaryDirectory() as checkpoint_dir:
+            lm = make_lm(requests_per_day=int(total_calls * quota_fraction))
+            _, errors = run_parallel(jobs(lm, checkpoint_dir, num_threads=4))
+            assert all(isinstance(error, QuotaExhaustedError) for error in errors.values()), errors
+            first_calls = lm_calls(lm)
+            if not keep_steps:
+                for name in os.listdir(checkpoint_dir):
+                    if name.endswith(".steps.pkl"):
+                        os.remove(os.path.join(checkpoint_dir, name))
+
+            lm = make_lm()
+            results, errors = run_parallel(jobs(lm, checkpoint_dir, num_threads=4))
+            assert not errors, errors
+            # Resuming must not change the outcome
+            assert best == {name: program_fingerprint(program) for name, (_, program) in results.items()}
+            restored_steps = sum(len(optimizer.restored_steps) for optimizer, _ in results.values())
+            return first_calls, lm_calls(lm), restored_steps
+
+    # Interrupt by running out of daily quota at several points, then resume
+    print(f"\nInterrupted runs, resumed with a fresh quota (uninterrupted run: {total_calls} LM calls)")
+    print(f"{'Quota':>6} | {'Before stop':>11} | {'Resume (trials)':>15} | {'Resume (all steps)':>18} | "
+          f"{'Steps restored':>14} | Calls saved")
+    for quota_fraction in (0.25, 0.5, 0.75):
+        _, trials_only_calls, _ = resume(quota_fraction, keep_steps=False)
+        first_calls, resumed_calls, restored_steps = resume(quota_fraction, keep_steps=True)
+        saved = total_calls - resumed_calls
+        print(f"{quota_fraction:>6.0%} | {first_calls:>11} | {trials_only_calls:>15} | {resumed_calls:>18} | "
+              f"{restored_steps:>14} | {saved:>4} ({saved / total_calls:.0%})")
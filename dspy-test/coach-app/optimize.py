@@ -2,7 +2,8 @@
 Optimization Script for Coach Nova Modules
 
 This script uses DSPy's MIPROv2 optimizer to improve:
-- InfoExtractor: Better extraction of structured requirements
+- IncrementalExtractor: Better extraction of structured requirements (the
+  extractor main.py runs)
 - WorkoutGenerator: Better quality workout plans
 
 MIPROv2 is chosen over BootstrapFewShot because it:
@@ -11,88 +12,109 @@ MIPROv2 is chosen over BootstrapFewShot because it:
 - Uses Bayesian Optimization for better prompt search
 - Generates task-specific instructions that encode domain rules
 
-The optimized modules are saved to the optimized/ directory.
+A fixed-seed share of each training set (evaluation.make_splits) is held out
+of optimization, and the evaluation reports it as a separate split, so the
+optimized scores are not only measured on examples MIPROv2 tuned against.
+Choice 3 optimizes both modules at once (see optimization_runner.py). Every
+step is checkpointed, so a run stopped by the daily quota or Ctrl-C resumes
+where it left off. The optimized modules are saved to the optimized/ directory.
 """
 
 import os
 import sys
-import time
 import dspy
-from modules import InfoExtractor, WorkoutGenerator
-from training_data import get_extractor_trainset, get_generator_trainset
+from modules import IncrementalExtractor, WorkoutGenerator
+from training_data import get_incremental_extractor_trainset, get_generator_trainset
 from metrics import extraction_accuracy, workout_quality
+from lm_cache import with_response_cache, print_cache_stats
+from evaluation import evaluate_parallel, make_splits, print_report_summary, DEFAULT_REPORT_DIR
+from rate_limiter import RateLimitedLM, RateLimiter, GEMINI_FREE_TIER, QuotaExhaustedError
+from optimization_runner import CheckpointedMIPROv2, run_parallel, CHECKPOINT_DIR
+from artifacts import artifact_source, load_optimized, ArtifactError, OPTIMIZED_DIR
+from prompt_prefix import PrefixCachingAdapter
+from replay_lm import lm_from_env, lm_mode_from_env, print_replay_stats
 
 
-class RateLimitedLM(dspy.LM):
-    """
-    Wrapper around dspy.LM that enforces rate limiting.
+# One limiter for every LM in this process so all optimization and evaluation
+# calls share the free tier budget (the daily count also persists across runs)
+_gemini_limiter = None
+
 
-    Gemini free tier limits:
-    - 10 requests per minute
-    - 50 requests per day
+def gemini_limiter():
+    """Return the process-wide RateLimiter for the Gemini free tier."""
+    global _gemini_limiter
+    if _gemini_limiter is None:
+        _gemini_limiter = RateLimiter(**GEMINI_FREE_TIER)
+    return _gemini_limiter
 
-    This wrapper adds a delay between calls to stay under the per-minute limit.
+
+def optimizer_lm(api_key):
     """
-    def __init__(self, *args, requests_per_min=9, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.requests_per_min = requests_per_min
-        self.min_delay = 60.0 / requests_per_min  # seconds between requests
-        self.last_request_time = 0
+    Build the Gemini LM used for optimization and evaluation.
 
-    def __call__(self, *args, **kwargs):
-        # Calculate time since last request
-        now = time.time()
-        time_since_last = now - self.last_request_time
+    The cache sits outside the rate limiter so repeated prompts skip both the
+    wait and the quota. COACH_NOVA_LM_MODE=record/replay records the run or
+    replays a recording instead (see replay_lm.py).
 
-        # If we're calling too fast, wait
-        if time_since_last < self.min_delay:
-            wait_time = self.min_delay - time_since_last
-            print(f"  [Rate limit] Waiting {wait_time:.1f}s before next request...")
-            time.sleep(wait_time)
+    Args:
+        api_key: Google Generative AI API key
+
+    Returns:
+        Cached, rate-limited LM drawing from gemini_limiter()
+    """
+    return lm_from_env(lambda: with_response_cache(RateLimitedLM(
+        "gemini/gemini-2.0-flash-exp",
+        api_key=api_key,
+        limiter=gemini_limiter()
+    )))
 
-        # Update timestamp
-        self.last_request_time = time.time()
 
-        # Make the actual call
-        return super().__call__(*args, **kwargs)
+# Concurrent candidate evaluations per optimization; the limiter still caps requests/min
+EVAL_THREADS = 4
 
 
-def optimize_info_extractor(api_key):
+def optimize_extractor(api_key, lm=None):
     """
-    Optimize the InfoExtractor module using MIPROv2.
+    Optimize the IncrementalExtractor module (main.py's extractor) using MIPROv2.
 
     Args:
         api_key: Google Generative AI API key
+        lm: LM to optimize with (default: optimizer_lm(api_key))
 
     Returns:
-        Optimized InfoExtractor module
+        Optimized IncrementalExtractor module
+
+    Raises:
+        QuotaExhaustedError: The daily quota ran out; rerun to resume
     """
     print("=" * 60)
-    print("OPTIMIZING INFO EXTRACTOR")
+    print("OPTIMIZING INCREMENTAL EXTRACTOR")
     print("=" * 60)
 
     # Configure DSPy with rate limiting to respect Gemini free tier limits
-    # Free tier: 10 requests/minute, so we set to 9 req/min with safety margin
-    print("\n⚠️  Rate limiting enabled: 9 requests/minute (Gemini free tier: 10/min)")
-    print("    This will add delays between API calls to avoid quota errors.")
-    lm = RateLimitedLM(
-        "gemini/gemini-2.0-flash-exp",
-        api_key=api_key,
-        requests_per_min=9  # Just under the 10/min limit
-    )
-    dspy.configure(lm=lm)
+    # Free tier: 10 requests/minute and 50/day, so we stay just under both
+    print("\n⚠️  Rate limiting enabled: 9 requests/minute, 50/day (Gemini free tier: 10/min)")
+    print("    Bursts are allowed; calls wait only when the budget is used up.")
+    lm = lm or optimizer_lm(api_key)
 
-    # Get training data
-    trainset = get_extractor_trainset()
-    print(f"\nTraining set size: {len(trainset)} examples")
+    # Get training data; the held-out examples are left for evaluate_on_splits
+    splits = make_splits(get_incremental_extractor_trainset())
+    trainset = splits["train"]
+    print(f"\nTraining set size: {len(trainset)} examples ({len(splits['holdout'])} held out)")
 
     # Create optimizer
     print("\nInitializing MIPROv2 optimizer...")
     print("  - auto='light': ~10-20 trials for fast iteration")
     print("  - Optimizes instructions + few-shot examples jointly")
     print("  - Reduced demo counts (2 vs 4/3) to minimize API calls")
-    optimizer = dspy.MIPROv2(
+    print("  - Each step (bootstrap, proposals, trials) is checkpointed; an interrupted run resumes")
+    optimizer = CheckpointedMIPROv2(
         metric=extraction_accuracy,
+        checkpoint_path=os.path.join(CHECKPOINT_DIR, "incremental_extractor.json"),
+        limiter=gemini_limiter(),
+        prompt_model=lm,
+        task_model=lm,
+        num_threads=EVAL_THREADS,
         auto="light",              # Light mode: ~10-20 trials, auto-configures minibatch settings
         max_bootstrapped_demos=2,  # Reduced from 4 to minimize API calls
         max_labeled_demos=2,       # Reduced from 4 to minimize API calls
@@ -100,16 +122,18 @@ def optimize_info_extractor(api_key):
 
     # Compile (optimize) the module
     print("Compiling optimized module (this may take a few minutes)...")
-    student = InfoExtractor()
-    optimized_extractor = optimizer.compile(
-        student=student,
-        trainset=trainset
-    )
+    student = IncrementalExtractor()
+    # A context rather than dspy.configure, so both optimizations can run on worker threads
+    with dspy.context(lm=lm):
+        optimized_extractor = optimizer.compile(
+            student=student,
+            trainset=trainset
+        )
 
     print("\n[SUCCESS] Optimization complete!")
 
     # Save optimized module
-    save_path = os.path.join("../optimized", "extractor.json")
+    save_path = os.path.join("../optimized", "incremental_extractor.json")
     os.makedirs(os.path.dirname(save_path), exist_ok=True)
     optimized_extractor.save(save_path)
     print(f"[SUCCESS] Saved to: {save_path}")
@@ -117,42 +141,48 @@ def optimize_info_extractor(api_key):
     return optimized_extractor
 
 
-def optimize_workout_generator(api_key):
+def optimize_workout_generator(api_key, lm=None):
     """
     Optimize the WorkoutGenerator module using MIPROv2.
 
     Args:
         api_key: Google Generative AI API key
+        lm: LM to optimize with (default: optimizer_lm(api_key))
 
     Returns:
         Optimized WorkoutGenerator module
+
+    Raises:
+        QuotaExhaustedError: The daily quota ran out; rerun to resume
     """
     print("\n" + "=" * 60)
     print("OPTIMIZING WORKOUT GENERATOR")
     print("=" * 60)
 
     # Configure DSPy with rate limiting to respect Gemini free tier limits
-    # Free tier: 10 requests/minute, so we set to 9 req/min with safety margin
-    print("\n⚠️  Rate limiting enabled: 9 requests/minute (Gemini free tier: 10/min)")
-    print("    This will add delays between API calls to avoid quota errors.")
-    lm = RateLimitedLM(
-        "gemini/gemini-2.0-flash-exp",
-        api_key=api_key,
-        requests_per_min=9  # Just under the 10/min limit
-    )
-    dspy.configure(lm=lm)
+    # Free tier: 10 requests/minute and 50/day, so we stay just under both
+    print("\n⚠️  Rate limiting enabled: 9 requests/minute, 50/day (Gemini free tier: 10/min)")
+    print("    Bursts are allowed; calls wait only when the budget is used up.")
+    lm = lm or optimizer_lm(api_key)
 
-    # Get training data
-    trainset = get_generator_trainset()
-    print(f"\nTraining set size: {len(trainset)} examples")
+    # Get training data; the held-out examples are left for evaluate_on_splits
+    splits = make_splits(get_generator_trainset())
+    trainset = splits["train"]
+    print(f"\nTraining set size: {len(trainset)} examples ({len(splits['holdout'])} held out)")
 
     # Create optimizer
     print("\nInitializing MIPROv2 optimizer...")
     print("  - auto='light': ~10-20 trials for fast iteration")
     print("  - Optimizes instructions + few-shot examples jointly")
     print("  - Reduced demo counts (2 vs 4/3) to minimize API calls")
-    optimizer = dspy.MIPROv2(
+    print("  - Each step (bootstrap, proposals, trials) is checkpointed; an interrupted run resumes")
+    optimizer = CheckpointedMIPROv2(
         metric=workout_quality,
+        checkpoint_path=os.path.join(CHECKPOINT_DIR, "generator.json"),
+        limiter=gemini_limiter(),
+        prompt_model=lm,
+        task_model=lm,
+        num_threads=EVAL_THREADS,
         auto="light",              # Light mode: ~10-20 trials, auto-configures minibatch settings
         max_bootstrapped_demos=2,  # Reduced from 3 to minimize API calls
         max_labeled_demos=2,       # Reduced from 3 to minimize API calls
@@ -161,10 +191,12 @@ def optimize_workout_generator(api_key):
     # Compile (optimize) the module
     print("Compiling optimized module (this may take a few minutes)...")
     student = WorkoutGenerator()
-    optimized_generator = optimizer.compile(
-        student=student,
-        trainset=trainset
-    )
+    # A context rather than dspy.configure, so both optimizations can run on worker threads
+    with dspy.context(lm=lm):
+        optimized_generator = optimizer.compile(
+            student=student,
+            trainset=trainset
+        )
 
     print("\n[SUCCESS] Optimization complete!")
 
@@ -177,80 +209,78 @@ def optimize_workout_generator(api_key):
     return optimized_generator
 
 
-def evaluate_improvements(original_module, optimized_module, trainset, metric, module_name):
+def evaluate_improvements(original_module, optimized_module, trainset, metric, module_name,
+                          holdout=None, num_threads=4):
     """
     Compare original vs optimized module performance.
 
+    Both modules run concurrently on every example (inputs come from each
+    Example's with_inputs keys) and share the configured LM's rate limiter.
+    A JSON report with per-example scores, latency and token counts is
+    written to ../eval-logs/.
+
     Args:
         original_module: Unoptimized module
         optimized_module: Optimized module
         trainset: Training examples to evaluate on
         metric: Metric function to use
-        module_name: Name for display
+        module_name: Name for display and the report file
+        holdout: Optional held-out examples, reported as a separate split
+        num_threads: Worker threads for parallel evaluation
+
+    Returns:
+        dict: The evaluation report
     """
     print(f"\n{'=' * 60}")
     print(f"EVALUATING {module_name.upper()}")
     print("=" * 60)
 
-    original_scores = []
-    optimized_scores = []
-
-    print(f"\nEvaluating on {len(trainset)} examples...")
-
-    for i, example in enumerate(trainset[:5], 1):  # Evaluate on first 5 examples
-        print(f"\nExample {i}/{min(5, len(trainset))}")
-
-        # Test original
-        if module_name == "InfoExtractor":
-            orig_pred = original_module(conversation_history=example.conversation_history)
-        else:  # WorkoutGenerator
-            orig_pred = original_module(
-                fitness_level=example.fitness_level,
-                goal=example.goal,
-                focus=example.focus,
-                equipment=example.equipment,
-                duration=example.duration,
-                space=example.space,
-                injuries=example.injuries,
-                primary_lift_pr=example.primary_lift_pr
-            )
+    splits = {"train": trainset}
+    if holdout:
+        splits["holdout"] = holdout
+    print(f"\nEvaluating on {sum(len(examples) for examples in splits.values())} examples...")
+
+    report_path = os.path.join(DEFAULT_REPORT_DIR, f"{module_name}-evaluation.json")
+    report = evaluate_parallel(
+        {"original": original_module, "optimized": optimized_module},
+        splits,
+        metric,
+        num_threads=num_threads,
+        report_path=report_path
+    )
 
-        orig_score = metric(example, orig_pred)
-        original_scores.append(orig_score)
-
-        # Test optimized
-        if module_name == "InfoExtractor":
-            opt_pred = optimized_module(conversation_history=example.conversation_history)
-        else:  # WorkoutGenerator
-            opt_pred = optimized_module(
-                fitness_level=example.fitness_level,
-                goal=example.goal,
-                focus=example.focus,
-                equipment=example.equipment,
-                duration=example.duration,
-                space=example.space,
-                injuries=example.injuries,
-                primary_lift_pr=example.primary_lift_pr
-            )
+    print(f"\n{'=' * 60}")
+    print("SUMMARY")
+    print("=" * 60)
+    print_report_summary(report)
+    print(f"\nReport saved to: {report_path}")
 
-        opt_score = metric(example, opt_pred)
-        optimized_scores.append(opt_score)
+    return report
 
-        print(f"  Original:  {orig_score:.2%}")
-        print(f"  Optimized: {opt_score:.2%}")
-        print(f"  Change:    {(opt_score - orig_score):+.2%}")
 
-    # Print summary
-    avg_original = sum(original_scores) / len(original_scores)
-    avg_optimized = sum(optimized_scores) / len(optimized_scores)
-    improvement = avg_optimized - avg_original
+def evaluate_on_splits(original_module, optimized_module, examples, metric, module_name):
+    """
+    evaluate_improvements on the same train/holdout split the optimizers use.
 
-    print(f"\n{'=' * 60}")
-    print("SUMMARY")
-    print("=" * 60)
-    print(f"Average Original Score:  {avg_original:.2%}")
-    print(f"Average Optimized Score: {avg_optimized:.2%}")
-    print(f"Average Improvement:     {improvement:+.2%}")
+    Args:
+        original_module: Unoptimized module
+        optimized_module: Optimized module
+        examples: Full training set of the module
+        metric: Metric function to use
+        module_name: Name for display and the report file
+
+    Returns:
+        dict: The evaluation report
+    """
+    splits = make_splits(examples)
+    return evaluate_improvements(
+        original_module,
+        optimized_module,
+        splits["train"],
+        metric,
+        module_name,
+        holdout=splits["holdout"]
+    )
 
 
 def main():
@@ -261,7 +291,7 @@ def main():
 
     # Get API key
     api_key = os.getenv("GOOGLE_GENERATIVE_AI_API_KEY")
-    if not api_key:
+    if not api_key and lm_mode_from_env() != "replay":
         print("\nError: GOOGLE_GENERATIVE_AI_API_KEY environment variable not set")
         return
 
@@ -271,31 +301,43 @@ def main():
     else:
         # Ask user what to optimize
         print("\nWhat would you like to optimize?")
-        print("1. InfoExtractor only")
+        print("1. IncrementalExtractor only")
         print("2. WorkoutGenerator only")
         print("3. Both modules")
         print("4. Evaluate existing optimized modules")
         choice = input("\nEnter choice (1-4): ").strip()
 
+    # One LM (and limiter) for every optimization and evaluation in this run
+    lm = optimizer_lm(api_key)
+    dspy.configure(lm=lm)
+
     if choice == "1":
-        optimized_extractor = optimize_info_extractor(api_key)
+        try:
+            optimized_extractor = optimize_extractor(api_key, lm)
+        except QuotaExhaustedError as e:
+            print(f"\n{e}")
+            return
 
         # Evaluate
         print("\nEvaluating improvements...")
-        evaluate_improvements(
-            InfoExtractor(),
+        evaluate_on_splits(
+            IncrementalExtractor(),
             optimized_extractor,
-            get_extractor_trainset(),
+            get_incremental_extractor_trainset(),
             extraction_accuracy,
-            "InfoExtractor"
+            "IncrementalExtractor"
         )
 
     elif choice == "2":
-        optimized_generator = optimize_workout_generator(api_key)
+        try:
+            optimized_generator = optimize_workout_generator(api_key, lm)
+        except QuotaExhaustedError as e:
+            print(f"\n{e}")
+            return
 
         # Evaluate
         print("\nEvaluating improvements...")
-        evaluate_improvements(
+        evaluate_on_splits(
             WorkoutGenerator(),
             optimized_generator,
             get_generator_trainset(),
@@ -304,24 +346,34 @@ def main():
         )
 
     elif choice == "3":
-        # Optimize both
-        optimized_extractor = optimize_info_extractor(api_key)
-        optimized_generator = optimize_workout_generator(api_key)
+        # Optimize both concurrently; they share one limiter and daily quota
+        results, errors = run_parallel({
+            "IncrementalExtractor": lambda: optimize_extractor(api_key, lm),
+            "WorkoutGenerator": lambda: optimize_workout_generator(api_key, lm),
+        })
+        if errors:
+            for name, error in errors.items():
+                print(f"\n[{name}] {type(error).__name__}: {error}")
+            if all(isinstance(error, QuotaExhaustedError) for error in errors.values()):
+                print("\nFinished steps are checkpointed; run again after the quota resets to resume.")
+            return
+        optimized_extractor = results["IncrementalExtractor"]
+        optimized_generator = results["WorkoutGenerator"]
 
         # Evaluate both
         print("\n" + "=" * 60)
         print("EVALUATION PHASE")
         print("=" * 60)
 
-        evaluate_improvements(
-            InfoExtractor(),
+        evaluate_on_splits(
+            IncrementalExtractor(),
             optimized_extractor,
-            get_extractor_trainset(),
+            get_incremental_extractor_trainset(),
             extraction_accuracy,
-            "InfoExtractor"
+            "IncrementalExtractor"
         )
 
-        evaluate_improvements(
+        evaluate_on_splits(
             WorkoutGenerator(),
             optimized_generator,
             get_generator_trainset(),
@@ -333,29 +385,29 @@ def main():
         # Load and evaluate existing modules
         print("\nLoading optimized modules...")
         try:
-            optimized_extractor = InfoExtractor()
-            optimized_extractor.load("../optimized/extractor.json")
+            # Validated against the current signatures; repeat runs load from the binary snapshot
+            # Falls back to the adapted InfoExtractor artifact until choice 1 or 3 has run
+            optimized_extractor = IncrementalExtractor()
+            source = artifact_source(optimized_extractor)
+            if source is None:
+                raise FileNotFoundError(os.path.join(OPTIMIZED_DIR, "incremental_extractor.json"))
+            path, adapt = source
+            load_optimized(optimized_extractor, path, adapt=adapt)
 
             optimized_generator = WorkoutGenerator()
-            optimized_generator.load("../optimized/generator.json")
+            load_optimized(optimized_generator, os.path.join(OPTIMIZED_DIR, "generator.json"))
 
-            # Configure DSPy with rate limiting
-            lm = RateLimitedLM(
-                "gemini/gemini-2.0-flash-exp",
-                api_key=api_key,
-                requests_per_min=9
-            )
-            dspy.configure(lm=lm)
+            dspy.configure(lm=lm, adapter=PrefixCachingAdapter())
 
-            evaluate_improvements(
-                InfoExtractor(),
+            evaluate_on_splits(
+                IncrementalExtractor(),
                 optimized_extractor,
-                get_extractor_trainset(),
+                get_incremental_extractor_trainset(),
                 extraction_accuracy,
-                "InfoExtractor"
+                "IncrementalExtractor"
             )
 
-            evaluate_improvements(
+            evaluate_on_splits(
                 WorkoutGenerator(),
                 optimized_generator,
                 get_generator_trainset(),
@@ -365,6 +417,8 @@ def main():
 
         except FileNotFoundError:
             print("\nError: Optimized modules not found. Please run optimization first.")
+        except ArtifactError as e:
+            print(f"\nError: Optimized modules do not match the current signatures ({e}). Please re-run optimization.")
 
     else:
         print("Invalid choice. Exiting.")
@@ -375,6 +429,8 @@ def main():
     print("OPTIMIZATION HISTORY (Last 5 interactions)")
     print("=" * 60)
     dspy.inspect_history(n=5)
+    print_cache_stats(dspy.settings.lm)
+    print_replay_stats(dspy.settings.lm)
 
     print("\n[SUCCESS] Optimization complete! Check the optimized/ directory for saved modules.")
 
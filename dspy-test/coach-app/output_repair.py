@@ -0,0 +1,469 @@
+"""
+Local Repair of Structured LM Output
+
+This module contains:
+- strip_fences: Removes markdown code fences around a JSON value
+- lenient_json: Parses JSON that json.loads rejects (Python literals,
+  trailing commas, surrounding prose, double encoding)
+- repair_value: Validates a typed output field from LM text after
+  deterministic repairs guided by its Pydantic annotation
+- RepairingAdapter: PrefixCachingAdapter that repairs typed output fields
+  instead of letting a parse failure trigger a new LM request
+
+A Workout that fails Pydantic validation (reps "8-10", setType "Working Set",
+a missing setType, weight "50 lbs", sets given as a count) makes
+ChatAdapter.parse raise. dspy then re-requests the whole output through
+JSONAdapter and, if that fails too, main.py reports the turn as failed and
+the user has to ask again. RepairingAdapter parses as usual first; only when
+that fails is each typed field re-parsed with fence stripping, lenient JSON,
+key and shape fixes, numeric coercion, enum normalization and defaults for
+fields the LM left out. Outputs that still do not validate raise the original
+error, so only unrecoverable outputs are re-requested. Running this file
+feeds corrupted workouts through WorkoutGenerator with and without repair
+and reports LM calls, failed turns and latency.
+"""
+
+import ast
+import functools
+import json
+import re
+import types
+from typing import Literal, Union, get_args, get_origin
+
+import json_repair
+import pydantic
+from dspy.adapters.chat_adapter import field_header_pattern
+from dspy.utils.exceptions import AdapterParseError
+
+from prompt_prefix import PrefixCachingAdapter
+
+
+REPAIR_KINDS = ("fences", "lenient_json", "keys", "shape", "numbers", "enums", "defaults")
+
+FENCE_PATTERN = re.compile(r"```[\w-]*[ \t]*\n?(.*?)(?:```|$)", re.DOTALL)
+NUMBER_PATTERN = re.compile(r"-?\d+(?:\.\d+)?")
+
+# Field names LMs use instead of the model's, compared after _normalize
+KEY_ALIASES = {
+    "type": "setType",
+    "repetitions": "reps",
+    "load": "weight",
+    "exercise": "name",
+    "focus": "workoutFocus",
+    "note": "notes",
+}
+# Literal values LMs use instead of the allowed ones, matched as substrings of the normalized value
+ENUM_ALIASES = {
+    "warm": "warmup",
+    "ramp": "warmup",
+    "feeder": "warmup",
+    "work": "working",
+    "main": "working",
+    "top": "working",
+    "backoff": "working",
+    "straight": "working",
+}
+# Values for required fields the LM left out
+FIELD_DEFAULTS = {"setType": "working"}
+
+
+def _normalize(text):
+    return re.sub(r"[^a-z0-9]", "", str(text).lower())
+
+
+@functools.lru_cache(maxsize=64)
+def _type_adapter(annotation):
+    return pydantic.TypeAdapter(annotation)
+
+
+# ============================================================================
+# TEXT REPAIRS
+# ============================================================================
+
+def strip_fences(text):
+    """
+    The content of the first markdown code fence in text, or text itself.
+
+    An unclosed fence (e.g. a truncated response) runs to the end of text.
+
+    Args:
+        text: LM output, e.g. "```json\\n{...}\\n```"
+
+    Returns:
+        str: text without fences, stripped
+    """
+    text = text.strip()
+    if "```" not in text or text[:1] in "{[":
+        return text
+    match = FENCE_PATTERN.search(text)
+    return match.group(1).strip() if match else text
+
+
+def lenient_json(text):
+    """
+    Parse a JSON object or array that json.loads may reject.
+
+    Tries, in order: json.loads, dropping prose before the first bracket,
+    Python literal syntax (single quotes, True/None), and json_repair for
+    trailing commas, comments and unbalanced brackets. A JSON string that
+    itself holds JSON is decoded once more.
+
+    Args:
+        text: JSON-like text
+
+    Returns:
+        dict or list: Parsed value
+
+    Raises:
+        ValueError: If no object or array can be recovered
+    """
+    try:
+        value = json.loads(text)
+    except ValueError:
+        starts = [index for index in (text.find("{"), text.find("[")) if index >= 0]
+        text = text[min(starts):] if starts else text
+        try:
+            value = ast.literal_eval(text)
+        except (ValueError, TypeError, SyntaxError, MemoryError, RecursionError):
+            value = json_repair.loads(text)
+    if isinstance(value, str) and value.strip()[:1] in ("{", "["):
+        return lenient_json(value)
+    if not isinstance(value, (dict, list)):
+        raise ValueError(f"No JSON object or array in {text[:80]!r}")
+    return value
+
+
+# ============================================================================
+# ANNOTATION-GUIDED REPAIRS
+# ============================================================================
+
+def _number(kind, value, optional, repairs):
+    # "8-10" -> 8 (low end of a range), "50 lbs" -> 50.0, "bodyweight" -> None for optional fields
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, float) and kind is int and not value.is_integer():
+        repairs.add("numbers")
+        return round(value)
+    if not isinstance(value, str):
+        return value
+    match = NUMBER_PATTERN.search(value)
+    if match is None:
+        if optional:
+            repairs.add("numbers")
+            return None
+        return value
+    if match.group() != value.strip():
+        repairs.add("numbers")
+    number = float(match.group())
+    return round(number) if kind is int else number
+
+
+def _enum(allowed, value, repairs):
+    # "Working Set" -> "working", "Warm-up" -> "warmup", "top set" -> "working"
+    if value in allowed or not isinstance(value, str):
+        return value
+    key = _normalize(value)
+    options = [option for option in allowed if isinstance(option, str)]
+    match = (
+        next((option for option in options if _normalize(option) == key), None)
+        or next((option for option in options if _normalize(option) in key), None)
+        or next((target for alias, target in ENUM_ALIASES.items() if alias in key and target in allowed), None)
+    )
+    if match is None:
+        return value
+    repairs.add("enums")
+    return match
+
+
+def _list_item_model(annotation):
+    args = get_args(annotation)
+    if get_origin(annotation) is list and args and _is_model(args[0]):
+        return args[0]
+    return None
+
+
+def _is_model(annotation):
+    return isinstance(annotation, type) and issubclass(annotation, pydantic.BaseModel)
+
+
+def _key_map(model):
+    keys = {_normalize(name): name for name in model.model_fields}
+    for alias, name in KEY_ALIASES.items():
+        if name in model.model_fields:
+            keys.setdefault(_normalize(alias), name)
+    return keys
+
+
+def _coerce_model(model, value, repairs):
+    fields = model.model_fields
+    if isinstance(value, list):
+        # A bare list for a model with one required list field: [{exercise}, ...] -> {"exercises": [...]}
+        list_fields = [name for name, field in fields.items()
+                       if field.is_required() and get_origin(field.annotation) is list]
+        if len(list_fields) != 1:
+            return value
+        value = {list_fields[0]: value}
+        repairs.add("shape")
+    if not isinstance(value, dict):
+        return value
+
+    keys = _key_map(model)
+    if len(value) == 1 and _normalize(next(iter(value))) not in keys:
+        # {"workout": {...}} -> {...}
+        inner = next(iter(value.values()))
+        if isinstance(inner, (dict, list)):
+            repairs.add("shape")
+            return _coerce_model(model, inner, repairs)
+
+    data = {}
+    for key, item in value.items():
+        name = keys.get(_normalize(key), key)
+        if name != key:
+            repairs.add("keys")
+        data.setdefault(name, item)
+
+    for name, field in fields.items():
+        item_model = _list_item_model(field.annotation)
+        count = data.get(name)
+        if item_model is None or isinstance(count, bool) or not isinstance(count, (int, float, str)):
+            continue
+        match = NUMBER_PATTERN.search(str(count))
+        if match is None:
+            continue
+        # {"sets": 3, "reps": 10, "weight": 45} -> three {"reps": 10, "weight": 45} sets
+        item_keys = _key_map(item_model)
+        item = {item_keys[_normalize(key)]: data.pop(key) for key in list(data)
+                if key not in fields and _normalize(key) in item_keys}
+        data[name] = [dict(item) for _ in range(max(0, round(float(match.group()))))]
+        repairs.add("shape")
+
+    for name, default in FIELD_DEFAULTS.items():
+        if name in fields and fields[name].is_required() and name not in data:
+            data[name] = default
+            repairs.add("defaults")
+
+    for name, field in fields.items():
+        if name in data:
+            data[name] = _coerce(field.annotation, data[name], repairs)
+    return data
+
+
+def _coerce(annotation, value, repairs, optional=False):
+    origin, args = get_origin(annotation), get_args(annotation)
+    if origin in (Union, types.UnionType):
+        options = [arg for arg in args if arg is not type(None)]
+        if value is None or len(options) != 1:
+            return value
+        return _coerce(options[0], value, repairs, optional=len(options) < len(args))
+    if _is_model(annotation):
+        return _coerce_model(annotation, value, repairs)
+    if origin is list:
+        if isinstance(value, dict):
+            value = [value]
+            repairs.add("shape")
+        if not isinstance(value, list) or not args:
+            return value
+        return [_coerce(args[0], item, repairs) for item in value]
+    if origin is Literal:
+        return _enum(args, value, repairs)
+    if annotation in (int, float):
+        return _number(annotation, value, optional, repairs)
+    return value
+
+
+def repair_value(annotation, text):
+    """
+    Parse text as annotation, repairing it where plain parsing fails.
+
+    Args:
+        annotation: Output field annotation, e.g. Workout or List[ExtractedInfo]
+        text: Raw field text from the LM
+
+    Returns:
+        tuple: (validated value, set of REPAIR_KINDS applied)
+
+    Raises:
+        ValueError: If the value cannot be recovered (pydantic.ValidationError
+            is a ValueError)
+    """
+    repairs = set()
+    stripped = strip_fences(text)
+    if stripped != text.strip():
+        repairs.add("fences")
+    try:
+        data = json.loads(stripped)
+    except ValueError:
+        data = lenient_json(stripped)
+        repairs.add("lenient_json")
+    return _type_adapter(annotation).validate_python(_coerce(annotation, data, repairs)), repairs
+
+
+# ============================================================================
+# ADAPTER
+# ============================================================================
+
+def _sections(completion):
+    # Field name -> text, split on [[ ## name ## ]] headers like ChatAdapter.parse (first occurrence wins)
+    sections = [(None, [])]
+    for line in completion.splitlines():
+        match = field_header_pattern.match(line.strip())
+        if match:
+            remaining = line.strip()[match.end():].strip()
+            sections.append((match.group(1), [remaining] if remaining else []))
+        else:
+            sections[-1][1].append(line)
+    parsed = {}
+    for name, lines in sections:
+        parsed.setdefault(name, "\n".join(lines).strip())
+    return parsed
+
+
+class RepairingAdapter(PrefixCachingAdapter):
+    """
+    PrefixCachingAdapter that repairs typed output fields before giving up.
+
+    Completions that ChatAdapter parses are returned unchanged. Otherwise
+    str fields are taken as written and every other field goes through
+    repair_value; if that fails too, the original AdapterParseError is
+    raised and dspy falls back to re-requesting the output.
+
+    stats counts outputs parsed as-is, retries_avoided (outputs repaired
+    locally instead of re-requested), unrecoverable outputs and how often
+    each repair kind was needed.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = {"parsed": 0, "retries_avoided": 0, "unrecoverable": 0, **dict.fromkeys(REPAIR_KINDS, 0)}
+
+    def parse(self, signature, completion):
+        try:
+            fields = super().parse(signature, completion)
+        except AdapterParseError as error:
+            return self._repair(signature, completion, error)
+        self.stats["parsed"] += 1
+        return fields
+
+    def _repair(self, signature, completion, error):
+        sections = _sections(completion)
+        fields, repairs = {}, set()
+        try:
+            for name, field in signature.output_fields.items():
+                if name not in sections:
+                    raise ValueError(f"Missing output field {name}")
+                if field.annotation is str:
+                    fields[name] = sections[name]
+                    continue
+                fields[name], applied = repair_value(field.annotation, sections[name])
+                repairs |= applied
+        except ValueError:
+            self.stats["unrecoverable"] += 1
+            raise error
+        self.stats["retries_avoided"] += 1
+        for kind in repairs:
+            self.stats[kind] += 1
+        return fields
+
+
+def print_repair_stats(adapter):
+    """Print repair counters if adapter is a RepairingAdapter."""
+    if isinstance(adapter, RepairingAdapter):
+        stats = adapter.stats
+        applied = ", ".join(f"{kind} {stats[kind]}" for kind in REPAIR_KINDS if stats[kind])
+        print(
+            f"[Output repair] {stats['parsed']} parsed as-is, {stats['retries_avoided']} repaired "
+            f"(retries avoided), {stats['unrecoverable']} unrecoverable" + (f"; {applied}" if applied else "")
+        )
+
+
+# ============================================================================
+# BENCHMARK
+# ============================================================================
+
+def corrupted_workouts(workout):
+    """
+    Malformed renderings of workout seen from real LMs, by name.
+
+    Args:
+        workout: Valid workout dict (e.g. stub_lm.DEFAULT_WORKOUT)
+
+    Returns:
+        dict: case name -> workout field text
+    """
+    def sets(transform):
+        return {**workout, "exercises": [
+            {**exercise, "sets": [transform(dict(s)) for s in exercise["sets"]]} for exercise in workout["exercises"]
+        ]}
+
+    rep_ranges = sets(lambda s: {**s, "reps": f"{s['reps'] - 2}-{s['reps']}"})
+    set_types = sets(lambda s: {**s, "setType": "Warm-up Set" if s["setType"] == "warmup" else "Working Set"})
+    no_set_type = sets(lambda s: {key: value for key, value in s.items() if key != "setType"})
+    units = sets(lambda s: {**s, "weight": f"{s['weight']:g} lbs"})
+    counts = {**workout, "exercises": [
+        {"name": exercise["name"], "sets": len(exercise["sets"]), "reps": exercise["sets"][-1]["reps"],
+         "weight": exercise["sets"][-1]["weight"]} for exercise in workout["exercises"]
+    ]}
+    snake_case = {"workout_focus": workout["workoutFocus"], "notes": workout["notes"], "exercises": [
+        {"name": exercise["name"], "sets": [{"set_type": s["setType"], "reps": s["reps"], "weight": s["weight"]}
+                                            for s in exercise["sets"]]} for exercise in workout["exercises"]
+    ]}
+    combined = sets(lambda s: {"type": s["setType"].upper(), "reps": f"{s['reps']} reps",
+                               "weight": f"{s['weight']:g}lb"})
+    amrap = sets(lambda s: {**s, "reps": "AMRAP"})
+    return {
+        "clean": json.dumps(workout),
+        "fenced": f"```json\n{json.dumps(workout, indent=2)}\n```",
+        "python literals": repr({**workout, "notes": None}),
+        "trailing commas": json.dumps(workout).replace("}]", "},]"),
+        "rep ranges": json.dumps(rep_ranges),
+        "set type labels": json.dumps(set_types),
+        "missing setType": json.dumps(no_set_type),
+        "weight units": json.dumps(units),
+        "sets as count": json.dumps(counts),
+        "snake_case keys": json.dumps(snake_case),
+        "wrapped": json.dumps({"workout": workout}),
+        "combined": f"Here is your plan:\n```\n{json.dumps({'workout': combined})}\n```",
+        "AMRAP reps": json.dumps(amrap),
+        "prose only": "Sorry, I could not put a workout together for that.",
+    }
+
+
+if __name__ == "__main__":
+    import time
+
+    import dspy
+
+    from modules import WorkoutGenerator
+    from stub_lm import DEFAULT_WORKOUT, StubLM
+    from training_data import get_generator_trainset
+
+    inputs = get_generator_trainset()[0].inputs().toDict()
+    cases = corrupted_workouts(DEFAULT_WORKOUT)
+    adapters = {"ChatAdapter": PrefixCachingAdapter(), "Repairing": RepairingAdapter()}
+
+    print("=" * 60)
+    print("OUTPUT REPAIR (StubLM, 300ms per call; a failed parse is re-requested via JSONAdapter)")
+    print("=" * 60)
+    print(f"{'Case':<17} | {'ChatAdapter':>16} | {'Repairing':>16}")
+    totals = {name: {"calls": 0, "failed": 0, "seconds": 0.0} for name in adapters}
+    for case, text in cases.items():
+        row = []
+        for name, adapter in adapters.items():
+            lm = StubLM(responses={"workout": text}, latency=0.3)
+            start = time.perf_counter()
+            try:
+                with dspy.context(lm=lm, adapter=adapter):
+                    WorkoutGenerator()(**inputs)
+                outcome = "ok"
+            except Exception:
+                outcome = "FAILED"
+                totals[name]["failed"] += 1
+            totals[name]["seconds"] += time.perf_counter() - start
+            totals[name]["calls"] += lm.calls
+            row.append(f"{outcome:>6}, {lm.calls} call{'s' if lm.calls > 1 else ' '}")
+        print(f"{case:<17} | {row[0]:>16} | {row[1]:>16}")
+
+    print()
+    for name, total in totals.items():
+        print(f"{name:<12} {total['calls']:>3} LM calls, {total['failed']:>2} failed turns, "
+              f"{total['seconds']:.1f}s total")
+    print_repair_stats(adapters["Repairing"])
@@ -0,0 +1,248 @@
+"""
+Speculative Turn Pipeline for Coach Nova
+
+This module contains:
+- SpeculativePipeline: Runs the main.py turn with extraction overlapping the
+  coach call, and optionally starts workout generation as soon as the
+  extracted requirements are complete
+- run_serial: The original one-call-after-another turn, used as a baseline
+
+main.py waits for CoachAgent, then IncrementalExtractor, then
+WorkoutGenerator. Extraction only needs the user's message and the coach
+question it answers, both known before the coach is called, so here it runs
+on a copy of the ExtractionState while the coach is still answering; the
+copy, with the coach's reply recorded as its previous_coach, replaces the
+real state once the coach returns. Speculative generation
+is keyed by its inputs: it is reused while later extractions produce the same
+inputs and is cancelled (or, if already running, discarded) once they change.
+Running this file replays the training conversations against a StubLM and
+reports end-to-end latency saved per conversation.
+"""
+
+import ast
+import contextvars
+import copy
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from extraction_state import ExtractionState
+from history_compaction import render_history
+from sessions import TurnResult, build_generator_inputs, find_missing_fields
+
+
+class SpeculativePipeline:
+    """
+    One conversation whose LM calls overlap where the data allows it.
+
+    Extraction runs every turn (rules first, so many turns cost no LM call)
+    instead of only when the coach sets should_extract; the extra calls are
+    the price for taking extraction off the critical path.
+
+    Args:
+        coach: CoachAgent
+        extractor: IncrementalExtractor
+        generator: WorkoutGenerator
+        speculate_generation: Start generation before the coach asks for it
+        history_compactor: Optional HistoryCompactor for the coach's conversation_history
+    """
+    def __init__(self, coach, extractor, generator, speculate_generation=True, history_compactor=None):
+        self.coach = coach
+        self.extractor = extractor
+        self.generator = generator
+        self.speculate_generation = speculate_generation
+        self.history_compactor = history_compactor
+        self.history = []
+        self.extraction = ExtractionState()
+        self._executor = ThreadPoolExecutor(max_workers=2)
+        self._lock = threading.Lock()
+        self._generation = None  # (inputs key, future)
+        self.stats = {
+            "extractions": 0,
+            "generations_started": 0,
+            "generations_used": 0,
+            "generations_discarded": 0,
+        }
+
+    def _submit(self, fn, *args, **kwargs):
+        # Workers inherit dspy.context(...) overrides from the caller
+        return self._executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+    def _speculate(self, state):
+        extracted = state.extract(self.extractor)
+        if self.speculate_generation and not find_missing_fields(extracted):
+            self._start_generation(build_generator_inputs(extracted))
+        return extracted
+
+    def _start_generation(self, inputs):
+        key = tuple(sorted(inputs.items()))
+        with self._lock:
+            if self._generation and self._generation[0] == key:
+                return
+            self._discard_generation()
+            self._generation = (key, self._submit(self.generator, **inputs))
+            self.stats["generations_started"] += 1
+
+    def _discard_generation(self):
+        # A running thread cannot be interrupted; its result is simply dropped
+        if self._generation:
+            self._generation[1].cancel()
+            self.stats["generations_discarded"] += 1
+            self._generation = None
+
+    def _take_generation(self, inputs):
+        key = tuple(sorted(inputs.items()))
+        with self._lock:
+            if self._generation and self._generation[0] == key:
+                future = self._generation[1]
+                self._generation = None
+                self.stats["generations_used"] += 1
+                return future
+            self._discard_generation()
+        return None
+
+    def turn(self, user_message):
+        """
+        Process one user message with extraction overlapping the coach call.
+
+        Args:
+            user_message: Text typed by the user
+
+        Returns:
+            TurnResult: Same fields as SessionEngine.turn
+        """
+        start = time.perf_counter()
+
+        # The coach reply is not known yet; the question being answered is the
+        # state's previous_coach, which leads the extraction request
+        speculative_state = copy.deepcopy(self.extraction)
+        speculative_state.add_exchange(user_message, "")
+        extraction = self._submit(self._speculate, speculative_state)
+        self.stats["extractions"] += 1
+
+        conversation_history = render_history(self.history, self.history_compactor, self.extraction.fields)
+        result = self.coach(conversation_history=conversation_history, user_message=user_message)
+        self.history.append({"user": user_message, "coach": result.response})
+
+        extracted = extraction.result()
+        speculative_state.previous_coach = result.response
+        self.extraction = speculative_state
+
+        turn = TurnResult(response=result.response, should_extract=result.should_extract.lower() == "true")
+        if turn.should_extract:
+            turn.extracted = extracted
+            turn.missing_fields = find_missing_fields(extracted)
+            if not turn.missing_fields:
+                inputs = build_generator_inputs(extracted)
+                future = self._take_generation(inputs)
+                generated = future.result() if future else self.generator(**inputs)
+                turn.workout = generated.workout
+
+        turn.latency = time.perf_counter() - start
+        return turn
+
+    def reset(self):
+        """Start a new workout, dropping any speculative work."""
+        with self._lock:
+            self._discard_generation()
+        self.history = []
+        self.extraction = ExtractionState()
+
+    def close(self):
+        """Discard speculative work and stop the worker threads."""
+        self.reset()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def run_serial(coach, extractor, generator, script):
+    """
+    Replay a scripted conversation with main.py's serial turn.
+
+    Args:
+        coach: CoachAgent
+        extractor: IncrementalExtractor
+        generator: WorkoutGenerator
+        script: User messages in order
+
+    Returns:
+        list: TurnResult per message
+    """
+    history = []
+    extraction = ExtractionState()
+    turns = []
+    for user_message in script:
+        start = time.perf_counter()
+        result = coach(conversation_history=str(history), user_message=user_message)
+        history.append({"user": user_message, "coach": result.response})
+        extraction.add_exchange(user_message, result.response)
+
+        turn = TurnResult(response=result.response, should_extract=result.should_extract.lower() == "true")
+        if turn.should_extract:
+            turn.extracted = extraction.extract(extractor)
+            turn.missing_fields = find_missing_fields(turn.extracted)
+            if not turn.missing_fields:
+                turn.workout = generator(**build_generator_inputs(turn.extracted)).workout
+        turn.latency = time.perf_counter() - start
+        turns.append(turn)
+    return turns
+
+
+if __name__ == "__main__":
+    import dspy
+    from extraction_state import EXTRACTION_FIELDS
+    from modules import CoachAgent, IncrementalExtractor, WorkoutGenerator
+    from stub_lm import StubLM
+    from training_data import get_extractor_trainset
+
+    def stub_for(exchanges, latency):
+        """StubLM replaying the recorded coach replies and the example's labels."""
+        replies = {exchange["user"]: exchange["coach"] for exchange in exchanges}
+        last_user = exchanges[-1]["user"]
+
+        def user_message(messages):
+            content = messages[-1]["content"]
+            return content.split("[[ ## user_message ## ]]\n", 1)[1].split("\n\n", 1)[0]
+
+        return StubLM(latency=latency, responses={
+            "response": lambda messages: replies.get(user_message(messages), "Tell me more."),
+            "should_extract": lambda messages: "true" if user_message(messages) == last_user else "false",
+            **{name: example[name] for name in EXTRACTION_FIELDS},
+        })
+
+    latency = 0.2
+    coach, extractor, generator = CoachAgent(), IncrementalExtractor(), WorkoutGenerator()
+
+    print("=" * 60)
+    print(f"SPECULATIVE PIPELINE (StubLM, {latency * 1000:.0f}ms per call)")
+    print("=" * 60)
+    print(f"{'Conv':>4} | {'Turns':>5} | {'Serial':>8} | {'Pipelined':>9} | {'Saved':>8} | {'LM calls':>13}")
+    totals = {"serial": 0.0, "pipelined": 0.0, "used": 0, "discarded": 0}
+    for index, example in enumerate(get_extractor_trainset(), 1):
+        exchanges = ast.literal_eval(example.conversation_history)
+        script = [exchange["user"] for exchange in exchanges]
+
+        lm = stub_for(exchanges, latency)
+        with dspy.context(lm=lm):
+            serial = run_serial(coach, extractor, generator, script)
+        serial_calls = lm.calls
+
+        lm = stub_for(exchanges, latency)
+        pipeline = SpeculativePipeline(coach, extractor, generator)
+        with dspy.context(lm=lm):
+            pipelined = [pipeline.turn(message) for message in script]
+        totals["used"] += pipeline.stats["generations_used"]
+        totals["discarded"] += pipeline.stats["generations_discarded"]
+        pipeline.close()
+
+        serial_seconds = sum(turn.latency for turn in serial)
+        pipelined_seconds = sum(turn.latency for turn in pipelined)
+        totals["serial"] += serial_seconds
+        totals["pipelined"] += pipelined_seconds
+        assert serial[-1].workout == pipelined[-1].workout
+        print(
+            f"{index:>4} | {len(script):>5} | {serial_seconds * 1000:6.0f}ms | {pipelined_seconds * 1000:7.0f}ms | "
+            f"{(serial_seconds - pipelined_seconds) * 1000:6.0f}ms | {serial_calls:>5} -> {lm.calls:<5}"
+        )
+    saved = totals["serial"] - totals["pipelined"]
+    print(f"\nEnd-to-end latency saved: {saved * 1000:.0f}ms ({saved / totals['serial']:.0%})")
+    print(f"Speculative generations: {totals['used']} used, {totals['discarded']} discarded as stale")
@@ -0,0 +1,186 @@
+"""
+Prompt-Prefix Reuse for ChatAdapter Prompts
+
+This module contains:
+- render_prefix: The invariant part of a ChatAdapter prompt (system message + demos)
+- PrefixCache: Bounded cache of rendered prefixes keyed by signature and demos
+- PREFIX_CACHE: Process-wide cache, also seeded by artifacts.load_optimized
+- PrefixCachingAdapter: ChatAdapter that renders each prefix once and then
+  only formats the per-call user message
+
+ChatAdapter.format rebuilds the field descriptions, the output structure
+(including the Workout JSON schema), the instructions and every demo on each
+call, although they only change when a predictor's signature or demos are
+replaced (e.g. by an optimizer or an artifact load). Here they are rendered
+once per (signature, demos) version and reused as the very same strings, so
+every call starts with a byte-identical prefix that provider-side prompt
+caching can match. The output-field reminder at the end of the user message
+is cached the same way. Running this file reports formatting time and prompt
+bytes per call for each module, before and after.
+"""
+
+import threading
+from collections import OrderedDict
+
+import dspy
+
+
+def render_prefix(adapter, signature, demos):
+    """System message and demo messages, exactly as ChatAdapter.format renders them."""
+    system_message = (
+        f"{adapter.format_field_description(signature)}\n"
+        f"{adapter.format_field_structure(signature)}\n"
+        f"{adapter.format_task_description(signature)}"
+    )
+    return [{"role": "system", "content": system_message}, *adapter.format_demos(signature, demos)]
+
+
+class PrefixCache:
+    """
+    Rendered prompt prefixes keyed by signature and demos identity.
+
+    An entry holds references to the signature and demos it was rendered
+    for, so a predictor whose signature or demos list is replaced (a new
+    "version") misses and gets a fresh rendering. Least recently used entries
+    are dropped beyond max_entries.
+    """
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _demo_ids(demos):
+        return tuple(map(id, demos))
+
+    def get(self, signature, demos):
+        """Return the cached prefix messages, or None if this version was not rendered."""
+        entry = self._entries.get(id(signature))
+        if entry is None or entry[0] is not signature or entry[1] is not demos or entry[2] != self._demo_ids(demos):
+            return None
+        with self._lock:
+            self._entries.move_to_end(id(signature))
+        return entry[3]
+
+    def put(self, signature, demos, messages):
+        """Store the prefix rendered for signature and demos."""
+        with self._lock:
+            self._entries[id(signature)] = (signature, demos, self._demo_ids(demos), messages)
+            self._entries.move_to_end(id(signature))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+PREFIX_CACHE = PrefixCache()
+
+
+class PrefixCachingAdapter(dspy.ChatAdapter):
+    """
+    ChatAdapter that reuses rendered prefixes from a PrefixCache.
+
+    Prompts are identical to ChatAdapter's. Signatures with a dspy.History
+    input field fall back to ChatAdapter.format.
+
+    Args:
+        cache: PrefixCache to use (default: the shared PREFIX_CACHE)
+    """
+    def __init__(self, *args, cache=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cache = cache or PREFIX_CACHE
+        self._requirements = {}
+
+    def __deepcopy__(self, memo):
+        # dspy.context copies settings; the cache must stay shared
+        return self
+
+    def user_message_output_requirements(self, signature):
+        entry = self._requirements.get(id(signature))
+        if entry is None or entry[0] is not signature:
+            entry = (signature, super().user_message_output_requirements(signature))
+            self._requirements[id(signature)] = entry
+        return entry[1]
+
+    def format(self, signature, demos, inputs):
+        if self._get_history_field_name(signature):
+            return super().format(signature, demos, inputs)
+        prefix = self.cache.get(signature, demos)
+        if prefix is None:
+            self.cache.misses += 1
+            prefix = render_prefix(self, signature, demos)
+            self.cache.put(signature, demos, prefix)
+        else:
+            self.cache.hits += 1
+        content = self.format_user_message_content(signature, dict(inputs), main_request=True)
+        return [*prefix, {"role": "user", "content": content}]
+
+
+if __name__ == "__main__":
+    import json
+    import os
+    import time
+
+    from artifacts import OPTIMIZED_DIR, load_optimized
+    from extraction_state import ExtractionState
+    from modules import CoachAgent, InfoExtractor, IncrementalExtractor, WorkoutGenerator
+    from sessions import build_generator_inputs
+    from training_data import get_extractor_trainset
+
+    extractor = InfoExtractor()
+    load_optimized(extractor, os.path.join(OPTIMIZED_DIR, "extractor.json"), snapshot_dir=None)
+    PREFIX_CACHE.clear()
+
+    conversations = [example.conversation_history for example in get_extractor_trainset()]
+    state = ExtractionState(use_rules=False)
+    state.add_exchange("I want to build muscle with dumbbells", "How long do you have?")
+    cases = {
+        "CoachAgent": (CoachAgent().chat.predict, [
+            {"conversation_history": history, "user_message": "45 minutes please"} for history in conversations
+        ]),
+        "InfoExtractor (optimized)": (extractor.extract.predict, [
+            {"conversation_history": history} for history in conversations
+        ]),
+        "IncrementalExtractor": (IncrementalExtractor().update.predict, [
+            {key: value for key, value in state.request().items() if key != "open_fields"}
+        ]),
+        "WorkoutGenerator": (WorkoutGenerator().generate.predict, [
+            build_generator_inputs(dspy.Prediction(goal=goal, equipment="dumbbells", duration="45", focus="legs"))
+            for goal in ("strength", "hypertrophy", "endurance")
+        ]),
+    }
+
+    def per_call_us(adapter, predictor, inputs_list, repeats=200):
+        start = time.perf_counter()
+        for _ in range(repeats):
+            for inputs in inputs_list:
+                adapter.format(predictor.signature, predictor.demos, inputs)
+        return (time.perf_counter() - start) / (repeats * len(inputs_list)) * 1e6
+
+    print("=" * 60)
+    print("PROMPT FORMATTING PER CALL (ChatAdapter -> PrefixCachingAdapter)")
+    print("=" * 60)
+    plain, caching = dspy.ChatAdapter(), PrefixCachingAdapter()
+    for name, (predictor, inputs_list) in cases.items():
+        for inputs in inputs_list:
+            expected = plain.format(predictor.signature, predictor.demos, inputs)
+            assert caching.format(predictor.signature, predictor.demos, inputs) == expected, name
+        messages = plain.format(predictor.signature, predictor.demos, inputs_list[0])
+        total_bytes = len(json.dumps(messages).encode("utf-8"))
+        prefix = PREFIX_CACHE.get(predictor.signature, predictor.demos)
+        prefix_bytes = len(json.dumps(prefix).encode("utf-8"))
+        before = per_call_us(plain, predictor, inputs_list)
+        after = per_call_us(caching, predictor, inputs_list)
+        print(f"\n{name}")
+        print(f"  formatting: {before:7.1f}us -> {after:6.1f}us per call ({before / after:.1f}x)")
+        print(f"  prompt bytes: {total_bytes} per call; re-rendered per call {total_bytes} -> "
+              f"{total_bytes - prefix_bytes} ({prefix_bytes / total_bytes:.0%} reused byte-for-byte)")
+    print(f"\nPrefix cache: {PREFIX_CACHE.hits} hits, {PREFIX_CACHE.misses} renders, {len(PREFIX_CACHE)} entries")
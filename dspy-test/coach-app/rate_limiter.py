@@ -0,0 +1,393 @@
+"""
+Multi-Limit Rate Limiter for Gemini Calls
+
+This module contains:
+- TokenBucket: Refilling budget with burst capacity (requests or tokens)
+- DailyQuota: Requests-per-day counter persisted across process restarts
+- RateLimiter: Combines per-minute, per-day and tokens-per-minute limits with
+  429-aware exponential backoff; safe to share between threads and asyncio tasks
+- RateLimitedLM: dspy.LM that acquires from a RateLimiter before every call,
+  streamed ones included
+
+Gemini free tier limits (see backend/docs/google-rate-limits.md):
+- 10 requests per minute
+- 50 requests per day, reset at midnight Pacific time
+- 250,000 input tokens per minute
+
+Buckets hand out reservations: a caller that has to wait takes its share
+immediately and sleeps outside the lock, so concurrent callers queue up in
+order instead of all waking at once.
+"""
+
+import asyncio
+import datetime
+import functools
+import json
+import os
+import threading
+import time
+
+import dspy
+import litellm
+from litellm.exceptions import RateLimitError
+
+from token_estimate import estimate_tokens
+
+try:
+    from zoneinfo import ZoneInfo
+    QUOTA_TIMEZONE = ZoneInfo("America/Los_Angeles")
+except Exception:  # tzdata missing: fall back to UTC days
+    QUOTA_TIMEZONE = datetime.timezone.utc
+
+
+DEFAULT_STATE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "rate_limits.json")
+
+# Limits used by optimize.py, kept just under the free tier
+GEMINI_FREE_TIER = {
+    "requests_per_min": 9,
+    "requests_per_day": 50,
+    "tokens_per_min": 250_000,
+}
+
+
+class QuotaExhaustedError(RuntimeError):
+    """Raised when the daily request quota has been used up."""
+
+
+# ============================================================================
+# BUDGETS
+# ============================================================================
+
+class TokenBucket:
+    """
+    Budget that refills continuously up to capacity.
+
+    capacity is the burst credit: after an idle period up to capacity units
+    can be spent back to back. reserve() may drive the balance negative; the
+    returned wait is how long the caller must sleep before its units exist.
+    """
+    def __init__(self, rate_per_sec, capacity):
+        self.rate_per_sec = rate_per_sec
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        elapsed = now - self.updated
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.rate_per_sec)
+        self.updated = now
+
+    def reserve(self, amount, now):
+        """Take amount units and return the seconds to wait before using them."""
+        self._refill(now)
+        self.tokens -= amount
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.rate_per_sec
+
+    def adjust(self, amount, now):
+        """Return (positive) or charge (negative) units after the fact."""
+        self._refill(now)
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class DailyQuota:
+    """
+    Requests-per-day counter stored as JSON so restarts do not reset it.
+
+    The day rolls over at midnight in QUOTA_TIMEZONE, matching Gemini's reset.
+    """
+    def __init__(self, limit, path=DEFAULT_STATE_PATH):
+        self.limit = limit
+        self.path = path
+        self.day, self.count = self._load()
+
+    @staticmethod
+    def today():
+        return datetime.datetime.now(QUOTA_TIMEZONE).date().isoformat()
+
+    def _load(self):
+        if self.path and os.path.exists(self.path):
+            try:
+                with open(self.path) as f:
+                    state = json.load(f)
+                if state.get("day") == self.today():
+                    return state["day"], int(state["count"])
+            except (ValueError, KeyError, OSError):
+                pass
+        return self.today(), 0
+
+    def _save(self):
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"day": self.day, "count": self.count}, f)
+        os.replace(tmp_path, self.path)
+
+    def remaining(self):
+        if self.day != self.today():
+            self.day, self.count = self.today(), 0
+        return self.limit - self.count
+
+    def consume(self):
+        """Count one request, raising QuotaExhaustedError if none are left."""
+        if self.remaining() <= 0:
+            raise QuotaExhaustedError(
+                f"Daily quota of {self.limit} requests used up; resets at midnight Pacific time"
+            )
+        self.count += 1
+        self._save()
+
+    def refund(self):
+        """Give back one request that the provider rejected."""
+        if self.count > 0:
+            self.count -= 1
+            self._save()
+
+
+# ============================================================================
+# RATE LIMITER
+# ============================================================================
+
+class RateLimiter:
+    """
+    Enforces several limits at once and backs off after 429 responses.
+
+    Args:
+        requests_per_min: Request budget per minute (None to disable)
+        requests_per_day: Persistent daily request quota (None to disable)
+        tokens_per_min: Prompt token budget per minute (None to disable)
+        burst: Requests allowed back to back after idling (default: requests_per_min)
+        state_path: JSON file holding the daily counter
+        max_backoff: Upper bound in seconds for 429 backoff
+    """
+    def __init__(self, requests_per_min=None, requests_per_day=None, tokens_per_min=None,
+                 burst=None, state_path=DEFAULT_STATE_PATH, max_backoff=120.0):
+        self.requests = TokenBucket(requests_per_min / 60.0, burst or requests_per_min) if requests_per_min else None
+        self.tokens = TokenBucket(tokens_per_min / 60.0, tokens_per_min) if tokens_per_min else None
+        self.daily = DailyQuota(requests_per_day, state_path) if requests_per_day else None
+        self.max_backoff = max_backoff
+        self.backoff = 0.0
+        self.blocked_until = 0.0
+        self.waited = 0.0
+        self.rate_limit_errors = 0
+        self.quota_errors = 0
+        self._lock = threading.Lock()
+
+    def __deepcopy__(self, memo):
+        # lm.copy() must keep drawing from the same budget
+        return self
+
+    def _reserve(self, tokens):
+        with self._lock:
+            now = time.monotonic()
+            if self.daily:
+                try:
+                    self.daily.consume()
+                except QuotaExhaustedError:
+                    self.quota_errors += 1
+                    raise
+            wait = max(0.0, self.blocked_until - now)
+            if self.requests:
+                wait = max(wait, self.requests.reserve(1, now))
+            if self.tokens:
+                wait = max(wait, self.tokens.reserve(tokens, now))
+            self.waited += wait
+            return wait
+
+    def acquire(self, tokens=0):
+        """Block the calling thread until a request with this many prompt tokens may be sent."""
+        wait = self._reserve(tokens)
+        if wait:
+            print(f"  [Rate limit] Waiting {wait:.1f}s before next request...")
+            time.sleep(wait)
+
+    async def aacquire(self, tokens=0):
+        """Async variant of acquire() that yields to the event loop while waiting."""
+        wait = self._reserve(tokens)
+        if wait:
+            await asyncio.sleep(wait)
+
+    def record_usage(self, estimated_tokens, actual_tokens):
+        """Correct the token bucket once the real prompt token count is known."""
+        if self.tokens and actual_tokens is not None:
+            with self._lock:
+                self.tokens.adjust(estimated_tokens - actual_tokens, time.monotonic())
+
+    def on_success(self):
+        """Relax the backoff after a successful call."""
+        with self._lock:
+            self.backoff = self.backoff / 2 if self.backoff > 1.0 else 0.0
+
+    def on_rate_limit(self, retry_after=None):
+        """
+        Block all callers after a 429, doubling the delay on repeated errors.
+
+        Args:
+            retry_after: Server-provided delay in seconds, if any
+
+        Returns:
+            float: Seconds all callers will now wait
+        """
+        with self._lock:
+            self.rate_limit_errors += 1
+            self.backoff = min(self.max_backoff, max(2.0, self.backoff * 2))
+            delay = max(self.backoff, retry_after or 0.0)
+            self.blocked_until = max(self.blocked_until, time.monotonic() + delay)
+            # Rejected requests do not use daily quota; the retry consumes it again
+            if self.daily:
+                self.daily.refund()
+            return delay
+
+    def stats(self):
+        """Counters describing limiter activity."""
+        return {
+            "waited_seconds": self.waited,
+            "rate_limit_errors": self.rate_limit_errors,
+            "quota_errors": self.quota_errors,
+            "daily_remaining": self.daily.remaining() if self.daily else None,
+        }
+
+
+def retry_after_seconds(error):
+    """Read a Retry-After header from a litellm RateLimitError, if present."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def prompt_tokens(prompt, messages):
+    """Estimate prompt tokens for a request before it is sent."""
+    if messages:
+        return sum(estimate_tokens(str(m.get("content", ""))) for m in messages)
+    return estimate_tokens(prompt or "")
+
+
+# ============================================================================
+# RATE-LIMITED LM
+# ============================================================================
+
+class RateLimitedLM(dspy.LM):
+    """
+    Wrapper around dspy.LM that enforces rate limiting.
+
+    Every call first acquires from a RateLimiter (shared with lm.copy() and
+    with any other LM given the same limiter). litellm's own retries are
+    disabled so that 429s come back here: the limiter backs off for every
+    caller and the request is retried up to max_rate_limit_retries times.
+    """
+    def __init__(self, *args, requests_per_min=9, requests_per_day=None, tokens_per_min=None,
+                 limiter=None, max_rate_limit_retries=4, **kwargs):
+        kwargs.setdefault("num_retries", 0)
+        super().__init__(*args, **kwargs)
+        self.limiter = limiter or RateLimiter(
+            requests_per_min=requests_per_min,
+            requests_per_day=requests_per_day,
+            tokens_per_min=tokens_per_min,
+        )
+        self.max_rate_limit_retries = max_rate_limit_retries
+
+    def _send(self, request, estimated):
+        """Call request() once the limiter allows it, backing off and retrying on 429s."""
+        for attempt in range(self.max_rate_limit_retries + 1):
+            self.limiter.acquire(estimated)
+            try:
+                return request()
+            except RateLimitError as e:
+                if attempt == self.max_rate_limit_retries:
+                    raise
+                delay = self.limiter.on_rate_limit(retry_after_seconds(e))
+                print(f"  [Rate limit] 429 received, backing off {delay:.1f}s...")
+
+    async def _asend(self, request, estimated):
+        """Async variant of _send()."""
+        for attempt in range(self.max_rate_limit_retries + 1):
+            await self.limiter.aacquire(estimated)
+            try:
+                return await request()
+            except RateLimitError as e:
+                if attempt == self.max_rate_limit_retries:
+                    raise
+                self.limiter.on_rate_limit(retry_after_seconds(e))
+
+    def _record(self, estimated, usage):
+        # usage comes from this call's own response: self.history[-1] may
+        # belong to another thread's call when the LM is shared
+        usage = dict(usage) if usage else {}
+        self.limiter.record_usage(estimated, usage.get("prompt_tokens"))
+        self.limiter.on_success()
+
+    def forward(self, prompt=None, messages=None, **kwargs):
+        estimated = prompt_tokens(prompt, messages)
+        request = functools.partial(super().forward, prompt=prompt, messages=messages, **kwargs)
+        response = self._send(request, estimated)
+        self._record(estimated, getattr(response, "usage", None))
+        return response
+
+    async def aforward(self, prompt=None, messages=None, **kwargs):
+        estimated = prompt_tokens(prompt, messages)
+        request = functools.partial(super().aforward, prompt=prompt, messages=messages, **kwargs)
+        response = await self._asend(request, estimated)
+        self._record(estimated, getattr(response, "usage", None))
+        return response
+
+    def stream(self, prompt=None, messages=None, **kwargs):
+        """
+        Yield completion text as litellm streams it, with the same limiting,
+        429 retries and usage recording as a regular call.
+
+        Only opening the stream is retried; once text has been yielded an
+        error propagates to the caller. Streaming bypasses dspy's cache.
+
+        Args:
+            prompt: Plain prompt, used when messages is not given
+            messages: OpenAI-style message list built by the ChatAdapter
+
+        Yields:
+            str: Successive pieces of the completion
+        """
+        messages = messages or [{"role": "user", "content": prompt}]
+        estimated = prompt_tokens(None, messages)
+        response = self._send(lambda: litellm.completion(
+            model=self.model,
+            messages=messages,
+            stream=True,
+            stream_options={"include_usage": True},
+            num_retries=self.num_retries,
+            **{**self.kwargs, **kwargs},
+        ), estimated)
+        usage = None
+        for chunk in response:
+            usage = getattr(chunk, "usage", None) or usage
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                yield delta
+        self._record(estimated, usage)
+
+
+if __name__ == "__main__":
+    from concurrent.futures import ThreadPoolExecutor
+
+    # 120 req/min with a burst of 5: the first 5 calls go through immediately,
+    # the rest are spaced 0.5s apart regardless of how many threads ask
+    limiter = RateLimiter(requests_per_min=120, burst=5, state_path=None)
+    start = time.perf_counter()
+    stamps = []
+
+    def call(_):
+        limiter.acquire()
+        stamps.append(time.perf_counter() - start)
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(call, range(10)))
+
+    print("=" * 60)
+    print("RATE LIMITER (120 req/min, burst 5, 8 threads)")
+    print("=" * 60)
+    print("Request start times: " + ", ".join(f"{t:.2f}s" for t in sorted(stamps)))
+    print(f"Total wait: {limiter.stats()['waited_seconds']:.2f}s")
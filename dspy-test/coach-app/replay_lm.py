@@ -0,0 +1,544 @@
+"""
+Record/Replay LM for Offline Benchmarks
+
+This module contains:
+- Recording: Request/response pairs with timings, stored as gzipped JSON lines
+- RecordingLM: dspy.BaseLM wrapper that captures every call of a live LM
+- LatencyModel: How long a replayed call takes (recorded, fixed, scaled,
+  empirical or lognormal)
+- ReplayLM: dspy.BaseLM that answers from a Recording without any network
+- lm_from_env: Picks live, record or replay mode from COACH_NOVA_LM_MODE
+
+Requests are identified with lm_cache.request_key (model, rendered messages
+and response-affecting kwargs), so a replay hits exactly when the same
+prompt is sent again. Every response is kept, in order: a request recorded
+several times (e.g. the same prompt in several sessions) replays its
+responses in the order they were recorded and then starts over. Streaming
+calls are recorded as one completion together with the time to first
+chunk, and ReplayLM.stream() emits them in chunks like StubLM.
+
+Set COACH_NOVA_LM_MODE=record to capture a session of main.py or
+optimize.py to COACH_NOVA_LM_RECORDING (default
+.cache/recordings/session.jsonl.gz; later sessions are appended), then
+COACH_NOVA_LM_MODE=replay to run it again without an API key, with
+COACH_NOVA_REPLAY_LATENCY choosing the simulated latency (e.g. "none",
+"fixed:0.3", "scale:2", "lognormal:0.8,0.4"). Running this file records
+the session engine load test and an optimization run against a StubLM,
+then replays them under several latency models and reports throughput,
+latency percentiles and whether every output matched the recording.
+"""
+
+import asyncio
+import atexit
+import gzip
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+from collections import Counter
+from types import SimpleNamespace
+
+import dspy
+
+from lm_cache import IGNORED_KWARGS, request_key
+from token_estimate import estimate_tokens
+from workout_stream import stream_completion
+
+
+RECORDING_FORMAT = "coach-nova-replay/1"
+DEFAULT_RECORDING_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), ".cache", "recordings", "session.jsonl.gz"
+)
+LM_MODES = ("live", "record", "replay")
+
+
+class ReplayMissError(LookupError):
+    """Raised when a replayed request was never recorded."""
+
+
+# ============================================================================
+# RECORDING
+# ============================================================================
+
+class Recording:
+    """
+    Recorded responses keyed by request_key, in recording order.
+
+    The file starts with a header line (model, model type and the request
+    kwargs of the recorded LM, without credentials) followed by one line per
+    response: key, outputs, latency, time to first chunk for streamed
+    calls, and token usage when the provider reported it. Deep copies share
+    the same recording.
+    """
+    def __init__(self, model="replay/unknown", model_type="chat", kwargs=None):
+        self.model = model
+        self.model_type = model_type
+        self.kwargs = {k: v for k, v in (kwargs or {}).items() if k not in IGNORED_KWARGS}
+        self.entries = {}
+        self._lock = threading.Lock()
+
+    def __deepcopy__(self, memo):
+        return self
+
+    @classmethod
+    def load(cls, path):
+        """
+        Read a recording written by save().
+
+        Args:
+            path: .jsonl.gz file
+
+        Returns:
+            Recording: The loaded recording
+        """
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            header = json.loads(f.readline())
+            if header.get("format") != RECORDING_FORMAT:
+                raise ValueError(f"{path} is not a {RECORDING_FORMAT} recording")
+            recording = cls(header["model"], header.get("model_type", "chat"), header.get("kwargs"))
+            for line in f:
+                record = json.loads(line)
+                recording.entries.setdefault(record.pop("key"), []).append(record)
+        return recording
+
+    def save(self, path):
+        """Write the recording atomically."""
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        header = {"format": RECORDING_FORMAT, "model": self.model, "model_type": self.model_type,
+                  "kwargs": self.kwargs}
+        tmp_path = f"{path}.tmp"
+        with self._lock, gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+            f.write(json.dumps(header, default=str) + "\n")
+            for key, records in self.entries.items():
+                for record in records:
+                    f.write(json.dumps({"key": key, **record}, default=str) + "\n")
+        os.replace(tmp_path, path)
+
+    def add(self, key, record):
+        """Append one response for key."""
+        with self._lock:
+            self.entries.setdefault(key, []).append(record)
+
+    def latencies(self):
+        """Every recorded latency, in seconds."""
+        with self._lock:
+            return [record["latency"] for records in self.entries.values() for record in records]
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(records) for records in self.entries.values())
+
+
+class RecordingLM(dspy.BaseLM):
+    """
+    Wrapper around any dspy LM that records each response and its latency.
+
+    Only plain-text outputs are recorded, as in CachedLM. Call save() (or let
+    lm_from_env register it at exit) to write the file.
+
+    Args:
+        lm: LM to record (e.g. CachedLM around RateLimitedLM)
+        path: Recording file; an existing recording of the same model is extended
+    """
+    def __init__(self, lm, path=DEFAULT_RECORDING_PATH):
+        super().__init__(model=lm.model, model_type=lm.model_type, cache=False)
+        self.kwargs = dict(lm.kwargs)
+        self.lm = lm
+        self.path = path
+        self.recording = Recording(lm.model, lm.model_type, lm.kwargs)
+        if path and os.path.exists(path):
+            existing = Recording.load(path)
+            if existing.model == lm.model:
+                self.recording.entries = existing.entries
+
+    def _usage(self, history_length):
+        history = getattr(self.lm, "history", None) or []
+        if len(history) > history_length:
+            usage = history[-1].get("usage")
+            return dict(usage) if usage else None
+        return None
+
+    def _record(self, prompt, messages, kwargs, outputs, latency, first_token=None, usage=None):
+        if not all(isinstance(output, str) for output in outputs):
+            return
+        record = {"outputs": outputs, "latency": round(latency, 4)}
+        if first_token is not None:
+            record["first_token"] = round(first_token, 4)
+        if usage:
+            record["usage"] = usage
+        self.recording.add(request_key(self.model, prompt, messages, kwargs), record)
+
+    def __call__(self, prompt=None, messages=None, **kwargs):
+        kwargs = {**self.kwargs, **kwargs}
+        history_length = len(getattr(self.lm, "history", None) or [])
+        start = time.perf_counter()
+        outputs = self.lm(prompt=prompt, messages=messages, **kwargs)
+        self._record(prompt, messages, kwargs, outputs, time.perf_counter() - start,
+                     usage=self._usage(history_length))
+        return outputs
+
+    async def acall(self, prompt=None, messages=None, **kwargs):
+        kwargs = {**self.kwargs, **kwargs}
+        history_length = len(getattr(self.lm, "history", None) or [])
+        start = time.perf_counter()
+        outputs = await self.lm.acall(prompt=prompt, messages=messages, **kwargs)
+        self._record(prompt, messages, kwargs, outputs, time.perf_counter() - start,
+                     usage=self._usage(history_length))
+        return outputs
+
+    def stream(self, prompt=None, messages=None, **kwargs):
+        """Stream from the wrapped LM (see workout_stream.stream_completion) and record the result."""
+        messages = messages or [{"role": "user", "content": prompt}]
+        start = time.perf_counter()
+        first_token = None
+        chunks = []
+        for chunk in stream_completion(self.lm, messages):
+            if first_token is None:
+                first_token = time.perf_counter() - start
+            chunks.append(chunk)
+            yield chunk
+        self._record(None, messages, {**self.kwargs, **kwargs}, ["".join(chunks)],
+                     time.perf_counter() - start, first_token=first_token)
+
+    def save(self):
+        """Write everything recorded so far to self.path."""
+        self.recording.save(self.path)
+
+
+# ============================================================================
+# REPLAY
+# ============================================================================
+
+class LatencyModel:
+    """
+    Latency of a replayed call.
+
+    Specs:
+        "recorded": the latency measured when the response was recorded
+        "none": no delay
+        "fixed:SECONDS": the same delay for every call
+        "scale:FACTOR": recorded latency times FACTOR
+        "empirical": a random latency drawn from the whole recording
+        "lognormal:MEDIAN,SIGMA": lognormal delay with the given median (seconds)
+    """
+    KINDS = {"recorded": 0, "none": 0, "fixed": 1, "scale": 1, "empirical": 0, "lognormal": 2}
+
+    def __init__(self, kind="recorded", *params):
+        if kind not in self.KINDS or len(params) != self.KINDS[kind]:
+            raise ValueError(f"Invalid latency model {kind!r} with parameters {params}")
+        self.kind = kind
+        self.params = [float(param) for param in params]
+
+    @classmethod
+    def parse(cls, spec):
+        """Build a LatencyModel from a spec string such as "lognormal:0.8,0.4"."""
+        kind, _, params = spec.strip().lower().partition(":")
+        return cls(kind, *[param for param in params.split(",") if param])
+
+    def sample(self, recorded, latencies, rng):
+        """
+        Draw the delay for one call.
+
+        Args:
+            recorded: Latency stored with the replayed response
+            latencies: All recorded latencies (for "empirical")
+            rng: random.Random used for the random models
+
+        Returns:
+            float: Seconds to wait
+        """
+        if self.kind == "recorded":
+            return recorded
+        if self.kind == "fixed":
+            return self.params[0]
+        if self.kind == "scale":
+            return recorded * self.params[0]
+        if self.kind == "empirical":
+            return rng.choice(latencies) if latencies else recorded
+        if self.kind == "lognormal":
+            median, sigma = self.params
+            return rng.lognormvariate(math.log(median), sigma)
+        return 0.0
+
+    def __repr__(self):
+        params = ",".join(f"{param:g}" for param in self.params)
+        return f"{self.kind}:{params}" if params else self.kind
+
+
+class ReplayLM(dspy.BaseLM):
+    """
+    Offline LM that serves responses from a Recording.
+
+    A request that was never recorded raises ReplayMissError, or goes to
+    fallback (e.g. a StubLM) when one is given. Recorded token usage is
+    reported to dspy's usage tracker; responses recorded without usage are
+    estimated like StubLM does.
+
+    Args:
+        recording: Recording or path of a recording file
+        latency: LatencyModel or spec string (default: recorded latencies)
+        fallback: LM used for requests missing from the recording
+        seed: Seed for the random latency models
+        chunk_size: Characters per chunk in stream()
+    """
+    def __init__(self, recording=DEFAULT_RECORDING_PATH, latency="recorded", fallback=None, seed=None,
+                 chunk_size=4):
+        if not isinstance(recording, Recording):
+            recording = Recording.load(recording)
+        super().__init__(model=recording.model, model_type=recording.model_type, cache=False)
+        self.kwargs = dict(recording.kwargs)
+        self.recording = recording
+        self.latency = latency if isinstance(latency, LatencyModel) else LatencyModel.parse(latency)
+        self.fallback = fallback
+        self.chunk_size = chunk_size
+        self.stats = {"hits": 0, "misses": 0}
+        self._latencies = recording.latencies()
+        self._positions = Counter()
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def __deepcopy__(self, memo):
+        # lm.copy() adds kwargs; the copy keeps replaying the same recording in order
+        copied = object.__new__(type(self))
+        copied.__dict__.update(self.__dict__)
+        copied.kwargs = dict(self.kwargs)
+        copied.history = []
+        return copied
+
+    def _lookup(self, prompt, messages, kwargs):
+        key = request_key(self.model, prompt, messages, {**self.kwargs, **kwargs})
+        with self._lock:
+            records = self.recording.entries.get(key)
+            if not records:
+                self.stats["misses"] += 1
+                return None, 0.0
+            self.stats["hits"] += 1
+            record = records[self._positions[key] % len(records)]
+            self._positions[key] += 1
+            return record, self.latency.sample(record["latency"], self._latencies, self._rng)
+
+    def _miss(self):
+        return ReplayMissError(
+            f"No recorded response for this request ({len(self.recording)} responses recorded for "
+            f"{self.model}); record it again with COACH_NOVA_LM_MODE=record"
+        )
+
+    def _response(self, messages, outputs, usage=None):
+        if usage is None:
+            prompt_tokens = sum(estimate_tokens(str(m.get("content", ""))) for m in messages or [])
+            completion_tokens = sum(estimate_tokens(output) for output in outputs)
+            usage = {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            }
+        # dspy.LM reports usage itself; custom BaseLM subclasses have to do it
+        if dspy.settings.usage_tracker:
+            dspy.settings.usage_tracker.add_usage(self.model, usage)
+        return SimpleNamespace(
+            choices=[
+                SimpleNamespace(message=SimpleNamespace(content=output, tool_calls=None)) for output in outputs
+            ],
+            usage=usage,
+            model=self.model,
+        )
+
+    def forward(self, prompt=None, messages=None, **kwargs):
+        record, delay = self._lookup(prompt, messages, kwargs)
+        if record is None:
+            if self.fallback is None:
+                raise self._miss()
+            return self._response(messages, self.fallback(prompt=prompt, messages=messages, **kwargs))
+        if delay:
+            time.sleep(delay)
+        return self._response(messages, record["outputs"], record.get("usage"))
+
+    async def aforward(self, prompt=None, messages=None, **kwargs):
+        record, delay = self._lookup(prompt, messages, kwargs)
+        if record is None:
+            if self.fallback is None:
+                raise self._miss()
+            outputs = await self.fallback.acall(prompt=prompt, messages=messages, **kwargs)
+            return self._response(messages, outputs)
+        if delay:
+            await asyncio.sleep(delay)
+        return self._response(messages, record["outputs"], record.get("usage"))
+
+    def stream(self, prompt=None, messages=None, **kwargs):
+        """
+        Yield a recorded completion in chunks.
+
+        The delay is split as it was recorded: time to the first chunk, then
+        the rest spread evenly over the remaining chunks.
+
+        Yields:
+            str: Successive pieces of the completion
+        """
+        messages = messages or [{"role": "user", "content": prompt}]
+        record, delay = self._lookup(None, messages, kwargs)
+        if record is None:
+            if self.fallback is None:
+                raise self._miss()
+            yield from stream_completion(self.fallback, messages)
+            return
+
+        content = record["outputs"][0]
+        chunks = [content[i:i + self.chunk_size] for i in range(0, len(content), self.chunk_size)]
+        recorded = record["latency"]
+        first_share = record.get("first_token", recorded) / recorded if recorded else 1.0
+        if delay:
+            time.sleep(delay * first_share)
+        chunk_delay = delay * (1 - first_share) / max(1, len(chunks))
+        for chunk in chunks:
+            if chunk_delay:
+                time.sleep(chunk_delay)
+            yield chunk
+        self._response(messages, [content], record.get("usage"))
+
+
+# ============================================================================
+# MODE SELECTION
+# ============================================================================
+
+def lm_mode_from_env():
+    """Return COACH_NOVA_LM_MODE (live, record or replay; default live)."""
+    mode = os.getenv("COACH_NOVA_LM_MODE", "live").lower()
+    if mode not in LM_MODES:
+        raise ValueError(f"COACH_NOVA_LM_MODE must be one of {LM_MODES}, got {mode!r}")
+    return mode
+
+
+def recording_path(name=None):
+    """
+    COACH_NOVA_LM_RECORDING, with ".<name>" inserted before the extension if name is given.
+
+    Args:
+        name: Optional name (e.g. a model) for one of several LMs of a session
+
+    Returns:
+        str: Recording path
+    """
+    path = os.getenv("COACH_NOVA_LM_RECORDING", DEFAULT_RECORDING_PATH)
+    if not name:
+        return path
+    root, extension = path[:-len(".jsonl.gz")], ".jsonl.gz"
+    if not path.endswith(extension):
+        root, extension = os.path.splitext(path)
+    return f"{root}.{re.sub(r'[^A-Za-z0-9_.-]+', '_', name)}{extension}"
+
+
+def lm_from_env(build_live, name=None):
+    """
+    Build the LM for the mode selected by COACH_NOVA_LM_MODE.
+
+    Args:
+        build_live: Zero-argument callable returning the live LM; not called
+            in replay mode, so no API key is needed there
+        name: Optional recording name, so that several LMs of one session
+            (e.g. routed models) are recorded and replayed separately
+
+    Returns:
+        dspy.BaseLM: The live LM, a RecordingLM around it, or a ReplayLM
+    """
+    path = recording_path(name)
+    mode = lm_mode_from_env()
+    if mode == "replay":
+        return ReplayLM(path, latency=os.getenv("COACH_NOVA_REPLAY_LATENCY", "recorded"))
+    lm = build_live()
+    if mode == "record":
+        lm = RecordingLM(lm, path)
+        atexit.register(lm.save)
+    return lm
+
+
+def print_replay_stats(lm):
+    """Print record/replay counters if lm is a RecordingLM or ReplayLM."""
+    if isinstance(lm, RecordingLM):
+        print(f"[LM replay] {len(lm.recording)} responses recorded to {lm.path}")
+    elif isinstance(lm, ReplayLM):
+        print(f"[LM replay] {lm.stats['hits']} replayed / {lm.stats['misses']} not recorded "
+              f"(latency: {lm.latency})")
+
+
+if __name__ == "__main__":
+    import logging
+    import tempfile
+
+    from metrics import extraction_accuracy
+    from modules import InfoExtractor
+    from optimization_runner import CheckpointedMIPROv2, program_fingerprint
+    from sessions import SessionEngine, run_load_test
+    from stub_lm import StubLM
+    from training_data import get_extractor_trainset
+
+    logging.getLogger("dspy").setLevel(logging.CRITICAL)
+    import optuna
+    optuna.logging.disable_default_handler()
+
+    def should_extract(messages):
+        return "true" if "'coach'" in messages[-1]["content"] else "false"
+
+    script = [
+        "I want to build muscle with dumbbells",
+        "45 minutes, full body, intermediate, at the gym",
+    ]
+    num_sessions = 100
+
+    def load_test(lm):
+        with dspy.context(lm=lm):
+            engine = SessionEngine()
+            return asyncio.run(run_load_test(engine, num_sessions, script))
+
+    def optimize(lm):
+        with dspy.context(lm=lm):
+            optimizer = CheckpointedMIPROv2(extraction_accuracy, auto="light", max_bootstrapped_demos=2,
+                                            max_labeled_demos=2, num_threads=4, verbose=False)
+            start = time.perf_counter()
+            program = optimizer.compile(InfoExtractor(), trainset=get_extractor_trainset())
+            return program_fingerprint(program), time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "session.jsonl.gz")
+
+        # Record against a StubLM standing in for Gemini: 200ms +/- 150ms per call
+        stub = StubLM(responses={"should_extract": should_extract}, latency=0.2, jitter=0.15, seed=0)
+        recorder = RecordingLM(stub, path)
+        recorded_stats = load_test(recorder)
+        best_recorded, recorded_seconds = optimize(recorder)
+        recorder.save()
+
+        recording = Recording.load(path)
+        print("=" * 60)
+        print("RECORD/REPLAY LM (recorded from StubLM, 200ms +/- 150ms per call)")
+        print("=" * 60)
+        print(f"Recorded {len(recording)} responses ({len(recording.entries)} distinct requests), "
+              f"{os.path.getsize(path) / 1024:.1f} KiB on disk\n")
+
+        print(f"Session load test, {num_sessions} sessions x {len(script)} turns")
+        print(f"{'Latency model':<22} | {'Sessions/sec':>12} | {'p50':>8} | {'p99':>8} | Misses")
+        print(f"{'live (recording run)':<22} | {recorded_stats['sessions_per_sec']:>12.1f} | "
+              f"{recorded_stats['p50_turn_latency'] * 1000:6.0f}ms | "
+              f"{recorded_stats['p99_turn_latency'] * 1000:6.0f}ms | -")
+        for spec in ("recorded", "none", "empirical", "scale:2", "lognormal:0.2,0.5"):
+            replay = ReplayLM(path, latency=spec, seed=0)
+            stats = load_test(replay)
+            print(f"{spec:<22} | {stats['sessions_per_sec']:>12.1f} | {stats['p50_turn_latency'] * 1000:6.0f}ms | "
+                  f"{stats['p99_turn_latency'] * 1000:6.0f}ms | {replay.stats['misses']}")
+
+        print("\nMIPROv2 on InfoExtractor")
+        for spec in ("recorded", "none"):
+            replay = ReplayLM(path, latency=spec, seed=0)
+            best, seconds = optimize(replay)
+            assert replay.stats["misses"] == 0, replay.stats
+            print(f"{spec:<22} | {seconds:6.1f}s (recording run {recorded_seconds:.1f}s) | "
+                  f"same best program: {best == best_recorded}")
+
+        # A request that was never recorded
+        try:
+            with dspy.context(lm=ReplayLM(path, latency="none")):
+                InfoExtractor()(conversation_history="[{'user': 'something new'}]")
+        except ReplayMissError as e:
+            print(f"\nUnrecorded request: ReplayMissError: {e}")
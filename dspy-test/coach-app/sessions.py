@@ -0,0 +1,299 @@
+"""
+Async Session Engine for Coach Nova
+
+This module hosts many coaching conversations in a single process:
+- Session: Per-user conversation state
+- TurnResult: Outcome of one user turn
+- SessionEngine: Runs the CoachAgent -> InfoExtractor -> WorkoutGenerator
+  turn semantics from main.py with non-blocking LM calls
+
+Each session processes its own turns in order, while turns from different
+sessions interleave freely on the event loop. Running this file performs a
+load test against the local StubLM and reports sessions/sec and turn latency
+percentiles.
+"""
+
+import asyncio
+import itertools
+import time
+from dataclasses import dataclass, field
+from typing import Optional
+
+from extraction_state import ExtractionState
+from history_compaction import render_history
+from modules import CoachAgent, IncrementalExtractor, InfoExtractor, WorkoutGenerator, Workout
+
+
+# Fields that must be extracted before a workout can be generated
+REQUIRED_FIELDS = ("goal", "equipment", "duration", "focus")
+
+# Fallbacks used for optional fields when the extractor returns "null"
+OPTIONAL_FIELD_DEFAULTS = {
+    "fitness_level": "intermediate",
+    "space": "gym",
+    "injuries": "none",
+    "primary_lift_pr": "none",
+}
+
+
+# ============================================================================
+# TURN HELPERS
+# ============================================================================
+
+def is_missing(value):
+    """Return True if an extracted field value is empty or "null"."""
+    return not value or value == "null"
+
+
+def find_missing_fields(extracted):
+    """
+    List the required fields the extractor could not fill.
+
+    Args:
+        extracted: Prediction from InfoExtractor
+
+    Returns:
+        list: Names of missing required fields
+    """
+    return [name for name in REQUIRED_FIELDS if is_missing(getattr(extracted, name, None))]
+
+
+def build_generator_inputs(extracted):
+    """
+    Map an extraction result to WorkoutGenerator keyword arguments.
+
+    Args:
+        extracted: Prediction from InfoExtractor
+
+    Returns:
+        dict: Inputs for WorkoutGenerator with defaults for optional fields
+    """
+    inputs = {name: getattr(extracted, name) for name in REQUIRED_FIELDS}
+    for name, default in OPTIONAL_FIELD_DEFAULTS.items():
+        value = getattr(extracted, name, None)
+        inputs[name] = default if is_missing(value) else value
+    return inputs
+
+
+def percentile(values, pct):
+    """
+    Nearest-rank percentile of a list of numbers.
+
+    Args:
+        values: Numbers to summarize
+        pct: Percentile between 0 and 100
+
+    Returns:
+        float: The percentile value (0.0 for an empty list)
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[rank]
+
+
+# ============================================================================
+# SESSION STATE
+# ============================================================================
+
+@dataclass
+class Session:
+    """Conversation state for a single user"""
+    session_id: str
+    history: list = field(default_factory=list)
+    extraction: ExtractionState = field(default_factory=ExtractionState)
+    workout: Optional[Workout] = None
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock, repr=False)
+
+
+@dataclass
+class TurnResult:
+    """Outcome of one user turn"""
+    response: str
+    should_extract: bool
+    missing_fields: list = field(default_factory=list)
+    extracted: Optional[object] = None
+    workout: Optional[Workout] = None
+    latency: float = 0.0
+
+
+# ============================================================================
+# SESSION ENGINE
+# ============================================================================
+
+class SessionEngine:
+    """
+    Hosts concurrent coaching sessions on one asyncio event loop.
+
+    Modules are shared between sessions; only the conversation history and
+    extraction state are per-session. With incremental_extraction the
+    extractor only sees messages added since its previous call (see
+    extraction_state.py); otherwise InfoExtractor re-reads the full history.
+    An optional semaphore caps the number of LM calls in flight so a burst of
+    sessions cannot exceed provider concurrency limits. Full-history
+    extraction can instead go through an ExtractionBatcher (see
+    extraction_batcher.py), which merges requests from sessions that reach
+    should_extract at about the same time. A HistoryCompactor keeps the
+    coach's conversation_history within a token budget (see
+    history_compaction.py).
+    """
+    def __init__(self, coach=None, extractor=None, generator=None, max_concurrent_calls=None,
+                 incremental_extraction=True, extraction_batcher=None, history_compactor=None):
+        if extraction_batcher is not None and incremental_extraction:
+            raise ValueError("extraction_batcher requires incremental_extraction=False")
+        self.incremental_extraction = incremental_extraction
+        self.extraction_batcher = extraction_batcher
+        self.history_compactor = history_compactor
+        self.coach = coach or CoachAgent()
+        self.extractor = extractor or (IncrementalExtractor() if incremental_extraction else InfoExtractor())
+        self.generator = generator or WorkoutGenerator()
+        self.sessions = {}
+        self._ids = itertools.count(1)
+        self._call_slots = asyncio.Semaphore(max_concurrent_calls) if max_concurrent_calls else None
+
+    def open_session(self, session_id=None):
+        """Create a new session and return its id."""
+        session_id = session_id or f"session-{next(self._ids)}"
+        if session_id in self.sessions:
+            raise ValueError(f"Session already exists: {session_id}")
+        self.sessions[session_id] = Session(session_id=session_id)
+        return session_id
+
+    def reset_session(self, session_id):
+        """Clear history so the session can start a new workout."""
+        session = self.sessions[session_id]
+        session.history = []
+        session.extraction = ExtractionState()
+        session.workout = None
+
+    def close_session(self, session_id):
+        """Drop a session and its state."""
+        self.sessions.pop(session_id, None)
+
+    async def _call(self, module, **kwargs):
+        if self._call_slots is None:
+            return await module.acall(**kwargs)
+        async with self._call_slots:
+            return await module.acall(**kwargs)
+
+    async def _extract(self, session):
+        if self.extraction_batcher is not None:
+            # The batcher applies its own in-flight cap
+            return await self.extraction_batcher.extract(str(session.history))
+        if not self.incremental_extraction:
+            return await self._call(self.extractor, conversation_history=str(session.history))
+        if self._call_slots is None:
+            return await session.extraction.aextract(self.extractor)
+        async with self._call_slots:
+            return await session.extraction.aextract(self.extractor)
+
+    async def turn(self, session_id, user_message):
+        """
+        Process one user message: coach reply, then extraction and workout
+        generation once the coach signals should_extract.
+
+        Args:
+            session_id: Id returned by open_session
+            user_message: Text typed by the user
+
+        Returns:
+            TurnResult: Coach response plus extraction/generation outcome
+        """
+        session = self.sessions[session_id]
+        async with session.lock:
+            start = time.perf_counter()
+
+            result = await self._call(
+                self.coach,
+                conversation_history=render_history(
+                    session.history, self.history_compactor, session.extraction.fields
+                ),
+                user_message=user_message
+            )
+            session.history.append({"user": user_message, "coach": result.response})
+            session.extraction.add_exchange(user_message, result.response)
+
+            turn = TurnResult(
+                response=result.response,
+                should_extract=result.should_extract.lower() == "true"
+            )
+
+            if turn.should_extract:
+                extracted = await self._extract(session)
+                turn.extracted = extracted
+                turn.missing_fields = find_missing_fields(extracted)
+
+                if not turn.missing_fields:
+                    generated = await self._call(self.generator, **build_generator_inputs(extracted))
+                    session.workout = generated.workout
+                    turn.workout = generated.workout
+
+            turn.latency = time.perf_counter() - start
+            return turn
+
+
+# ============================================================================
+# LOAD TEST
+# ============================================================================
+
+async def run_load_test(engine, num_sessions, script):
+    """
+    Drive many sessions concurrently through the same scripted conversation.
+
+    Args:
+        engine: SessionEngine to exercise
+        num_sessions: Number of concurrent sessions
+        script: List of user messages sent in order by every session
+
+    Returns:
+        dict: sessions_per_sec, turns, p50/p99 turn latency (seconds), wall time
+    """
+    latencies = []
+
+    async def run_session():
+        session_id = engine.open_session()
+        for message in script:
+            result = await engine.turn(session_id, message)
+            latencies.append(result.latency)
+        engine.close_session(session_id)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(run_session() for _ in range(num_sessions)))
+    wall = time.perf_counter() - start
+
+    return {
+        "sessions": num_sessions,
+        "turns": len(latencies),
+        "wall_seconds": wall,
+        "sessions_per_sec": num_sessions / wall if wall else 0.0,
+        "p50_turn_latency": percentile(latencies, 50),
+        "p99_turn_latency": percentile(latencies, 99),
+    }
+
+
+if __name__ == "__main__":
+    import dspy
+    from stub_lm import StubLM
+
+    def should_extract(messages):
+        # Extract once the user has answered at least one follow-up question
+        return "true" if "'coach'" in messages[-1]["content"] else "false"
+
+    dspy.configure(lm=StubLM(responses={"should_extract": should_extract}, latency=0.05, jitter=0.02, seed=0))
+    script = [
+        "I want to build muscle with dumbbells",
+        "45 minutes, full body, intermediate, at the gym",
+    ]
+
+    print("=" * 60)
+    print("SESSION ENGINE LOAD TEST (StubLM, 50ms +/- 20ms per call)")
+    print("=" * 60)
+    for num_sessions in (1, 100, 1000):
+        stats = asyncio.run(run_load_test(SessionEngine(), num_sessions, script))
+        print(
+            f"{stats['sessions']:>5} sessions | {stats['turns']:>5} turns | "
+            f"{stats['sessions_per_sec']:>8.1f} sessions/sec | "
+            f"p50 {stats['p50_turn_latency'] * 1000:6.1f}ms | "
+            f"p99 {stats['p99_turn_latency'] * 1000:6.1f}ms"
+        )
@@ -0,0 +1,234 @@
+"""
+Local Stub LM for Offline Testing and Benchmarks
+
+This module contains a drop-in replacement for dspy.LM that never touches the
+network. It reads the output fields requested by DSPy's ChatAdapter from the
+prompt and answers them with canned values, after an optional simulated
+latency. It lets the coach pipeline be exercised and measured without a
+GOOGLE_GENERATIVE_AI_API_KEY.
+
+With token_delay set, StubLM.stream() emits the completion a few characters
+at a time like a streaming provider, and blocking calls take as long as
+streaming the whole completion would.
+"""
+
+import asyncio
+import json
+import random
+import re
+import time
+from types import SimpleNamespace
+
+import dspy
+
+from token_estimate import estimate_tokens
+
+
+# Matches the output field list in ChatAdapter's "Respond with the corresponding
+# output fields, starting with the field `[[ ## a ## ]]`, then ..." reminder
+OUTPUT_REQUEST_PATTERN = re.compile(r"Respond with the corresponding output fields.*", re.DOTALL)
+FIELD_MARKER_PATTERN = re.compile(r"\[\[ ## (\w+) ## \]\]")
+
+
+# ============================================================================
+# DEFAULT RESPONSES
+# ============================================================================
+
+DEFAULT_WORKOUT = {
+    "workoutFocus": "Full Body Hypertrophy",
+    "exercises": [
+        {
+            "name": "Dumbbell Goblet Squat",
+            "sets": [
+                {"setType": "warmup", "reps": 12, "weight": 25.0},
+                {"setType": "working", "reps": 10, "weight": 50.0},
+                {"setType": "working", "reps": 10, "weight": 50.0},
+            ],
+        },
+        {
+            "name": "Dumbbell Bench Press",
+            "sets": [
+                {"setType": "working", "reps": 10, "weight": 45.0},
+                {"setType": "working", "reps": 10, "weight": 45.0},
+            ],
+        },
+        {
+            "name": "Dumbbell Row",
+            "sets": [
+                {"setType": "working", "reps": 12, "weight": 40.0},
+                {"setType": "working", "reps": 12, "weight": 40.0},
+            ],
+        },
+    ],
+    "notes": "Rest 60-90 seconds between sets.",
+}
+
+DEFAULT_RESPONSES = {
+    # Shared ChainOfThought field
+    "reasoning": "The user has provided their goal, equipment, duration and focus.",
+    # ChatAgent
+    "response": "Great, I have everything I need. Let me build your workout!",
+    "should_extract": "true",
+    # ExtractUserInfo
+    "fitness_level": "intermediate",
+    "goal": "hypertrophy",
+    "focus": "full_body",
+    "equipment": "dumbbells",
+    "duration": "45",
+    "space": "gym",
+    "injuries": "none",
+    "primary_lift_pr": "null",
+    # GenerateWorkout
+    "workout": json.dumps(DEFAULT_WORKOUT),
+}
+
+
+def requested_output_fields(messages):
+    """
+    Find the output fields DSPy asked for in the final user message.
+
+    Args:
+        messages: OpenAI-style message list built by the ChatAdapter
+
+    Returns:
+        list: Output field names in the order they were requested
+    """
+    content = messages[-1]["content"] if messages else ""
+    match = OUTPUT_REQUEST_PATTERN.search(content)
+    if not match:
+        return []
+    return [name for name in FIELD_MARKER_PATTERN.findall(match.group(0)) if name != "completed"]
+
+
+# ============================================================================
+# STUB LM
+# ============================================================================
+
+class StubLM(dspy.BaseLM):
+    """
+    Offline LM that answers ChatAdapter prompts with canned field values.
+
+    Responses can be plain strings or callables receiving the message list,
+    which allows tests to vary answers per prompt. Latency is simulated with
+    time.sleep for sync calls and asyncio.sleep for async calls so that
+    concurrency benefits are visible in benchmarks. latency is the time to
+    the first token; token_delay is added per streamed chunk of chunk_size
+    characters and prefill_delay per prompt token, so longer prompts take
+    longer to answer.
+    """
+    def __init__(self, responses=None, latency=0.0, jitter=0.0, seed=None, model="stub/coach-nova",
+                 token_delay=0.0, chunk_size=4, prefill_delay=0.0):
+        super().__init__(model=model, cache=False)
+        self.responses = {**DEFAULT_RESPONSES, **(responses or {})}
+        self.latency = latency
+        self.jitter = jitter
+        self.token_delay = token_delay
+        self.chunk_size = chunk_size
+        self.prefill_delay = prefill_delay
+        self.calls = 0
+        self._rng = random.Random(seed)
+
+    def _delay(self, messages):
+        prefill = 0.0
+        if self.prefill_delay:
+            prefill = self.prefill_delay * sum(estimate_tokens(m["content"]) for m in messages)
+        if not self.latency and not self.jitter:
+            return prefill
+        return max(0.0, self.latency + self._rng.uniform(-self.jitter, self.jitter)) + prefill
+
+    def _completion(self, messages):
+        fields = requested_output_fields(messages)
+        sections = []
+        for name in fields:
+            value = self.responses.get(name, "null")
+            if callable(value):
+                value = value(messages)
+            sections.append(f"[[ ## {name} ## ]]\n{value}")
+        sections.append("[[ ## completed ## ]]")
+        return "\n\n".join(sections)
+
+    def _chunks(self, content):
+        return [content[i:i + self.chunk_size] for i in range(0, len(content), self.chunk_size)]
+
+    def _generation_time(self, content):
+        return self.token_delay * len(self._chunks(content)) if self.token_delay else 0.0
+
+    def _record_usage(self, messages, content):
+        prompt_tokens = sum(estimate_tokens(m["content"]) for m in messages)
+        completion_tokens = estimate_tokens(content)
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+        # dspy.LM reports usage itself; custom BaseLM subclasses have to do it
+        if dspy.settings.usage_tracker:
+            dspy.settings.usage_tracker.add_usage(self.model, usage)
+        return usage
+
+    def _response(self, messages, content):
+        self.calls += 1
+        usage = self._record_usage(messages, content)
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=content, tool_calls=None))],
+            usage=usage,
+            model=self.model,
+        )
+
+    def forward(self, prompt=None, messages=None, **kwargs):
+        messages = messages or [{"role": "user", "content": prompt}]
+        content = self._completion(messages)
+        delay = self._delay(messages) + self._generation_time(content)
+        if delay:
+            time.sleep(delay)
+        return self._response(messages, content)
+
+    async def aforward(self, prompt=None, messages=None, **kwargs):
+        messages = messages or [{"role": "user", "content": prompt}]
+        content = self._completion(messages)
+        delay = self._delay(messages) + self._generation_time(content)
+        if delay:
+            await asyncio.sleep(delay)
+        return self._response(messages, content)
+
+    def stream(self, prompt=None, messages=None, **kwargs):
+        """
+        Yield the completion text in chunks, sleeping token_delay before each.
+
+        Args:
+            prompt: Plain prompt, used when messages is not given
+            messages: OpenAI-style message list built by the ChatAdapter
+
+        Yields:
+            str: Successive pieces of the completion
+        """
+        messages = messages or [{"role": "user", "content": prompt}]
+        content = self._completion(messages)
+        self.calls += 1
+        delay = self._delay(messages)
+        if delay:
+            time.sleep(delay)
+        for chunk in self._chunks(content):
+            if self.token_delay:
+                time.sleep(self.token_delay)
+            yield chunk
+        self._record_usage(messages, content)
+
+
+if __name__ == "__main__":
+    from modules import CoachAgent, InfoExtractor, WorkoutGenerator
+
+    dspy.configure(lm=StubLM())
+
+    result = CoachAgent()(conversation_history="[]", user_message="Dumbbells, 45 minutes, full body")
+    print(f"Coach: {result.response} (should_extract={result.should_extract})")
+
+    extracted = InfoExtractor()(conversation_history="[]")
+    print(f"Extracted goal={extracted.goal}, equipment={extracted.equipment}")
+
+    workout = WorkoutGenerator()(
+        fitness_level="intermediate", goal="hypertrophy", focus="full_body",
+        equipment="dumbbells", duration="45", space="gym", injuries="none",
+        primary_lift_pr="none"
+    )
+    print(f"Workout: {len(workout.workout.exercises)} exercises")
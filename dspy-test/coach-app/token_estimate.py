@@ -0,0 +1,23 @@
+"""
+Offline Token Estimates
+
+This module contains:
+- estimate_tokens: Rough token count of a string (~4 characters per token)
+
+Rate limiting, telemetry, replay, routing and history compaction all need a
+token count before (or without) a provider response, and StubLM reports its
+usage with the same rule, so offline runs and live runs are measured alike.
+"""
+
+
+def estimate_tokens(text):
+    """
+    Rough token count used for offline reporting (~4 characters per token).
+
+    Args:
+        text: String to measure
+
+    Returns:
+        int: Estimated number of tokens
+    """
+    return max(1, len(text) // 4) if text else 0
@@ -2,7 +2,8 @@
 Training Data for DSPy Optimization
 
 This module contains synthetic training examples for:
-- InfoExtractor: Extracting structured info from conversations
+- InfoExtractor: Extracting structured info from conversations (also given
+  to IncrementalExtractor as first-request examples)
 - WorkoutGenerator: Generating appropriate workout plans
 """
 
@@ -410,6 +411,23 @@ def get_extractor_trainset():
     return extractor_examples
 
 
+def get_incremental_extractor_trainset():
+    """
+    Returns the training set for IncrementalExtractor optimization.
+
+    Same conversations and labels as the InfoExtractor set, given as the first
+    ExtractionState request: nothing known yet, the whole conversation new.
+    """
+    return [
+        dspy.Example(
+            known_info="{}",
+            new_messages=example.conversation_history,
+            **example.labels().toDict()
+        ).with_inputs("known_info", "new_messages")
+        for example in extractor_examples
+    ]
+
+
 def get_generator_trainset():
     """Returns the training set for WorkoutGenerator optimization"""
     return generator_examples
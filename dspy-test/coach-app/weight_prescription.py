@@ -0,0 +1,361 @@
+"""
+Local Weight Prescription from primary_lift_pr
+
+This module contains:
+- parse_lift_pr: Lift, load and reps from a PR like "205lb bench" or "bench 225x5"
+- percent_1rm: %1RM for a rep target, from the rep table and goal-specific reserve
+- estimate_1rm: One-rep max from a load lifted for reps
+- bench_1rm_for: Bench press 1RM from primary_lift_pr, or the fitness-level reference
+- exercise_1rm: Estimated 1RM of an exercise given a bench press 1RM
+- prescribe_weights: Fills in the weights of a WorkoutPlan to give a Workout
+- PrescribedWorkoutGenerator: WorkoutGenerator front end whose LM call only
+  chooses exercises, set types and reps
+
+GenerateWorkout passes primary_lift_pr to the LM as free text, and the LM
+invents every WorkoutSet.weight. Here the generator's own predictor is
+called with the workout field typed as WorkoutPlan, which has no weights.
+Its demos get the same treatment, so the optimized instructions and demos
+still apply. The weights are then computed locally. The PR becomes a 1RM
+through the %1RM rep table, and then a bench press equivalent through
+workout_templates.PR_LIFT_RATIOS; without a PR the fitness-level reference
+is used. Each exercise's 1RM follows from LOAD_RATIOS and the implement
+(catalog entry or equipment words in the name). Working sets get the %1RM
+of their reps plus the goal's reps in reserve, and warm-up sets ramp up to
+the first working weight. Running this file compares output tokens, latency
+and workout_quality of WorkoutGenerator with and without it.
+"""
+
+import json
+import re
+from dataclasses import dataclass
+
+import dspy
+from pydantic import BaseModel
+
+from exercise_catalog import CATALOG, CatalogExercise, mentioned_equipment
+from extraction_state import normalize_value
+from modules import Exercise, Workout, WorkoutGenerator, WorkoutPlan, WorkoutSet
+from workout_templates import (
+    EQUIPMENT_LOAD, KG_TO_LB, PR_LIFT_RATIOS, REFERENCE_BENCH_1RM, load_ratio, normalize_enum,
+)
+
+
+# %1RM that can be lifted for a number of reps to failure (common strength-coaching table)
+PERCENT_1RM_BY_REPS = {
+    1: 1.0, 2: 0.95, 3: 0.93, 4: 0.9, 5: 0.87, 6: 0.85, 7: 0.83, 8: 0.8,
+    9: 0.77, 10: 0.75, 12: 0.7, 15: 0.65, 20: 0.6, 25: 0.55, 30: 0.5,
+}
+
+# Reps left in reserve on working sets: strength work goes closest to failure,
+# power and endurance work stay well short of it
+GOAL_RESERVE_REPS = {"strength": 1, "power": 4, "hypertrophy": 2, "endurance": 4, "general": 3}
+LEVEL_RESERVE_REPS = {"beginner": 1, "intermediate": 0, "advanced": 0}
+
+# Warm-up sets as fractions of the first working weight, lightest first
+WARMUP_RAMP = (0.5, 0.7, 0.85)
+
+# PRs are only used within this rep range; higher-rep sets say little about a 1RM
+MAX_PR_REPS = 12
+
+LIFT_PATTERN = "|".join(sorted(map(re.escape, PR_LIFT_RATIOS), key=len, reverse=True))
+PR_PATTERNS = (
+    # "205lb bench", "225x5 squat", "140 kg for 3 on the deadlift", "315lbs squat for 2 reps"
+    re.compile(
+        r"(?P<load>\d{2,3}(?:\.\d+)?)\s*(?P<unit>kg|lbs?|pounds)?"
+        r"(?:\s*(?:x|for)\s*(?P<reps>\d{1,2})(?:\s*reps?)?)?"
+        rf"\s*(?:on\s+|for\s+)?(?:the\s+|my\s+)?(?P<lift>{LIFT_PATTERN})"
+        r"(?:\w*\s*(?:x|for)\s*(?P<reps_after>\d{1,2})(?:\s*reps?)?)?"
+    ),
+    # "bench 225x5", "squat: 140kg for 3", "deadlift pr of 405"
+    re.compile(
+        rf"(?P<lift>{LIFT_PATTERN})\w*\s*(?:pr\s*)?(?:of\s+|is\s+|at\s+|:\s*)?"
+        r"(?P<load>\d{2,3}(?:\.\d+)?)\s*(?P<unit>kg|lbs?|pounds)?"
+        r"(?:\s*(?:x|for)\s*(?P<reps>\d{1,2})(?:\s*reps?)?)?"
+    ),
+)
+
+PLAN_DESC = ("Exercises with set types and reps only; weights are computed from primary_lift_pr "
+             "after generation, so do not include them")
+
+
+@dataclass(frozen=True)
+class LiftPR:
+    """A primary_lift_pr as read from free text"""
+    lift: str  # Key of PR_LIFT_RATIOS
+    pounds: float
+    reps: int
+
+
+# ============================================================================
+# 1RM ESTIMATION
+# ============================================================================
+
+def parse_lift_pr(primary_lift_pr):
+    """
+    Read a PR such as "205lb bench", "bench 225x5" or "140kg deadlift for 3".
+
+    Args:
+        primary_lift_pr: Extracted primary_lift_pr value
+
+    Returns:
+        LiftPR or None: None when no PR is stated or it cannot be read
+    """
+    text = normalize_value(primary_lift_pr)
+    for pattern in PR_PATTERNS:
+        match = pattern.search(text)
+        if match:
+            groups = match.groupdict()
+            reps = int(groups.get("reps") or groups.get("reps_after") or 1)
+            pounds = float(groups["load"]) * (KG_TO_LB if groups["unit"] == "kg" else 1.0)
+            return LiftPR(groups["lift"], pounds, max(1, reps))
+    return None
+
+
+def percent_1rm(reps, goal=None, fitness_level=None):
+    """
+    Working-set load for a rep target, as a fraction of 1RM.
+
+    Without a goal this is the load that can be lifted for exactly reps;
+    with one, the goal's (and fitness level's) reps in reserve are added.
+    Rep counts between table entries are interpolated linearly.
+
+    Args:
+        reps: Rep target of the set
+        goal: Normalized goal (strength, hypertrophy, ...) or None
+        fitness_level: Normalized fitness level or None
+
+    Returns:
+        float: Fraction of 1RM
+    """
+    reps = max(1, reps) + GOAL_RESERVE_REPS.get(goal, 0) + LEVEL_RESERVE_REPS.get(fitness_level, 0)
+    table = sorted(PERCENT_1RM_BY_REPS.items())
+    if reps >= table[-1][0]:
+        return table[-1][1]
+    for (low_reps, low), (high_reps, high) in zip(table, table[1:]):
+        if low_reps <= reps <= high_reps:
+            return low + (high - low) * (reps - low_reps) / (high_reps - low_reps)
+    return table[0][1]
+
+
+def estimate_1rm(pounds, reps):
+    """1RM from a load lifted for reps (reps above MAX_PR_REPS are treated as MAX_PR_REPS)."""
+    return pounds / percent_1rm(min(reps, MAX_PR_REPS))
+
+
+def bench_1rm_for(primary_lift_pr, fitness_level=None):
+    """
+    Bench press 1RM in lbs that weights are prescribed from.
+
+    Args:
+        primary_lift_pr: Extracted primary_lift_pr value
+        fitness_level: Used for the reference 1RM when there is no usable PR
+
+    Returns:
+        tuple: (bench 1RM, True if it was estimated from the PR)
+    """
+    pr = parse_lift_pr(primary_lift_pr)
+    if pr is not None:
+        estimate = estimate_1rm(pr.pounds, pr.reps) / PR_LIFT_RATIOS[pr.lift]
+        # Implausible values are more likely extraction slips than PRs
+        if 45 <= estimate <= 500:
+            return estimate, True
+    level = normalize_enum("fitness_level", fitness_level) or "intermediate"
+    return REFERENCE_BENCH_1RM[level], False
+
+
+def exercise_1rm(name, bench_1rm, equipment=None):
+    """
+    Estimated 1RM of an exercise, or None if it is not loaded.
+
+    Catalog exercises use their catalog equipment; other names use the
+    equipment words they contain (e.g. "Dumbbell ..."), and names without
+    any (e.g. "Bench Press") the user's equipment.
+
+    Args:
+        name: Exercise name as written by the LM
+        bench_1rm: Bench press 1RM in lbs
+        equipment: User's normalized equipment value, or None
+
+    Returns:
+        float or None: 1RM in lbs (per hand for dumbbells)
+    """
+    entry = CATALOG.lookup(name)
+    if entry is None:
+        implements = [item for item in EQUIPMENT_LOAD if item in (mentioned_equipment(name) or {equipment})]
+        if not implements:
+            return None
+        entry = CatalogExercise(name=name, equipment=(implements[0],), focus=(), space=())
+    ratio = load_ratio(entry)
+    return bench_1rm * ratio if ratio is not None else None
+
+
+def _round_load(weight):
+    return max(5.0, 5.0 * round(weight / 5.0))
+
+
+def prescribe_weights(plan, requirements):
+    """
+    Workout with weights for every set of a WorkoutPlan.
+
+    Args:
+        plan: WorkoutPlan (or Workout, whose weights are replaced)
+        requirements: GenerateWorkout inputs (goal, fitness_level, equipment, primary_lift_pr)
+
+    Returns:
+        Workout: Same exercises, sets and notes, with weights in lbs
+    """
+    goal = normalize_enum("goal", requirements.get("goal"))
+    level = normalize_enum("fitness_level", requirements.get("fitness_level"))
+    equipment = normalize_enum("equipment", requirements.get("equipment"))
+    bench_1rm, _ = bench_1rm_for(requirements.get("primary_lift_pr"), level)
+
+    exercises = []
+    for planned in plan.exercises:
+        one_rep_max = exercise_1rm(planned.name, bench_1rm, equipment)
+        working_reps = next((s.reps for s in planned.sets if s.setType == "working"), None)
+        top = one_rep_max * percent_1rm(working_reps, goal, level) if one_rep_max and working_reps else one_rep_max
+        warmups = sum(1 for s in planned.sets if s.setType == "warmup")
+        ramp = WARMUP_RAMP[:warmups] if warmups <= len(WARMUP_RAMP) else (
+            *(WARMUP_RAMP[0],) * (warmups - len(WARMUP_RAMP)), *WARMUP_RAMP)
+
+        sets, warmup_index = [], 0
+        for planned_set in planned.sets:
+            if one_rep_max is None:
+                weight = None
+            elif planned_set.setType == "working":
+                weight = _round_load(one_rep_max * percent_1rm(planned_set.reps, goal, level))
+            else:
+                weight = _round_load(top * ramp[warmup_index])
+                warmup_index += 1
+            sets.append(WorkoutSet(reps=planned_set.reps, setType=planned_set.setType, weight=weight))
+        exercises.append(Exercise(name=planned.name, sets=sets))
+    return Workout(exercises=exercises, notes=plan.notes, workoutFocus=plan.workoutFocus)
+
+
+# ============================================================================
+# GENERATOR
+# ============================================================================
+
+def _without_weights(workout):
+    # Demo workouts may be Workout models, dicts or JSON strings
+    if isinstance(workout, BaseModel):
+        workout = workout.model_dump()
+    elif isinstance(workout, str):
+        try:
+            workout = json.loads(workout)
+        except ValueError:
+            return workout
+    if not isinstance(workout, dict):
+        return workout
+    return {**workout, "exercises": [
+        {**exercise, "sets": [{key: value for key, value in s.items() if key != "weight"}
+                              for s in exercise.get("sets", []) if isinstance(s, dict)]}
+        if isinstance(exercise, dict) else exercise
+        for exercise in workout.get("exercises", [])
+    ]}
+
+
+class PrescribedWorkoutGenerator(dspy.Module):
+    """
+    WorkoutGenerator front end that asks the LM for a WorkoutPlan and
+    prescribes the weights locally.
+
+    The wrapped generator keeps its predictor, so optimized artifacts and
+    execution modes apply unchanged.
+
+    Args:
+        generator: WorkoutGenerator whose predictor is used (optimized or not)
+    """
+    def __init__(self, generator=None):
+        super().__init__()
+        self.generator = generator or WorkoutGenerator()
+        self.stats = {"requests": 0, "from_pr": 0, "weights": 0}
+        self._plan_signature = (None, None)
+        self._plan_demos = (None, (), [])
+
+    def _plan_kwargs(self, user_requirements):
+        predict = self.generator.generate.predict
+        base, signature = self._plan_signature
+        if base is not predict.signature:
+            signature = predict.signature.with_updated_fields("workout", type_=WorkoutPlan, desc=PLAN_DESC)
+            self._plan_signature = (predict.signature, signature)
+        # Rebuilt only when the demos change, so the list identity stays stable for PrefixCache
+        source, ids, demos = self._plan_demos
+        if source is not predict.demos or ids != tuple(map(id, predict.demos)):
+            demos = [demo.copy(workout=_without_weights(demo["workout"])) if "workout" in demo else demo
+                     for demo in predict.demos]
+            self._plan_demos = (predict.demos, tuple(map(id, predict.demos)), demos)
+        return {**user_requirements, "signature": signature, "demos": demos}
+
+    def _prescribe(self, plan, user_requirements):
+        workout = prescribe_weights(plan.workout, user_requirements)
+        self.stats["requests"] += 1
+        self.stats["from_pr"] += bench_1rm_for(user_requirements.get("primary_lift_pr"))[1]
+        self.stats["weights"] += sum(s.weight is not None for e in workout.exercises for s in e.sets)
+        return dspy.Prediction(reasoning=plan.get("reasoning", ""), workout=workout)
+
+    def forward(self, **user_requirements):
+        plan = self.generator.generate(**self._plan_kwargs(user_requirements))
+        return self._prescribe(plan, user_requirements)
+
+    async def aforward(self, **user_requirements):
+        plan = await self.generator.generate.acall(**self._plan_kwargs(user_requirements))
+        return self._prescribe(plan, user_requirements)
+
+
+if __name__ == "__main__":
+    import time
+
+    from metrics import workout_quality
+    from stub_lm import StubLM
+    from training_data import get_generator_trainset
+
+    examples = get_generator_trainset()
+    prs = ("null", "205lb bench", "bench 225x5", "140kg deadlift for 3", "315lb squat")
+    current = {}
+
+    def workout_response(messages):
+        """The example's own workout, without weights when the prompt asks for a WorkoutPlan."""
+        workout = current["example"].workout.model_dump()
+        if "WorkoutPlan" in messages[0]["content"]:
+            workout = _without_weights(workout)
+        return json.dumps(workout)
+
+    # 300ms to first token plus 2ms per 4-character chunk: latency follows output length
+    lm = StubLM(responses={"workout": workout_response}, latency=0.3, token_delay=0.002)
+    dspy.configure(lm=lm)
+    variants = {"LM weights": WorkoutGenerator(), "Local weights": None}
+    variants["Local weights"] = PrescribedWorkoutGenerator(variants["LM weights"])
+
+    print("=" * 60)
+    print(f"WEIGHT PRESCRIPTION ({len(examples) * len(prs)} requests, StubLM 300ms + 2ms per 4 output chars)")
+    print("=" * 60)
+    print(f"{'Variant':<14} | {'Out tok/call':>12} | {'Prompt tok/call':>15} | {'Mean latency':>12} | Quality")
+    for name, generator in variants.items():
+        completion_tokens = prompt_tokens = seconds = score = 0
+        for example in examples:
+            for pr in prs:
+                current["example"] = example
+                inputs = {**example.inputs().toDict(), "primary_lift_pr": pr}
+                start = time.perf_counter()
+                prediction = generator(**inputs)
+                seconds += time.perf_counter() - start
+                completion_tokens += lm.history[-1]["usage"]["completion_tokens"]
+                prompt_tokens += lm.history[-1]["usage"]["prompt_tokens"]
+                score += workout_quality(example, prediction)
+        count = len(examples) * len(prs)
+        print(f"{name:<14} | {completion_tokens / count:>12.0f} | {prompt_tokens / count:>15.0f} | "
+              f"{seconds / count * 1000:>10.0f}ms | {score / count:.1%}")
+    print(f"Prescriber stats: {variants['Local weights'].stats}")
+
+    print("\nPrescribed working weights (strength 5s / hypertrophy 10s, intermediate):")
+    for pr in prs:
+        bench_1rm, from_pr = bench_1rm_for(pr, "intermediate")
+        row = []
+        for exercise in ("Barbell Bench Press", "Barbell Back Squat", "Dumbbell Row"):
+            one_rep_max = exercise_1rm(exercise, bench_1rm)
+            row.append(f"{_round_load(one_rep_max * percent_1rm(5, 'strength', 'intermediate')):>4.0f}/"
+                       f"{_round_load(one_rep_max * percent_1rm(10, 'hypertrophy', 'intermediate')):<4.0f}")
+        source = "PR" if from_pr else "reference"
+        print(f"  {pr:<22} bench 1RM {bench_1rm:>5.0f} ({source:<9}) | bench {row[0]} | squat {row[1]} | "
+              f"DB row {row[2]}")
@@ -0,0 +1,388 @@
+"""
+Semantic Workout Cache
+
+This module contains:
+- requirement_features: Normalized view of WorkoutGenerator inputs
+- similarity: Weighted similarity between two normalized requirement sets
+- WorkoutCache: Bounded in-memory cache of generated workouts with exact and
+  similarity lookups, LRU or LFU eviction, TTL staleness and hit statistics
+- CachedWorkoutGenerator: WorkoutGenerator front end that consults the cache
+
+lm_cache.py only helps when the rendered prompt is byte-identical, so
+"45" vs "45 minutes" or "dumbbell" vs "dumbbells" each cost a new
+ChainOfThought generation. Here requirements are normalized first (the same
+enum matching the rule extractor and template library use) and a request
+may reuse a recent workout whose requirements score at least the similarity
+threshold. Equipment, space, injuries and the bench press 1RM bucket are
+never relaxed: a workout is only reused for the exact same constraints, and
+its weights only for a lifter of about the same strength. With the default
+FEATURE_WEIGHTS and threshold, similarity only ever relaxes duration: a
+different goal or focus scores at most 8/11 (0.73) and a different fitness
+level 9/11 (0.82), both below 0.9, so a similar hit is the same request with
+a duration within about 18%. main.py puts the cache in front of the
+generator when COACH_NOVA_WORKOUT_CACHE=on. Running this file compares raw,
+normalized and similarity keys and both eviction policies on a synthetic
+request stream.
+"""
+
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import dspy
+
+from extraction_state import FIELD_CHOICES, normalize_value
+from modules import WorkoutGenerator
+from workout_templates import NO_INJURY_VALUES, estimate_bench_1rm, normalize_enum
+
+
+DEFAULT_MAX_ENTRIES = 256
+DEFAULT_MAX_BYTES = 4 * 1024 * 1024
+DEFAULT_TTL = 24 * 60 * 60  # one day
+DEFAULT_THRESHOLD = 0.9
+
+EVICTION_POLICIES = ("lru", "lfu")
+
+# Features that must match exactly for a workout to be reused; cached weights are
+# only appropriate for a similar bench_1rm, so it is bucketed and matched exactly too
+HARD_FEATURES = ("equipment", "space", "injuries", "bench_1rm")
+BENCH_1RM_BUCKET = 20  # lbs
+
+# Weights of the remaining features in the similarity score; at DEFAULT_THRESHOLD
+# any goal, focus or fitness_level mismatch already fails, so only duration is relaxed
+FEATURE_WEIGHTS = {"goal": 3.0, "focus": 3.0, "duration": 3.0, "fitness_level": 2.0}
+
+
+def requirement_features(requirements):
+    """
+    Normalize WorkoutGenerator inputs for cache lookups.
+
+    Enum fields map to their documented value when recognizable (otherwise
+    their normalized text), duration to minutes, injuries to "none" or their
+    text and primary_lift_pr to an estimated bench press 1RM, rounded to
+    BENCH_1RM_BUCKET lbs.
+
+    Args:
+        requirements: Dict of GenerateWorkout inputs
+
+    Returns:
+        dict: Feature name -> normalized value
+    """
+    features = {
+        name: normalize_enum(name, requirements.get(name)) or normalize_value(requirements.get(name))
+        for name in FIELD_CHOICES
+    }
+    minutes = re.search(r"\d+", str(requirements.get("duration")))
+    features["duration"] = int(minutes.group()) if minutes else None
+    injuries = normalize_value(requirements.get("injuries"))
+    features["injuries"] = "none" if injuries in NO_INJURY_VALUES else injuries
+    bench_1rm = estimate_bench_1rm(requirements.get("primary_lift_pr"))
+    features["bench_1rm"] = BENCH_1RM_BUCKET * round(bench_1rm / BENCH_1RM_BUCKET) if bench_1rm else None
+    return features
+
+
+def _relative_closeness(a, b):
+    if a == b:
+        return 1.0
+    if a is None or b is None:
+        return 0.5
+    # 10% apart scores 0.8, 50% apart scores 0
+    return max(0.0, 1.0 - 2.0 * abs(a - b) / max(a, b))
+
+
+def similarity(a, b):
+    """
+    Similarity of two requirement_features results, between 0.0 and 1.0.
+
+    Returns 0.0 when any hard feature differs.
+    """
+    if any(a[name] != b[name] for name in HARD_FEATURES):
+        return 0.0
+    score = 0.0
+    for name, weight in FEATURE_WEIGHTS.items():
+        if name == "duration":
+            score += weight * _relative_closeness(a[name], b[name])
+        else:
+            score += weight * (a[name] == b[name])
+    return score / sum(FEATURE_WEIGHTS.values())
+
+
+@dataclass
+class CacheEntry:
+    """One cached workout"""
+    features: dict
+    prediction: dspy.Prediction
+    size: int
+    created: float
+    accessed: float
+    hits: int = 0
+
+
+# ============================================================================
+# WORKOUT CACHE
+# ============================================================================
+
+class WorkoutCache:
+    """
+    In-memory cache of WorkoutGenerator predictions keyed by normalized requirements.
+
+    Lookups try the exact normalized key first, then scan the entries that
+    share the hard features for the most similar one. Entries older than ttl
+    seconds are stale: they are dropped when found and never served.
+
+    Args:
+        threshold: Minimum similarity for a non-identical request to reuse a workout
+        max_entries: Largest number of cached workouts
+        max_bytes: Largest total size of cached workouts (JSON bytes)
+        ttl: Seconds a workout may be served for (None: forever)
+        policy: "lru" or "lfu" (least frequently used, oldest access first on ties)
+        clock: Time source, replaceable for simulations
+    """
+    def __init__(self, threshold=DEFAULT_THRESHOLD, max_entries=DEFAULT_MAX_ENTRIES, max_bytes=DEFAULT_MAX_BYTES,
+                 ttl=DEFAULT_TTL, policy="lru", clock=time.monotonic):
+        if policy not in EVICTION_POLICIES:
+            raise ValueError(f"policy must be one of {EVICTION_POLICIES}, got {policy!r}")
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.policy = policy
+        self.clock = clock
+        self.total_bytes = 0
+        self._entries = OrderedDict()  # exact key -> CacheEntry, least recently used first
+        self._groups = {}  # hard feature values -> set of exact keys
+        self._lock = threading.Lock()
+        self.stats = {"exact_hits": 0, "similar_hits": 0, "misses": 0, "stale": 0, "evictions": 0}
+
+    @staticmethod
+    def _key(features):
+        return tuple(features[name] for name in sorted(features))
+
+    @staticmethod
+    def _group(features):
+        return tuple(features[name] for name in HARD_FEATURES)
+
+    @property
+    def hit_rate(self):
+        hits = self.stats["exact_hits"] + self.stats["similar_hits"]
+        total = hits + self.stats["misses"]
+        return hits / total if total else 0.0
+
+    def _is_stale(self, entry, now):
+        return self.ttl is not None and now - entry.created > self.ttl
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        group = self._groups[self._group(entry.features)]
+        group.discard(key)
+        if not group:
+            del self._groups[self._group(entry.features)]
+        self.total_bytes -= entry.size
+
+    def _find(self, features, now):
+        key = self._key(features)
+        entry = self._entries.get(key)
+        if entry is not None:
+            if not self._is_stale(entry, now):
+                return key, "exact_hits"
+            self._remove(key)
+            self.stats["stale"] += 1
+
+        best_key, best_score = None, self.threshold
+        for candidate in list(self._groups.get(self._group(features), ())):
+            entry = self._entries[candidate]
+            if self._is_stale(entry, now):
+                self._remove(candidate)
+                self.stats["stale"] += 1
+                continue
+            score = similarity(features, entry.features)
+            if score >= best_score:
+                best_key, best_score = candidate, score
+        return best_key, "similar_hits"
+
+    def get(self, requirements):
+        """
+        Return a cached prediction for these requirements, or None.
+
+        Args:
+            requirements: Dict of GenerateWorkout inputs
+
+        Returns:
+            dspy.Prediction or None: A copy of the cached reasoning + workout
+        """
+        features = requirement_features(requirements)
+        now = self.clock()
+        with self._lock:
+            key, kind = self._find(features, now)
+            if key is None:
+                self.stats["misses"] += 1
+                return None
+            self.stats[kind] += 1
+            entry = self._entries[key]
+            entry.hits += 1
+            entry.accessed = now
+            self._entries.move_to_end(key)
+        return dspy.Prediction(reasoning=entry.prediction.get("reasoning", ""),
+                               workout=entry.prediction.workout.model_copy(deep=True))
+
+    def put(self, requirements, prediction):
+        """Cache a WorkoutGenerator prediction and evict entries over the limits."""
+        features = requirement_features(requirements)
+        key = self._key(features)
+        now = self.clock()
+        size = len(prediction.workout.model_dump_json())
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = CacheEntry(features, prediction, size, now, now)
+            self._groups.setdefault(self._group(features), set()).add(key)
+            self.total_bytes += size
+            while len(self._entries) > self.max_entries or self.total_bytes > self.max_bytes:
+                self._remove(self._victim())
+                self.stats["evictions"] += 1
+
+    def _victim(self):
+        if self.policy == "lru":
+            return next(iter(self._entries))
+        # Ordered by recency, so min() picks the least recently used among the least hit
+        return min(self._entries, key=lambda key: self._entries[key].hits)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._groups.clear()
+            self.total_bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class CachedWorkoutGenerator(dspy.Module):
+    """
+    WorkoutGenerator front end that reuses workouts for near-identical requirements.
+
+    Args:
+        generator: WorkoutGenerator called on misses (optimized or not)
+        cache: WorkoutCache to consult (default: a new one with default settings)
+    """
+    def __init__(self, generator=None, cache=None):
+        super().__init__()
+        self.generator = generator or WorkoutGenerator()
+        self.cache = cache or WorkoutCache()
+
+    def forward(self, **user_requirements):
+        prediction = self.cache.get(user_requirements)
+        if prediction is None:
+            prediction = self.generator(**user_requirements)
+            self.cache.put(user_requirements, prediction)
+        return prediction
+
+    async def aforward(self, **user_requirements):
+        prediction = self.cache.get(user_requirements)
+        if prediction is None:
+            prediction = await self.generator.acall(**user_requirements)
+            self.cache.put(user_requirements, prediction)
+        return prediction
+
+
+if __name__ == "__main__":
+    import random
+
+    from modules import Workout
+    from stub_lm import DEFAULT_WORKOUT, StubLM
+
+    SURFACE_FORMS = {
+        "duration": lambda minutes, rng: rng.choice([str(minutes), f"{minutes} minutes", f"{minutes} min"]),
+        "equipment": lambda value, rng: rng.choice([value, value.rstrip("s"), value.title()]),
+        "focus": lambda value, rng: rng.choice([value, value.replace("_", " ")]),
+        "injuries": lambda value, rng: rng.choice(["none", "no", "None"]) if value == "none" else value,
+    }
+
+    def synthetic_requests(count, seed=0):
+        """Zipf-distributed popular requirement tuples written in varying surface forms."""
+        rng = random.Random(seed)
+        profiles = []
+        for _ in range(400):
+            profiles.append({
+                "fitness_level": rng.choice(FIELD_CHOICES["fitness_level"]),
+                "goal": rng.choice(FIELD_CHOICES["goal"]),
+                "focus": rng.choice(FIELD_CHOICES["focus"]),
+                "equipment": rng.choice(("dumbbells", "barbell", "bodyweight")),
+                "duration": rng.choice((30, 40, 45, 50, 60)),
+                "space": rng.choice(("gym", "home")),
+                "injuries": "none" if rng.random() < 0.8 else "bad left knee",
+                "primary_lift_pr": "null",
+            })
+        weights = [1 / rank for rank in range(1, len(profiles) + 1)]
+        for profile in rng.choices(profiles, weights, k=count):
+            yield {name: SURFACE_FORMS.get(name, lambda value, rng: value)(value, rng) for name, value in profile.items()}
+
+    class SimulatedClock:
+        def __init__(self):
+            self.now = 0.0
+
+        def __call__(self):
+            return self.now
+
+    requests = list(synthetic_requests(2000))
+    stub_prediction = dspy.Prediction(reasoning="stub", workout=Workout.model_validate(DEFAULT_WORKOUT))
+
+    def simulate(cache):
+        """Replay the stream, one request per simulated minute; misses are 'generated'."""
+        clock = cache.clock
+        generated = 0
+        for request in requests:
+            clock.now += 60
+            if cache.get(request) is None:
+                generated += 1
+                cache.put(request, stub_prediction)
+        return generated
+
+    print("=" * 60)
+    print(f"SEMANTIC WORKOUT CACHE ({len(requests)} requests, 1/min, 64 entries, 12h TTL)")
+    print("=" * 60)
+    raw_cache, raw_generated = OrderedDict(), 0
+    for request in requests:
+        key = tuple(sorted(request.items()))
+        if key in raw_cache:
+            raw_cache.move_to_end(key)
+            continue
+        raw_generated += 1
+        raw_cache[key] = True
+        if len(raw_cache) > 64:
+            raw_cache.popitem(last=False)
+    print(f"{'Raw input key (LRU)':<30} | hit rate {1 - raw_generated / len(requests):5.1%} | generations {raw_generated}")
+
+    for label, threshold, policy in [("Normalized key (LRU)", 1.0, "lru"), ("Normalized key (LFU)", 1.0, "lfu"),
+                                     ("Similarity >= 0.9 (LRU)", 0.9, "lru"), ("Similarity >= 0.9 (LFU)", 0.9, "lfu"),
+                                     ("Similarity >= 0.8 (LFU)", 0.8, "lfu")]:
+        cache = WorkoutCache(threshold=threshold, max_entries=64, ttl=12 * 60 * 60, policy=policy,
+                             clock=SimulatedClock())
+        generated = simulate(cache)
+        stats = cache.stats
+        print(f"{label:<30} | hit rate {cache.hit_rate:5.1%} | generations {generated} | "
+              f"exact {stats['exact_hits']} similar {stats['similar_hits']} stale {stats['stale']} "
+              f"evicted {stats['evictions']}")
+
+    # End to end: cached requests skip the ChainOfThought generation entirely
+    dspy.configure(lm=StubLM(latency=0.3))
+    generator = CachedWorkoutGenerator(cache=WorkoutCache(policy="lfu"))
+    latencies = {"hit": [], "miss": []}
+    for request in requests[:40]:
+        misses = generator.cache.stats["misses"]
+        start = time.perf_counter()
+        generator(**request)
+        latencies["miss" if generator.cache.stats["misses"] > misses else "hit"].append(time.perf_counter() - start)
+    print(f"\nStubLM (300ms): {len(latencies['hit'])} hits at "
+          f"{sum(latencies['hit']) / len(latencies['hit']) * 1e6:.0f}us, {len(latencies['miss'])} misses at "
+          f"{sum(latencies['miss']) / len(latencies['miss']) * 1000:.0f}ms; "
+          f"cache holds {len(generator.cache)} workouts in {generator.cache.total_bytes} bytes")
+
+    # Weights are tied to the lifter: a very different PR must never reuse a cached workout
+    request = {**requests[0], "injuries": "none"}
+    weak, strong = (requirement_features({**request, "primary_lift_pr": pr}) for pr in ("135lb bench", "315lb bench"))
+    assert similarity(weak, strong) == 0.0, "workouts reused across very different bench press 1RMs"
+    print(f"135lb vs 315lb bench: similarity {similarity(weak, strong):.1f} (bench_1rm buckets of "
+          f"{BENCH_1RM_BUCKET}lbs must match)")
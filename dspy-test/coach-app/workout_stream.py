@@ -0,0 +1,296 @@
+"""
+Streaming Workout Generation
+
+This module contains:
+- ExerciseStreamParser: Incremental JSON scanner that validates each entry of
+  the "exercises" array against the Exercise model as soon as it closes
+- WorkoutStream: Runs a WorkoutGenerator's prompt with a streaming LM call and
+  yields validated Exercise objects while the rest of the workout is generated
+- stream_workout: Entry point used by main.py
+
+DSPy's own StreamListener only handles string output fields, so the workout
+field is streamed here: the prompt is formatted with the generator's own
+predictor, signature and demos, and the finished completion goes through the
+same adapter parse, so the final prediction matches a blocking call.
+"""
+
+import json
+import time
+
+import dspy
+import litellm
+from pydantic import ValidationError
+
+from lm_cache import CachedLM
+from modules import Exercise
+
+
+WORKOUT_FIELD_MARKER = "[[ ## workout ## ]]"
+
+
+# ============================================================================
+# INCREMENTAL PARSER
+# ============================================================================
+
+class ExerciseStreamParser:
+    """
+    Incremental scanner over the JSON text of a Workout.
+
+    Characters are fed in arbitrary pieces. The scanner tracks string and
+    nesting state only, so each character is looked at once; whenever an
+    object inside the top-level "exercises" array closes, its text span is
+    validated with Exercise and returned, and its position in the array is
+    added to emitted_indices. Top-level string values (workoutFocus, notes)
+    are collected in fields as they complete.
+    """
+    def __init__(self):
+        self.text = []
+        self.position = 0
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.string_start = None
+        self.expecting_key = False
+        self.current_key = None
+        self.in_exercises = False
+        self.exercise_start = None
+        self.exercise_index = 0
+        self.emitted_indices = set()
+        self.done = False
+        self.fields = {}
+        self.invalid_exercises = 0
+
+    def feed(self, chunk):
+        """
+        Consume more workout text.
+
+        Args:
+            chunk: Next piece of the workout field's JSON text
+
+        Returns:
+            list: Exercise objects completed by this chunk
+        """
+        completed = []
+        for char in chunk:
+            if self.done:
+                break
+            self.text.append(char)
+            index = self.position
+            self.position += 1
+
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif char == "\\":
+                    self.escape = True
+                elif char == '"':
+                    self.in_string = False
+                    if self.depth == 1:
+                        self._top_level_string(index)
+                continue
+
+            if self.depth == 0 and char != "{":
+                # Whitespace or a ```json fence before the workout object
+                continue
+            if char == '"':
+                self.in_string = True
+                self.string_start = index
+            elif char in "{[":
+                self.depth += 1
+                if self.depth == 1:
+                    self.expecting_key = char == "{"
+                elif self.depth == 2 and char == "[" and self.current_key == "exercises":
+                    self.in_exercises = True
+                elif self.depth == 3 and char == "{" and self.in_exercises:
+                    self.exercise_start = index
+            elif char in "}]":
+                self.depth -= 1
+                if self.depth == 2 and char == "}" and self.exercise_start is not None:
+                    exercise = self._validate("".join(self.text[self.exercise_start:index + 1]))
+                    self.exercise_start = None
+                    if exercise is not None:
+                        self.emitted_indices.add(self.exercise_index)
+                        completed.append(exercise)
+                    self.exercise_index += 1
+                elif self.depth == 1 and char == "]":
+                    self.in_exercises = False
+                elif self.depth == 0:
+                    self.done = True
+            elif char == "," and self.depth == 1:
+                self.expecting_key = True
+        return completed
+
+    def _top_level_string(self, end):
+        value = json.loads("".join(self.text[self.string_start:end + 1]))
+        if self.expecting_key:
+            self.current_key = value
+            self.expecting_key = False
+        elif self.current_key is not None:
+            self.fields[self.current_key] = value
+
+    def _validate(self, span):
+        try:
+            return Exercise.model_validate_json(span)
+        except ValidationError:
+            # Left for the final adapter parse, which may still repair it
+            self.invalid_exercises += 1
+            return None
+
+
+# ============================================================================
+# STREAMING CALL
+# ============================================================================
+
+def stream_completion(lm, messages):
+    """
+    Yield completion text for messages as the LM produces it.
+
+    StubLM, RateLimitedLM and other LMs with a stream() method are used
+    directly; a plain dspy.LM goes through litellm with stream=True.
+    Streaming bypasses the response cache.
+
+    Args:
+        lm: Configured dspy LM
+        messages: Chat messages formatted by the adapter
+
+    Yields:
+        str: Successive pieces of the completion
+    """
+    if isinstance(lm, CachedLM):
+        lm = lm.lm
+    if hasattr(lm, "stream"):
+        yield from lm.stream(messages=messages)
+        return
+
+    response = litellm.completion(model=lm.model, messages=messages, stream=True, **lm.kwargs)
+    for chunk in response:
+        delta = chunk.choices[0].delta.content if chunk.choices else None
+        if delta:
+            yield delta
+
+
+class WorkoutStream:
+    """
+    Iterable over the exercises of a workout that is still being generated.
+
+    Iterating yields each Exercise as soon as its JSON closes and validates.
+    Once iteration finishes, prediction holds the same dspy.Prediction
+    (reasoning + Workout) a blocking WorkoutGenerator call would return, and
+    any exercise only the final parse could recover is yielded last.
+
+    Args:
+        generator: WorkoutGenerator whose predictor, demos and signature are used
+        **user_requirements: Inputs for GenerateWorkout
+    """
+    def __init__(self, generator, **user_requirements):
+        self.predictor = generator.generate.predict
+        # The generator's execution mode decides the signature and demos (see execution_modes.py)
+        self.call_kwargs = generator.generate.mode_call_kwargs()
+        self.inputs = user_requirements
+        self.parser = ExerciseStreamParser()
+        self.prediction = None
+        self.started = None
+        self.first_exercise_latency = None
+        self.total_latency = None
+
+    @property
+    def fields(self):
+        """Top-level workout strings (workoutFocus, notes) seen so far."""
+        return self.parser.fields
+
+    def __iter__(self):
+        adapter = dspy.settings.adapter or dspy.ChatAdapter()
+        lm = self.predictor.lm or dspy.settings.lm
+        signature = self.call_kwargs["signature"]
+        messages = adapter.format(signature, self.call_kwargs["demos"], self.inputs)
+
+        self.started = time.perf_counter()
+        completion = []
+        workout_offset = None
+        for chunk in stream_completion(lm, messages):
+            completion.append(chunk)
+            if workout_offset is None:
+                text = "".join(completion)
+                marker = text.find(WORKOUT_FIELD_MARKER)
+                if marker < 0:
+                    continue
+                workout_offset = marker + len(WORKOUT_FIELD_MARKER)
+                chunk = text[workout_offset:]
+            for exercise in self.parser.feed(chunk):
+                if self.first_exercise_latency is None:
+                    self.first_exercise_latency = time.perf_counter() - self.started
+                yield exercise
+
+        parsed = adapter.parse(signature, "".join(completion))
+        self.prediction = dspy.Prediction(**parsed)
+        self.total_latency = time.perf_counter() - self.started
+        # Exercises that failed strict validation mid-stream, wherever they are in the array
+        for index, exercise in enumerate(self.prediction.workout.exercises):
+            if index in self.parser.emitted_indices:
+                continue
+            if self.first_exercise_latency is None:
+                self.first_exercise_latency = time.perf_counter() - self.started
+            yield exercise
+
+
+def stream_workout(generator, **user_requirements):
+    """
+    Start a streaming workout generation.
+
+    Args:
+        generator: WorkoutGenerator (optimized or not)
+        **user_requirements: Same keyword arguments as generator(...)
+
+    Returns:
+        WorkoutStream: Iterate it to receive exercises progressively
+    """
+    return WorkoutStream(generator, **user_requirements)
+
+
+if __name__ == "__main__":
+    from modules import WorkoutGenerator
+    from sessions import build_generator_inputs
+    from stub_lm import StubLM
+
+    # 300ms to first token, then 4 characters every 10ms
+    dspy.configure(lm=StubLM(latency=0.3, token_delay=0.01))
+    generator = WorkoutGenerator()
+    inputs = build_generator_inputs(dspy.Prediction(goal="hypertrophy", equipment="dumbbells",
+                                                    duration="45", focus="full_body"))
+
+    print("=" * 60)
+    print("STREAMING WORKOUT GENERATION (StubLM, 300ms + 10ms per 4 chars)")
+    print("=" * 60)
+
+    start = time.perf_counter()
+    blocking = generator(**inputs)
+    blocking_seconds = time.perf_counter() - start
+    print(f"Blocking:  first exercise after {blocking_seconds * 1000:.0f}ms "
+          f"(all {len(blocking.workout.exercises)} at once)")
+
+    stream = stream_workout(generator, **inputs)
+    arrivals = []
+    for exercise in stream:
+        arrivals.append((time.perf_counter() - stream.started, exercise.name))
+    print(f"Streaming: first exercise after {stream.first_exercise_latency * 1000:.0f}ms, "
+          f"complete after {stream.total_latency * 1000:.0f}ms")
+    for arrived, name in arrivals:
+        print(f"  {arrived * 1000:6.0f}ms  {name}")
+
+    assert stream.prediction.workout == blocking.workout, "streamed workout differs from blocking call"
+    print(f"\nTime to first exercise: {blocking_seconds / stream.first_exercise_latency:.1f}x faster; "
+          f"final Workout identical to the blocking call")
+
+    # An exercise that only the final (repairing) parse accepts must be yielded once, in addition
+    # to the ones already streamed, even when it sits in the middle of the array
+    from output_repair import RepairingAdapter
+    from stub_lm import DEFAULT_WORKOUT
+
+    workout = json.loads(json.dumps(DEFAULT_WORKOUT))
+    workout["exercises"][1]["sets"][0]["reps"] = "8-10"
+    with dspy.context(lm=StubLM(responses={"workout": json.dumps(workout)}), adapter=RepairingAdapter()):
+        stream = stream_workout(generator, **inputs)
+        names = [exercise.name for exercise in stream]
+    expected = [exercise["name"] for exercise in workout["exercises"]]
+    assert sorted(names) == sorted(expected), f"streamed {names}, expected each of {expected} once"
+    print(f"Mid-array repair: streamed {names[:-1]}, then {names[-1]!r} after the final parse")
@@ -0,0 +1,422 @@
+"""
+Template-Based Workout Fast Path
+
+This module contains:
+- normalize_requirements: Maps generator inputs to a library key
+  (fitness_level, goal, focus, equipment, duration bucket, space)
+- estimate_bench_1rm: Reference strength from a primary_lift_pr like "205lb bench"
+- TemplateLibrary: Precomputed exercise layouts and set schemes for every key
+  the exercise catalog can fill
+- TemplateWorkoutGenerator: Serves workouts from the library and falls back
+  to WorkoutGenerator on misses or when the user reports injuries
+
+Common requirement tuples produce near-identical LM workouts (compare the
+generator_examples in training_data.py), yet each costs a full
+WorkoutGenerator call. Here every slot of a layout holds up to three
+interchangeable catalog exercises, one of which is picked at random per
+request, and working weights come from %1RM per goal applied to an
+estimated bench press 1RM (fitness-level default, or scaled from
+primary_lift_pr). Anything the library cannot represent, including any
+injury, still goes to the LM. Running this file reports hit rate, latency
+savings and workout_quality over a synthetic request distribution.
+"""
+
+import itertools
+import random
+import re
+from collections import Counter
+from dataclasses import dataclass
+
+import dspy
+
+from exercise_catalog import ALLOWED_EQUIPMENT, EXERCISES
+from extraction_state import FIELD_CHOICES, normalize_value
+from modules import Exercise, Workout, WorkoutGenerator, WorkoutSet
+from rule_extractor import match_enum
+
+
+# Session lengths the library covers: bucket -> (shortest, longest) minutes
+DURATION_BUCKETS = {30: (20, 37), 45: (38, 52), 60: (53, 75)}
+EXERCISES_PER_BUCKET = {30: 3, 45: 4, 60: 5}
+
+# Slot patterns for full-body sessions, in order
+FULL_BODY_PATTERNS = ("legs", "push", "pull", "full_body", "legs")
+
+# Interchangeable exercises kept per slot (the source of variation)
+VARIANTS_PER_SLOT = 3
+
+# Injury values that do not need the LM's judgement
+NO_INJURY_VALUES = ("none", "null", "no", "n/a", "nothing")
+
+# Estimated bench press 1RM (lbs) for users without a primary_lift_pr
+REFERENCE_BENCH_1RM = {"beginner": 95.0, "intermediate": 165.0, "advanced": 235.0}
+LEVEL_SET_ADJUSTMENT = {"beginner": -1, "intermediate": 0, "advanced": 1}
+
+# Exercise 1RM relative to bench press 1RM, by name keyword (first match wins,
+# so isolation keywords come before the compound lifts they contain)
+LOAD_RATIOS = (
+    ("curl", 0.35), ("triceps", 0.35), ("skull crusher", 0.3), ("pushdown", 0.35),
+    ("lateral raise", 0.15), ("rear delt", 0.15), ("face pull", 0.3), ("fly", 0.35),
+    ("crossover", 0.35), ("pec deck", 0.5), ("extension", 0.5), ("calf raise", 1.0), ("shrug", 1.2),
+    ("romanian deadlift", 1.1), ("deadlift", 1.5), ("hip thrust", 1.4), ("leg press", 2.2),
+    ("split squat", 0.6), ("front squat", 1.0), ("squat", 1.2), ("lunge", 0.6), ("step-up", 0.5),
+    ("power clean", 0.8), ("thruster", 0.6), ("overhead press", 0.65), ("shoulder press", 0.65),
+    ("row", 0.85), ("pulldown", 0.8), ("incline", 0.85), ("floor press", 0.9), ("press", 1.0),
+)
+DEFAULT_LOAD_RATIO = 0.7
+
+# Load of the implement relative to a barbell (dumbbells are per hand)
+EQUIPMENT_LOAD = {"barbell": 1.0, "dumbbells": 0.4, "cables": 0.6, "machines": 0.9}
+
+# primary_lift_pr lifts as a multiple of bench press 1RM
+PR_LIFT_RATIOS = {"bench": 1.0, "squat": 1.2, "deadlift": 1.5, "overhead press": 0.65, "ohp": 0.65, "row": 0.85}
+PR_PATTERN = re.compile(
+    r"(\d{2,3}(?:\.\d+)?)\s*(kg|lbs?|pounds)?\s*(?:on\s+|for\s+)?(?:the\s+)?"
+    r"(bench|squat|deadlift|overhead press|ohp|row)"
+)
+KG_TO_LB = 2.20462
+
+
+@dataclass(frozen=True)
+class SetScheme:
+    """Sets, reps and intensity for one training goal"""
+    warmups: tuple  # (reps, %1RM) before the first exercise's working sets
+    sets: int
+    reps: int
+    intensity: float  # Working sets, as a fraction of the exercise 1RM
+    notes: str
+
+
+GOAL_SCHEMES = {
+    "strength": SetScheme(((5, 0.5), (3, 0.7)), 4, 5, 0.85,
+                          "Rest 3-5 minutes between working sets; end a set if bar speed drops sharply."),
+    "power": SetScheme(((3, 0.5),), 5, 3, 0.7,
+                       "Move every rep explosively and rest 2-3 minutes between sets."),
+    "hypertrophy": SetScheme(((12, 0.4),), 3, 10, 0.72,
+                             "Rest 60-90 seconds between sets and finish each set 1-2 reps short of failure."),
+    "endurance": SetScheme((), 3, 15, 0.55,
+                           "Keep rest to 30-45 seconds between sets."),
+    "general": SetScheme(((12, 0.4),), 3, 10, 0.65,
+                         "Rest 60-90 seconds between sets and keep every rep controlled."),
+}
+
+
+@dataclass(frozen=True)
+class WorkoutTemplate:
+    """Precomputed workout for one library key"""
+    key: tuple
+    slots: tuple  # Per slot: ((exercise name, load ratio or None), ...)
+    scheme: SetScheme
+    sets: int
+
+
+# ============================================================================
+# REQUIREMENT NORMALIZATION
+# ============================================================================
+
+def normalize_enum(name, value):
+    """Documented value of an enum field for loose input like "Dumbbell" or "full body", or None."""
+    value = normalize_value(value)
+    if value in FIELD_CHOICES[name]:
+        return value
+    return match_enum(name, value)
+
+
+def duration_bucket(value):
+    """Library bucket for a duration like "45" or "45 minutes", or None."""
+    match = re.search(r"\d+", str(value))
+    if not match:
+        return None
+    minutes = int(match.group())
+    for bucket, (shortest, longest) in DURATION_BUCKETS.items():
+        if shortest <= minutes <= longest:
+            return bucket
+    return None
+
+
+def normalize_requirements(requirements):
+    """
+    Library key for WorkoutGenerator inputs.
+
+    Args:
+        requirements: Dict of GenerateWorkout inputs
+
+    Returns:
+        tuple: (key or None, miss reason or None)
+    """
+    if normalize_value(requirements.get("injuries")) not in NO_INJURY_VALUES:
+        return None, "injuries"
+    values = {name: normalize_enum(name, requirements.get(name)) for name in FIELD_CHOICES}
+    unknown = [name for name, value in values.items() if value is None]
+    if unknown:
+        return None, f"unknown {unknown[0]}"
+    bucket = duration_bucket(requirements.get("duration"))
+    if bucket is None:
+        return None, "duration"
+    return (values["fitness_level"], values["goal"], values["focus"], values["equipment"], bucket, values["space"]), None
+
+
+def estimate_bench_1rm(primary_lift_pr):
+    """
+    Estimated bench press 1RM in lbs from a PR such as "205lb bench" or "100kg deadlift".
+
+    Returns:
+        float or None: None when no PR is stated or it cannot be read
+    """
+    match = PR_PATTERN.search(normalize_value(primary_lift_pr))
+    if not match:
+        return None
+    weight, unit, lift = match.groups()
+    pounds = float(weight) * (KG_TO_LB if unit == "kg" else 1.0)
+    estimate = pounds / PR_LIFT_RATIOS[lift]
+    # Implausible values are more likely extraction slips than PRs
+    return estimate if 45 <= estimate <= 500 else None
+
+
+# ============================================================================
+# LIBRARY
+# ============================================================================
+
+def load_ratio(entry):
+    """Exercise 1RM relative to bench press 1RM, or None for unloaded exercises."""
+    implement = EQUIPMENT_LOAD.get(entry.equipment[0])
+    if implement is None:
+        return None
+    lowered = entry.name.lower()
+    ratio = next((ratio for keyword, ratio in LOAD_RATIOS if keyword in lowered), DEFAULT_LOAD_RATIO)
+    return ratio * implement
+
+
+def _pool(pattern, equipment, space):
+    allowed = ALLOWED_EQUIPMENT.get(equipment, {equipment, "bodyweight"})
+    matches = [entry for entry in EXERCISES
+               if pattern in entry.focus and space in entry.space and not allowed.isdisjoint(entry.equipment)]
+    # Exercises for the user's equipment first, bodyweight fillers after
+    return sorted(matches, key=lambda entry: equipment not in entry.equipment)
+
+
+def _layout(focus, equipment, space, count):
+    patterns = FULL_BODY_PATTERNS[:count] if focus == "full_body" else (focus,) * count
+    taken = set()
+    slots = [None] * count
+    for pattern in dict.fromkeys(patterns):
+        indices = [index for index, slot_pattern in enumerate(patterns) if slot_pattern == pattern]
+        pool = [entry for entry in _pool(pattern, equipment, space) if entry.name not in taken]
+        if len(pool) < len(indices):
+            return None
+        # Slots sharing a pattern split its pool, so no exercise appears twice
+        for nth, index in enumerate(indices):
+            candidates = pool[nth::len(indices)][:VARIANTS_PER_SLOT]
+            taken.update(entry.name for entry in candidates)
+            slots[index] = tuple((entry.name, load_ratio(entry)) for entry in candidates)
+    return tuple(slots)
+
+
+def _round_weight(weight):
+    return max(5.0, 5.0 * round(weight / 5.0))
+
+
+class TemplateLibrary:
+    """
+    Workout templates for every (fitness_level, goal, focus, equipment,
+    duration bucket, space) key the exercise catalog has enough exercises for.
+
+    Layouts depend only on focus, equipment, space and bucket and are shared
+    between levels and goals.
+
+    Args:
+        seed: Seed for the exercise variation (None for a random seed)
+    """
+    def __init__(self, seed=None):
+        self.rng = random.Random(seed)
+        self.templates = {}
+        layouts = {}
+        for level, goal, focus, equipment, bucket, space in itertools.product(
+            FIELD_CHOICES["fitness_level"], FIELD_CHOICES["goal"], FIELD_CHOICES["focus"],
+            FIELD_CHOICES["equipment"], DURATION_BUCKETS, FIELD_CHOICES["space"]
+        ):
+            layout_key = (focus, equipment, space, bucket)
+            if layout_key not in layouts:
+                layouts[layout_key] = _layout(focus, equipment, space, EXERCISES_PER_BUCKET[bucket])
+            if layouts[layout_key] is None:
+                continue
+            scheme = GOAL_SCHEMES[goal]
+            key = (level, goal, focus, equipment, bucket, space)
+            self.templates[key] = WorkoutTemplate(key, layouts[layout_key], scheme,
+                                                  max(2, scheme.sets + LEVEL_SET_ADJUSTMENT[level]))
+
+    def __len__(self):
+        return len(self.templates)
+
+    def get(self, key):
+        return self.templates.get(key)
+
+    def render(self, template, bench_1rm=None):
+        """
+        Build a Workout from a template.
+
+        Args:
+            template: WorkoutTemplate from get()
+            bench_1rm: Estimated bench press 1RM in lbs (default: fitness-level reference)
+
+        Returns:
+            Workout: One randomly chosen exercise per slot, with weights from %1RM
+        """
+        level, goal, focus = template.key[:3]
+        bench_1rm = bench_1rm or REFERENCE_BENCH_1RM[level]
+        scheme = template.scheme
+        exercises = []
+        for index, slot in enumerate(template.slots):
+            name, ratio = self.rng.choice(slot)
+            one_rep_max = bench_1rm * ratio if ratio is not None else None
+
+            def weight(intensity):
+                return _round_weight(one_rep_max * intensity) if one_rep_max is not None else None
+
+            sets = [WorkoutSet(setType="warmup", reps=reps, weight=weight(intensity))
+                    for reps, intensity in (scheme.warmups if index == 0 else ())]
+            sets += [WorkoutSet(setType="working", reps=scheme.reps, weight=weight(scheme.intensity))
+                     for _ in range(template.sets)]
+            exercises.append(Exercise(name=name, sets=sets))
+        return Workout(
+            exercises=exercises,
+            notes=scheme.notes,
+            workoutFocus=f"{focus.replace('_', ' ').title()} {goal.title()}",
+        )
+
+
+# ============================================================================
+# FAST-PATH GENERATOR
+# ============================================================================
+
+class TemplateWorkoutGenerator(dspy.Module):
+    """
+    WorkoutGenerator front end that answers from a TemplateLibrary when it can.
+
+    Args:
+        generator: WorkoutGenerator used on misses (optimized or not)
+        library: TemplateLibrary to serve from
+        seed: Seed for a new library's exercise variation
+    """
+    def __init__(self, generator=None, library=None, seed=None):
+        super().__init__()
+        self.generator = generator or WorkoutGenerator()
+        self.library = library or TemplateLibrary(seed=seed)
+        self.stats = {"requests": 0, "hits": 0, "misses": Counter()}
+
+    @property
+    def hit_rate(self):
+        return self.stats["hits"] / self.stats["requests"] if self.stats["requests"] else 0.0
+
+    def serve(self, **user_requirements):
+        """
+        Answer from the library without calling the LM.
+
+        Args:
+            **user_requirements: Same keyword arguments as WorkoutGenerator
+
+        Returns:
+            dspy.Prediction or None: reasoning + workout on a hit, None on a miss
+        """
+        self.stats["requests"] += 1
+        key, reason = normalize_requirements(user_requirements)
+        template = self.library.get(key) if key else None
+        if template is None:
+            self.stats["misses"][reason or "no template"] += 1
+            return None
+        self.stats["hits"] += 1
+        bench_1rm = estimate_bench_1rm(user_requirements.get("primary_lift_pr"))
+        workout = self.library.render(template, bench_1rm)
+        source = f"an estimated {bench_1rm:.0f}lb bench 1RM" if bench_1rm else f"{key[0]} reference loads"
+        return dspy.Prediction(
+            reasoning=f"Served from the {'/'.join(map(str, key))} template with {source}.",
+            workout=workout,
+        )
+
+    def forward(self, **user_requirements):
+        prediction = self.serve(**user_requirements)
+        return prediction if prediction is not None else self.generator(**user_requirements)
+
+    async def aforward(self, **user_requirements):
+        prediction = self.serve(**user_requirements)
+        return prediction if prediction is not None else await self.generator.acall(**user_requirements)
+
+
+if __name__ == "__main__":
+    import time
+
+    from exercise_catalog import validate_workout
+    from metrics import workout_quality
+    from stub_lm import StubLM
+
+    def weighted(rng, options):
+        values, weights = zip(*options.items())
+        return rng.choices(values, weights)[0]
+
+    def synthetic_requests(count, seed=0):
+        rng = random.Random(seed)
+        for _ in range(count):
+            yield {
+                "fitness_level": weighted(rng, {"beginner": 3, "intermediate": 5, "advanced": 2}),
+                "goal": weighted(rng, {"hypertrophy": 35, "strength": 25, "general": 20, "endurance": 10, "power": 10}),
+                "focus": weighted(rng, {"full_body": 30, "legs": 15, "push": 12, "pull": 12, "chest": 8,
+                                        "back": 8, "arms": 8, "shoulders": 7}),
+                "equipment": weighted(rng, {"dumbbells": 35, "barbell": 25, "bodyweight": 20, "machines": 10,
+                                            "cables": 5, "dumbbells and bands": 5}),
+                "duration": weighted(rng, {"45": 35, "60": 25, "30": 20, "45 minutes": 10, "90": 5, "15": 5}),
+                "space": weighted(rng, {"gym": 60, "home": 30, "hotel": 5, "outdoor": 5}),
+                "injuries": weighted(rng, {"none": 80, "lower back pain": 10, "bad left knee": 10}),
+                "primary_lift_pr": weighted(rng, {"none": 70, "205lb bench": 10, "315lb squat": 10, "140kg deadlift": 10}),
+            }
+
+    requests = list(synthetic_requests(300))
+    start = time.perf_counter()
+    library = TemplateLibrary(seed=0)
+    build_seconds = time.perf_counter() - start
+
+    dspy.configure(lm=StubLM(latency=0.3, token_delay=0.0005))
+    fast = TemplateWorkoutGenerator(library=library)
+    served = []
+    start = time.perf_counter()
+    for request in requests:
+        prediction = fast.serve(**request)
+        if prediction is not None:
+            served.append((request, prediction))
+    serve_seconds = time.perf_counter() - start
+    hits = fast.stats["hits"]
+
+    # LM latency measured on a sample; every request would pay it without the fast path
+    lm_samples = []
+    for request in requests[:10]:
+        start = time.perf_counter()
+        fast.generator(**request)
+        lm_samples.append(time.perf_counter() - start)
+    lm_seconds = sum(lm_samples) / len(lm_samples)
+
+    print("=" * 60)
+    print(f"TEMPLATE FAST PATH ({len(requests)} synthetic requests, StubLM ~{lm_seconds * 1000:.0f}ms per call)")
+    print("=" * 60)
+    print(f"Library: {len(library)} keys built in {build_seconds * 1000:.0f}ms")
+    print(f"Hit rate: {fast.hit_rate:.0%} ({hits}/{len(requests)})")
+    for reason, count in fast.stats["misses"].most_common():
+        print(f"  miss: {reason:<20} {count}")
+    print(f"Template serve: {serve_seconds / len(requests) * 1e6:.0f}us per request")
+    all_lm = len(requests) * lm_seconds
+    with_templates = serve_seconds + (len(requests) - hits) * lm_seconds
+    print(f"Total generation time: {all_lm:.1f}s -> {with_templates:.1f}s ({1 - with_templates / all_lm:.0%} saved)")
+
+    scores = [workout_quality(dspy.Example(**request), prediction) for request, prediction in served]
+    issues = sum(len(validate_workout(prediction.workout, request["equipment"], request["space"], request["focus"]))
+                 for request, prediction in served)
+    print(f"\nServed workouts: mean workout_quality {sum(scores) / len(scores):.2f}, catalog issues {issues}")
+
+    request = {"fitness_level": "intermediate", "goal": "hypertrophy", "focus": "full_body",
+               "equipment": "dumbbells", "duration": "45", "space": "gym", "injuries": "none"}
+    variants = {tuple(e.name for e in fast.serve(**request, primary_lift_pr="none").workout.exercises)
+                for _ in range(50)}
+    print(f"Variation: {len(variants)} distinct exercise selections in 50 serves of {request['goal']}/"
+          f"{request['focus']}/{request['equipment']}/{request['duration']}")
+    for pr in ("none", "275lb bench"):
+        library.rng.seed(1)
+        first = fast.serve(**request, primary_lift_pr=pr).workout.exercises[0]
+        print(f"  PR {pr!r}: {first.name} working weight {first.sets[-1].weight:.0f}lbs")
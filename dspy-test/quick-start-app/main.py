@@ -1,10 +1,18 @@
 # This is just a quick start to test out the dspy library
 
 import os
+import sys
 import dspy
 
 api_key = os.getenv("GOOGLE_GENERATIVE_AI_API_KEYKEY")
-dspy.configure(lm=dspy.LM("gemini/gemini-2.5-flash", api_key=api_key))
+
+# COACH_NOVA_LM_MODE=record/replay records the session or replays it offline, as in
+# coach-app (see ../coach-app/replay_lm.py)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "coach-app"))
+from replay_lm import lm_from_env, print_replay_stats
+
+lm = lm_from_env(lambda: dspy.LM("gemini/gemini-2.5-flash", api_key=api_key), name="quick-start")
+dspy.configure(lm=lm)
 
 
 class GatherUserInfo(dspy.Signature):
@@ -35,3 +43,4 @@ while True:
     history.messages.append({"question": question, **outputs})
 
 dspy.inspect_history()
+print_replay_stats(lm)